@@ -0,0 +1,163 @@
+"""Constant memory summaries of the audit event stream.
+
+An EventAggregator consumes event rows one at a time and keeps only
+rolling aggregates: event counts with first and last timestamps in total
+and per event type, event counts per hour, and the busiest apps and users.
+Event types and hours are few, so they are counted exactly.  Apps and
+users can be numerous, so they are tracked with the Space-Saving
+algorithm, which keeps a fixed number of counters and reports the heavy
+hitters with a bound on how much each count may be overestimated.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+
+
+class SpaceSaving(object):
+    """Approximate top-N counter in a fixed number of counters.
+
+    When a new key arrives and every counter is taken, the key with the
+    smallest count is replaced and the newcomer inherits that count as its
+    possible overestimation (``error``).  Keys whose true count exceeds
+    total / capacity are guaranteed to be tracked.  Counters are kept in
+    buckets by count, so every update is O(1).
+
+    Keyword Args:
+        capacity (Optional[int]): Number of counters.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        self._buckets = {}
+        self._min = 0
+
+    def add(self, key):
+        """Count one occurrence of key."""
+        self.total += 1
+        count = self._counts.get(key)
+        if count is None:
+            if len(self._counts) < self.capacity:
+                count = 0
+                self._errors[key] = 0
+                self._min = 0
+            else:
+                count = self._min
+                evicted = self._buckets[count].pop()
+                if not self._buckets[count]:
+                    del self._buckets[count]
+                del self._counts[evicted]
+                del self._errors[evicted]
+                self._errors[key] = count
+        else:
+            bucket = self._buckets[count]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[count]
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, set()).add(key)
+        # Counts grow by one, so an emptied minimum bucket moves the
+        # minimum to the key just incremented.
+        if self._min not in self._buckets:
+            self._min = count + 1
+
+    def top(self, n):
+        """Return the n keys with the highest counts.
+
+        Args:
+            n (int): Number of keys.
+
+        Returns:
+            list(tuple): ``(key, count, error)`` tuples, highest count first.
+                The true count lies between count - error and count.
+        """
+        keys = sorted(self._counts, key=lambda k: (-self._counts[k], k))[:n]
+        return [(k, self._counts[k], self._errors[k]) for k in keys]
+
+
+class EventAggregator(object):
+    """Rolling summary of app event rows.
+
+    Keyword Args:
+        top (Optional[int]): Number of apps and users reported.
+        capacity (Optional[int]): Space-Saving counters kept for apps and
+            for users.
+    """
+
+    def __init__(self, top=20, capacity=1000):
+        self.top = top
+        self.events = 0
+        self.first = None
+        self.last = None
+        self.types = {}
+        self.hours = {}
+        self.apps = SpaceSaving(capacity)
+        self.users = SpaceSaving(capacity)
+
+    def add(self, timestamp, event_type, app, user):
+        """Count one event.
+
+        Args:
+            timestamp (str): The v2 timestamp, e.g. ``2026-10-18T09:15:00Z``.
+            event_type (str): The event type, e.g. ``audit.app.update``.
+            app (str): A name identifying the app.
+            user (str): The actor name.
+        """
+        self.events += 1
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if self.last is None or timestamp > self.last:
+            self.last = timestamp
+        stats = self.types.get(event_type)
+        if stats is None:
+            self.types[event_type] = [1, timestamp, timestamp]
+        else:
+            stats[0] += 1
+            stats[1] = min(stats[1], timestamp)
+            stats[2] = max(stats[2], timestamp)
+        hour = timestamp[:13]
+        self.hours[hour] = self.hours.get(hour, 0) + 1
+        self.apps.add(app)
+        self.users.add(user)
+
+    def add_row(self, row):
+        """Count one report event row, see cfoperations.event_row."""
+        keys = ('orgname', 'spacename', 'name')
+        if row.get('foundation'):
+            keys = ('foundation',) + keys
+        app = u'/'.join(u'{0}'.format(row[k]) for k in keys)
+        self.add(row['time'], row['event'], app, row['user'])
+
+    def summary(self):
+        """Return the aggregates as a JSON serializable dict."""
+        def top(counter):
+            return [{'name': k, 'events': c, 'overcount': e} for k, c, e in counter.top(self.top)]
+
+        return {
+            'events': self.events,
+            'first': self.first,
+            'last': self.last,
+            'types': dict((t, {'events': s[0], 'first': s[1], 'last': s[2]})
+                          for t, s in self.types.items()),
+            'hours': dict(self.hours),
+            'top_apps': top(self.apps),
+            'top_users': top(self.users),
+        }
+
+    def rows(self):
+        """Return the aggregates as sheet rows.
+
+        Returns:
+            list(tuple): ``(section, key, events, first, last, overcount)``
+                rows, first and last are None where they are not tracked.
+        """
+        rows = [('total', '', self.events, self.first, self.last, 0)]
+        rows += [('event type', t, s[0], s[1], s[2], 0) for t, s in sorted(self.types.items())]
+        rows += [('hour', h, c, None, None, 0) for h, c in sorted(self.hours.items())]
+        rows += [('app', k, c, None, None, e) for k, c, e in self.apps.top(self.top)]
+        rows += [('user', k, c, None, None, e) for k, c, e in self.users.top(self.top)]
+        return rows
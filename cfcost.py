@@ -0,0 +1,153 @@
+"""Crawl cost history and largest-first scheduling.
+
+Every report run records what each org and space cost to crawl: the
+requests sent, the seconds spent and the resources found.  The next run
+starts the most expensive units first (longest processing time first), so
+a huge org is not picked up last by an otherwise idle pool of workers and
+does not alone set the run time.  Orgs without history are estimated from
+their resource counts, see CostHistory.estimate.
+
+The history is a JSON file keyed by API host::
+
+    {"version": 1, "foundations": {"<api host>": {
+        "orgs": {"<org>": {"requests": 12, "seconds": 3.5, "resources": 80}},
+        "spaces": {"<org>/<space>": {"resources": 20, "seconds": 0.4}}}}}
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+import json
+import os
+import threading
+
+
+def lpt_order(items, cost):
+    """Order work items longest processing time first.
+
+    Args:
+        items (iterable): The work items.
+        cost (callable): Returns the estimated cost of an item.
+
+    Returns:
+        list: The items, most expensive first.  Items of equal cost keep
+            their order.
+    """
+    return sorted(items, key=lambda item: -(cost(item) or 0))
+
+
+class CostHistory(object):
+    """Per-org and per-space crawl costs of previous runs.
+
+    Keyword Args:
+        filename (Optional[str]): The history file written by save.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.foundations = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filename):
+        """Read a history file, a missing file is an empty history.
+
+        Args:
+            filename (str): The history file.
+
+        Returns:
+            CostHistory: The history.
+        """
+        history = cls(filename)
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                history.foundations = json.load(f).get('foundations', {})
+        return history
+
+    def save(self, filename=None):
+        """Write the history.
+
+        Keyword Args:
+            filename (Optional[str]): The file, replaced atomically.
+                Defaults to the file the history was loaded from.
+        """
+        filename = filename or self.filename
+        with self._lock:
+            data = json.dumps({'version': 1, 'foundations': self.foundations}, sort_keys=True)
+        tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.rename(tmp, filename)
+
+    def _foundation(self, key):
+        return self.foundations.setdefault(key, {'orgs': {}, 'spaces': {}})
+
+    def record(self, key, cost):
+        """Store the measured cost of an org and its spaces.
+
+        Args:
+            key (str): The foundation, its API host.
+            cost (dict): ``org``, ``requests``, ``seconds``, ``resources``
+                and ``spaces``, space names to dicts of ``resources`` and,
+                when measured, ``seconds``.
+        """
+        with self._lock:
+            foundation = self._foundation(key)
+            foundation['orgs'][cost['org']] = dict(
+                (k, cost[k]) for k in ('requests', 'seconds', 'resources'))
+            for space, space_cost in cost.get('spaces', {}).items():
+                foundation['spaces']['{0}/{1}'.format(cost['org'], space)] = space_cost
+
+    def org_seconds(self, key, org):
+        """Return the seconds an org took last time, or None."""
+        with self._lock:
+            return self.foundations.get(key, {}).get('orgs', {}).get(org, {}).get('seconds')
+
+    def space_seconds(self, key, org, space):
+        """Return the seconds a space took last time, or None."""
+        with self._lock:
+            spaces = self.foundations.get(key, {}).get('spaces', {})
+            return spaces.get('{0}/{1}'.format(org, space), {}).get('seconds')
+
+    def seconds_per_resource(self, key):
+        """Return the average crawl seconds per resource of a foundation.
+
+        Returns:
+            float: The rate, 1.0 when there is no history to derive it from.
+        """
+        with self._lock:
+            orgs = self.foundations.get(key, {}).get('orgs', {}).values()
+            seconds = sum(o['seconds'] for o in orgs if o.get('resources'))
+            resources = sum(o['resources'] for o in orgs if o.get('resources'))
+        return seconds / resources if resources and seconds else 1.0
+
+    def estimate(self, key, orgs, probe):
+        """Estimate the crawl seconds of orgs.
+
+        Orgs crawled before cost what they cost last time.  The others are
+        sized by probe and converted to seconds with the foundation's
+        seconds_per_resource.
+
+        Args:
+            key (str): The foundation, its API host.
+            orgs (list(str)): The org names.
+            probe (callable): Called with the orgs without history, returns
+                a dict of org names to resource counts.
+
+        Returns:
+            dict: Org names to estimated seconds.
+        """
+        costs = {}
+        unknown = []
+        for org in orgs:
+            seconds = self.org_seconds(key, org)
+            if seconds is None:
+                unknown.append(org)
+            else:
+                costs[org] = seconds
+        if unknown:
+            rate = self.seconds_per_resource(key)
+            for org, resources in probe(unknown).items():
+                costs[org] = resources * rate
+        return costs
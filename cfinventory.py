@@ -0,0 +1,417 @@
+"""In-memory inventory of a Cloud Foundry foundation.
+
+The inventory holds compact records (see cfrecords) of every org, space,
+app, managed service instance and user-provided service instance keyed by
+GUID.  It is filled by one full crawl and can then be kept fresh by
+applying audit events as deltas, so reports can be produced from memory
+instead of re-crawling the foundation.  Saved as a snapshot file it also
+lets the next run re-crawl only the spaces that changed in between.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+import itertools
+import json
+import os
+import threading
+import urllib2
+from collections import deque
+from time import time, gmtime, strftime
+from cfrecords import Org, Space, App, ServiceInstance, UserProvidedService
+
+# Inventory collection name to record class, v2 collection path and the
+# CfApi method listing it.
+KINDS = (
+    ('orgs', Org, '/v2/organizations', 'orgs'),
+    ('spaces', Space, '/v2/spaces', 'spaces'),
+    ('apps', App, '/v2/apps', 'apps'),
+    ('services', ServiceInstance, '/v2/service_instances',
+     'service_instances'),
+    ('user_provided_services', UserProvidedService,
+     '/v2/user_provided_service_instances',
+     'user_provided_service_instances'),
+)
+
+# Version numbers shared by every inventory, see Inventory.versions.
+_VERSIONS = itertools.count(1)
+
+# Audit event actee types to the inventory collection they change.
+EVENT_KINDS = {
+    'organization': 'orgs',
+    'space': 'spaces',
+    'app': 'apps',
+    'service_instance': 'services',
+    'user_provided_service_instance': 'user_provided_services',
+}
+
+
+def iso_timestamp(epoch):
+    """Format epoch seconds the way the v2 API formats timestamps."""
+    return strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(epoch))
+
+
+def is_delete_event(event_type):
+    """Tell whether an audit event type removes its actee."""
+    return event_type.endswith('.delete') or event_type.endswith('.delete-request')
+
+
+# Collections whose records belong to a space, re-listed per dirty space
+# by Inventory.refresh.
+SPACE_KINDS = ('apps', 'services', 'user_provided_services')
+
+
+class Inventory(object):
+    """GUID indexed records of one foundation.
+
+    Keyword Args:
+        max_events (Optional[int]): Number of recent audit events kept in
+            memory.  Defaults to 10000.
+
+    Attributes:
+        versions (dict): Collection names to a number that changes
+            whenever the collection does, unique across inventories.
+    """
+
+    def __init__(self, max_events=10000):
+        self.orgs = {}
+        self.spaces = {}
+        self.apps = {}
+        self.services = {}
+        self.user_provided_services = {}
+        self.events = deque(maxlen=max_events)
+        self.crawled_at = None
+        self.updated_at = None
+        self.lock = threading.RLock()
+        self.versions = {}
+        self._changed(*[kind for kind, _, _, _ in KINDS])
+
+    def collection(self, kind):
+        """Return the GUID to record dict of a collection."""
+        return getattr(self, kind)
+
+    def _changed(self, *kinds):
+        for kind in kinds:
+            self.versions[kind] = next(_VERSIONS)
+
+    def load(self, api):
+        """Replace the contents with a full crawl of the foundation.
+
+        Every collection is listed foundation-wide once, the listings run
+        concurrently.
+
+        Args:
+            api (CfApi): The API instance to crawl with.
+        """
+        started = time()
+        listings = api.map_concurrent(
+            lambda kind: getattr(api, kind[3])(
+                filters={'results-per-page': 100}, records=True),
+            KINDS)
+        with self.lock:
+            for (kind, _, _, _), records in zip(KINDS, listings):
+                setattr(self, kind, dict((r.guid, r) for r in records))
+                self._changed(kind)
+            self.crawled_at = started
+            self.updated_at = started
+
+    def refresh(self, api, max_age=7 * 86400):
+        """Bring the records up to date by re-crawling only dirty spaces.
+
+        Orgs and spaces are always listed in full, which is cheap.  A
+        space is dirty when it is new, its updated_at changed, or an audit
+        event since the last crawl names it.  The apps and services of
+        dirty spaces are re-listed with batched ``space_guid IN`` queries,
+        records of every other space are kept as they are.  Without a
+        previous crawl, or when it is older than max_age, everything is
+        crawled.
+
+        Args:
+            api (CfApi): The API instance to crawl with.
+
+        Keyword Args:
+            max_age (Optional[float]): Seconds after which a full crawl is
+                done instead, must stay within the audit event retention of
+                the foundation.
+
+        Returns:
+            int: The number of spaces re-crawled, None after a full crawl.
+        """
+        started = time()
+        if self.crawled_at is None or started - self.crawled_at > max_age:
+            self.load(api)
+            return None
+        orgs, spaces = api.map_concurrent(
+            lambda kind: getattr(api, kind[3])(
+                filters={'results-per-page': 100}, records=True),
+            KINDS[:2])
+        spaces = dict((r.guid, r) for r in spaces)
+        with self.lock:
+            previous = dict((g, s.updated_at) for g, s in self.spaces.items())
+        dirty = set(g for g, s in spaces.items()
+                    if g not in previous or previous[g] != s.updated_at)
+        since = int(self.crawled_at)
+        for events in api.events_by_window(since, int(started) + 1, records=True):
+            for event in events:
+                if event.space_guid:
+                    dirty.add(event.space_guid)
+                    continue
+                # Events without a space, find the space of a known actee.
+                kind = EVENT_KINDS.get(event.actee_type)
+                record = self.collection(kind).get(event.actee) if kind in SPACE_KINDS else None
+                if record is not None:
+                    dirty.add(record.space_guid)
+        dirty &= set(spaces)
+        paths = dict((kind, (cls, path)) for kind, cls, path, _ in KINDS)
+        listings = api.map_concurrent(
+            lambda kind: api.resources_in(paths[kind][1], 'space_guid', dirty, paths[kind][0]),
+            SPACE_KINDS if dirty else ())
+        with self.lock:
+            self.orgs = dict((r.guid, r) for r in orgs)
+            self.spaces = spaces
+            for kind in SPACE_KINDS:
+                setattr(self, kind, dict(
+                    (g, r) for g, r in self.collection(kind).items()
+                    if r.space_guid in spaces and r.space_guid not in dirty))
+            for kind, records in zip(SPACE_KINDS, listings):
+                self.collection(kind).update((r.guid, r) for r in records)
+            self._changed('orgs', 'spaces', *SPACE_KINDS)
+            self.crawled_at = started
+            self.updated_at = started
+        return len(dirty)
+
+    def save(self, filename):
+        """Write the records to a JSON snapshot file.
+
+        Args:
+            filename (str): The snapshot file, replaced atomically.
+        """
+        with self.lock:
+            snapshot = {'crawled_at': self.crawled_at, 'updated_at': self.updated_at}
+            for kind, _, _, _ in KINDS:
+                snapshot[kind] = [r.to_dict() for r in self.collection(kind).values()]
+        tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(tmp, filename)
+
+    @classmethod
+    def from_snapshot(cls, filename, max_events=10000):
+        """Load an inventory saved with save.
+
+        Args:
+            filename (str): The snapshot file.
+
+        Keyword Args:
+            max_events (Optional[int]): See Inventory.
+
+        Returns:
+            Inventory: The inventory, without event history.
+        """
+        with open(filename) as f:
+            snapshot = json.load(f)
+        inventory = cls(max_events)
+        for kind, record_cls, _, _ in KINDS:
+            setattr(inventory, kind, dict(
+                (values['guid'], record_cls(**values)) for values in snapshot.get(kind, [])))
+        inventory.crawled_at = snapshot.get('crawled_at')
+        inventory.updated_at = snapshot.get('updated_at')
+        return inventory
+
+    def upsert(self, kind, record):
+        """Add or replace a record."""
+        with self.lock:
+            self.collection(kind)[record.guid] = record
+            self._changed(kind)
+            self.updated_at = time()
+
+    def remove(self, kind, guid):
+        """Remove a record, missing records are ignored."""
+        with self.lock:
+            if self.collection(kind).pop(guid, None) is not None:
+                self._changed(kind)
+            self.updated_at = time()
+
+    def apply_events(self, api, events):
+        """Apply audit events as deltas.
+
+        Delete events drop their actee, every other event of a tracked
+        actee type refetches the actee once, however many events reference
+        it.
+
+        Args:
+            api (CfApi): The API instance used to refetch changed resources.
+            events (list(Event)): Audit events in timestamp order.
+
+        Returns:
+            int: The number of records changed.
+        """
+        self.record_events(events)
+        latest = {}
+        for event in events:
+            kind = EVENT_KINDS.get(event.actee_type)
+            if kind is not None and event.actee:
+                latest[(kind, event.actee)] = event.type
+        deleted = [k for k, t in latest.items() if is_delete_event(t)]
+        changed = [k for k, t in latest.items() if not is_delete_event(t)]
+        for kind, guid in deleted:
+            self.remove(kind, guid)
+        paths = dict((kind, (cls, path)) for kind, cls, path, _ in KINDS)
+
+        def refetch(key):
+            kind, guid = key
+            cls, path = paths[kind]
+            try:
+                resource = api.get_generic_request('{0}/{1}'.format(path, guid))
+            except urllib2.HTTPError as e:
+                if e.code == 404:
+                    return kind, guid, None
+                raise
+            return kind, guid, cls.from_resource(resource)
+
+        for kind, guid, record in api.map_concurrent(refetch, changed):
+            if record is None:
+                self.remove(kind, guid)
+            else:
+                self.upsert(kind, record)
+        return len(deleted) + len(changed)
+
+    def record_events(self, events):
+        """Keep audit events as recent history without applying them."""
+        with self.lock:
+            self.events.extend(events)
+
+    def report_rows(self, foundation=''):
+        """Build report rows from memory.
+
+        Returns:
+            dict: 'spaces', 'apps', 'services' and 'events' rows in the
+                shape produced by cfoperations.collect_report.
+        """
+        with self.lock:
+            orgs = dict((g, o.name) for g, o in self.orgs.items())
+            spaces = dict((g, (orgs.get(s.organization_guid), s.name))
+                          for g, s in self.spaces.items())
+            report = {'spaces': [], 'apps': [], 'services': [], 'events': []}
+            for guid, (orgname, spacename) in spaces.items():
+                report['spaces'].append({'foundation': foundation, 'orgname': orgname,
+                                         'spacename': spacename, 'spaceguid': guid})
+            for a in self.apps.values():
+                orgname, spacename = spaces.get(a.space_guid, (None, None))
+                report['apps'].append({'foundation': foundation, 'orgname': orgname,
+                                       'spacename': spacename, 'name': a.name,
+                                       'state': a.state, 'date': a.updated_at})
+            for s in self.services.values():
+                orgname, spacename = spaces.get(s.space_guid, (None, None))
+                report['services'].append({'foundation': foundation, 'orgname': orgname,
+                                           'spacename': spacename, 'name': s.name,
+                                           'date': s.last_operation_created_at})
+            for s in self.user_provided_services.values():
+                orgname, spacename = spaces.get(s.space_guid, (None, None))
+                report['services'].append({'foundation': foundation, 'orgname': orgname,
+                                           'spacename': spacename, 'name': s.name,
+                                           'date': s.created_at})
+            for e in self.events:
+                orgname, spacename = spaces.get(e.space_guid, (orgs.get(e.organization_guid), None))
+                report['events'].append({'foundation': foundation, 'orgname': orgname,
+                                         'spacename': spacename, 'name': e.actee_name,
+                                         'user': e.actor_name, 'event': e.type,
+                                         'time': e.timestamp})
+        return report
+
+
+class InventoryWatcher(object):
+    """Keeps an Inventory fresh by polling audit events.
+
+    After one full crawl the watcher polls ``/v2/events`` for events newer
+    than the last one seen and applies them as deltas.  A full
+    reconciliation crawl runs periodically to catch anything the event
+    stream missed.
+
+    Args:
+        api (CfApi): The API instance to use.
+
+    Keyword Args:
+        inventory (Optional[Inventory]): The inventory to maintain.
+        poll_interval (Optional[float]): Seconds between event polls.
+        reconcile_interval (Optional[float]): Seconds between full crawls.
+        event_backlog (Optional[float]): Seconds of audit events loaded
+            into the event history by the first crawl.
+    """
+
+    def __init__(self, api, inventory=None, poll_interval=30,
+                 reconcile_interval=3600, event_backlog=0):
+        self.api = api
+        self.inventory = inventory if inventory is not None else Inventory()
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.event_backlog = event_backlog
+        self._since = None
+        self._seen = set()
+        self._reconciled_at = 0
+
+    def reconcile(self):
+        """Run a full crawl and move the event cursor to its start time."""
+        started = time()
+        if self._since is None and self.event_backlog:
+            filters = {'q': 'timestamp>={0}'.format(iso_timestamp(started - self.event_backlog)),
+                       'order-direction': 'asc', 'results-per-page': 100}
+            self.inventory.record_events(self.api.events(filters=filters, records=True))
+        self.inventory.load(self.api)
+        self._since = iso_timestamp(started)
+        self._seen = set()
+        self._reconciled_at = started
+
+    def poll(self):
+        """Fetch and apply events newer than the last poll.
+
+        Returns:
+            int: The number of records changed.
+        """
+        if self._since is None:
+            self.reconcile()
+        filters = {'q': 'timestamp>={0}'.format(self._since),
+                   'order-direction': 'asc', 'results-per-page': 100}
+        events = [e for e in self.api.events(filters=filters, records=True)
+                  if e.guid not in self._seen]
+        if not events:
+            return 0
+        last = events[-1].timestamp
+        # Timestamps have a one second resolution, remember the events of
+        # the last second so the next >= query does not apply them twice.
+        # Polls within the same second add to what was already seen.
+        new = set(e.guid for e in events if e.timestamp == last)
+        if last == self._since:
+            self._seen |= new
+        else:
+            self._seen = new
+        self._since = last
+        return self.inventory.apply_events(self.api, events)
+
+    def tick(self):
+        """Reconcile when due, poll otherwise.
+
+        Returns:
+            int: The number of records changed by a poll, 0 after a
+                reconciliation.
+        """
+        if time() - self._reconciled_at >= self.reconcile_interval:
+            self.reconcile()
+            return 0
+        return self.poll()
+
+    def run(self, stop=None, on_tick=None):
+        """Poll until stop is set.
+
+        Keyword Args:
+            stop (Optional[threading.Event]): Set to end the loop.
+            on_tick (Optional[callable]): Called with the watcher after
+                every tick.
+        """
+        stop = stop if stop is not None else threading.Event()
+        while not stop.is_set():
+            self.tick()
+            if on_tick is not None:
+                on_tick(self)
+            stop.wait(self.poll_interval)
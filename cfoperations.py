@@ -8,16 +8,35 @@ Cf Services (Managed Services and User Provided Services) details in all cf orga
 This script has option for delete particular space and given application & application bind services.
 
 """
+from time import time, sleep
+# Wall clock time the module started importing, see check_startup.
+STARTED = time()
 import argparse
+import calendar
 import datetime
-import xlsxwriter
 from os import path
 import sys
 import getpass
-from cloudfoundryapi import CfApi
+import os
+import signal
+import socket
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from cloudfoundryapi import CfSession, RequestCounter
+from cfprofiler import ApiProfiler
 import json
-import yaml
+import re
 
+# Seconds a subcommand may spend importing and parsing arguments before it
+# starts working.  Cron and CI call the tool many times a day, so heavy
+# modules are imported and input.yaml is read only by the commands that
+# need them.
+STARTUP_BUDGET = 0.15
+
+# Modules that must not be imported before a command needs them.
+HEAVY_MODULES = ('yaml', 'xlsxwriter', 'numpy', 'cfreport', 'cfinventory', 'cfquery', 'cfshard',
+                 'cfprovision', 'cfpipeline', 'cfaggregate', 'cfcost', 'cfsearch')
 
 # Cloud Foundry API host
 API_HOST = '<< Cloud foundry API Host >>'
@@ -25,45 +44,482 @@ API_HOST = '<< Cloud foundry API Host >>'
 # Cloud Foundry Login Host
 LOGIN_HOST = '<< Cloud Foundry Login Host >>'
 
+# Extra CfApi options shared by every CfApi: the transport selected with
+# --record-api or --replay-api, timeouts and hedging.
+API_OPTIONS = {}
+
+# CfSessions by API host and user, shared by every CfApi of a run.
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
 DATE = str(datetime.date.today())
 today = datetime.date.today()
 YDate = str(today - datetime.timedelta(days=1))
 
 
-def parse_args():
+COMMANDS = ('report', 'events', 'env', 'teardown', 'provision', 'lookup', 'watch', 'serve',
+            'shard-worker', 'check-startup')
+
+
+def parse_args(argv=None):
     """Parse command line args.
 
-    Simple function to parse and return command line args.
+    Simple function to parse and return command line args.  Every
+    subcommand stores its handler in ``func``.  Without a subcommand the
+    report is run, as before subcommands existed.
+
+    Keyword Args:
+        argv (Optional[list(str)]): The arguments, sys.argv[1:] by default.
 
     Returns:
         argparse.Namespace: An argparse.Namespace object.
     """
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-cfUsername',
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not any(a in COMMANDS or a in ('-h', '--help') for a in argv):
+        argv.insert(0, 'report')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-cfUsername',
                         dest='cfUsername',
                         default=None,
                         required=True,
                         help='Provide Cloud Foundry User Name')
-    parser.add_argument('-SDate',
-                        dest='StartDate',
+    common.add_argument('--profile-api',
+                        dest='ProfileApi',
+                        nargs='?',
+                        const='-',
                         default=None,
                         required=False,
-                        help='Enter start date to fetch events. Format YYYY-MM-DD')
-    parser.add_argument('-EDate',
-                        dest='EndDate',
+                        help='Record every API call with its call site and report '
+                             'batching/caching opportunities to the given file '
+                             '(stderr when no file is given)')
+    common.add_argument('--record-api',
+                        dest='RecordApi',
                         default=None,
                         required=False,
-                        help='Enter End date to fetch events. Format YYYY-MM-DD')
-    args = parser.parse_args()
+                        help='Save every API request and response, secrets redacted, to this '
+                             'cassette file for offline replay')
+    common.add_argument('--replay-api',
+                        dest='ReplayApi',
+                        default=None,
+                        required=False,
+                        help='Answer API requests from this cassette file instead of the foundation')
+    common.add_argument('--replay-latency',
+                        dest='ReplayLatency',
+                        type=float,
+                        default=None,
+                        required=False,
+                        help='With --replay-api, sleep for the recorded latency times this factor '
+                             '(1 replays at recorded speed)')
+    common.add_argument('-ConnectTimeout',
+                        dest='ConnectTimeout',
+                        type=float,
+                        default=10,
+                        required=False,
+                        help='Seconds to wait for a connection to the API')
+    common.add_argument('-ReadTimeout',
+                        dest='ReadTimeout',
+                        type=float,
+                        default=120,
+                        required=False,
+                        help='Seconds to wait for each read of an API response')
+    common.add_argument('--hedge-api',
+                        dest='HedgeApi',
+                        nargs='?',
+                        type=float,
+                        const=0.05,
+                        default=None,
+                        required=False,
+                        help='Resend GETs running past the p95 latency of their endpoint and use the '
+                             'first response, adding at most this fraction of extra requests (0.05)')
+    common.add_argument('--http2-api',
+                        dest='Http2Api',
+                        nargs='?',
+                        type=int,
+                        const=100,
+                        default=None,
+                        required=False,
+                        help='Multiplex API requests over a few HTTP/2 connections, at most this '
+                             'many requests in flight per connection (100).  Needs hyper')
+    common.add_argument('-Http2Connections',
+                        dest='Http2Connections',
+                        type=int,
+                        default=2,
+                        required=False,
+                        help='With --http2-api, HTTP/2 connections opened per API host')
+    dates = argparse.ArgumentParser(add_help=False)
+    dates.add_argument('-SDate',
+                       dest='StartDate',
+                       default=None,
+                       required=False,
+                       help='Enter start date to fetch events. Format YYYY-MM-DD')
+    dates.add_argument('-EDate',
+                       dest='EndDate',
+                       default=None,
+                       required=False,
+                       help='Enter End date to fetch events. Format YYYY-MM-DD')
+    polling = argparse.ArgumentParser(add_help=False)
+    polling.add_argument('-PollInterval',
+                         dest='PollInterval',
+                         type=float,
+                         default=30,
+                         required=False,
+                         help='seconds between /v2/events polls')
+    polling.add_argument('-ReconcileInterval',
+                         dest='ReconcileInterval',
+                         type=float,
+                         default=3600,
+                         required=False,
+                         help='seconds between full reconciliation crawls')
+    foundation = argparse.ArgumentParser(add_help=False)
+    foundation.add_argument('-Foundation',
+                            dest='Foundation',
+                            default=None,
+                            required=False,
+                            help='name of the foundation to use when several are configured')
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+
+    report = commands.add_parser('report', parents=[common, dates],
+                                 help='crawl every foundation once and write the workbook')
+    report.add_argument('-Shards',
+                        dest='Shards',
+                        type=int,
+                        default=0,
+                        required=False,
+                        help='crawl orgs in this many local worker processes')
+    report.add_argument('-ShardQueue',
+                        dest='ShardQueue',
+                        default=None,
+                        required=False,
+                        help='hand org shards to shard-worker processes through this shared directory')
+    report.add_argument('-ShardSize',
+                        dest='ShardSize',
+                        type=int,
+                        default=1,
+                        required=False,
+                        help='orgs per shard')
+    report.add_argument('-SpaceSummary',
+                        dest='SpaceSummary',
+                        action='store_true',
+                        help='crawl apps and services with one /v2/spaces/:guid/summary request per space, '
+                             'application durations are then measured from the last package upload')
+    report.add_argument('-Snapshot',
+                        dest='Snapshot',
+                        default=None,
+                        required=False,
+                        help='incremental report: re-crawl only the spaces changed since the run that '
+                             'wrote this snapshot file and carry the rest forward (sharding is not used)')
+    report.add_argument('-PipelineDepth',
+                        dest='PipelineDepth',
+                        type=int,
+                        default=16,
+                        required=False,
+                        help='org reports and event chunks crawled ahead of the workbook writer per '
+                             'foundation, bounds memory (not used with sharding or -Snapshot)')
+    report.add_argument('-CostHistory',
+                        dest='CostHistory',
+                        default='cfcosts.json',
+                        required=False,
+                        help='file keeping the per-org and per-space crawl costs of each run, used to '
+                             'crawl the most expensive orgs first (empty to disable)')
+    report.add_argument('-EventSummary',
+                        dest='EventSummary',
+                        action='store_true',
+                        help='add an Event Summary sheet with event counts per type and hour and the '
+                             'busiest apps and users')
+    report.add_argument('-NoEventRows',
+                        dest='EventRows',
+                        action='store_false',
+                        help='leave out the App Events sheet with one row per event')
+    report.set_defaults(func=command_report)
+
+    events = commands.add_parser('events', parents=[common, dates],
+                                 help='export the audit events of a date range as JSON lines')
+    events.add_argument('-Output',
+                        dest='Output',
+                        default=None,
+                        required=False,
+                        help='file to write the event rows to, stdout by default unless -Summary is given')
+    events.add_argument('-Summary',
+                        dest='Summary',
+                        default=None,
+                        required=False,
+                        help='write event counts per type and hour and the busiest apps and users as '
+                             'JSON to this file (- for stdout), in constant memory')
+    events.add_argument('-Top',
+                        dest='Top',
+                        type=int,
+                        default=20,
+                        required=False,
+                        help='apps and users listed in the summary')
+    events.set_defaults(func=command_events)
+
+    env = commands.add_parser('env', parents=[common],
+                              help='save the service credentials of the input.yaml applications '
+                                   'to tempcreds.txt')
+    env.set_defaults(func=command_env)
+
+    teardown = commands.add_parser('teardown', parents=[common],
+                                   help='delete the input.yaml applications and their bound services')
+    teardown.add_argument('-DeleteSpace',
+                          dest='DeleteSpace',
+                          action='store_true',
+                          help='delete the cf_space_name space instead')
+    teardown.set_defaults(func=command_teardown)
+
+    provision = commands.add_parser('provision', parents=[common],
+                                    help='create the PROVISION apps, services and bindings of input.yaml '
+                                         'in the cf_space_name space')
+    provision.add_argument('-PollInterval',
+                           dest='PollInterval',
+                           type=float,
+                           default=5,
+                           required=False,
+                           help='seconds between polls of service instances still being created')
+    provision.add_argument('-ProvisionTimeout',
+                           dest='ProvisionTimeout',
+                           type=float,
+                           default=1800,
+                           required=False,
+                           help='seconds to wait for a service instance to be created')
+    provision.set_defaults(func=command_provision)
+
+    lookup = commands.add_parser('lookup', parents=[common, foundation],
+                                 help='find orgs, spaces, apps and services by name')
+    lookup.add_argument('name',
+                        help='the name, name prefix, substring or regular expression to look for')
+    lookup.add_argument('-Kind',
+                        dest='Kind',
+                        action='append',
+                        choices=[k for k, _ in LOOKUP_KINDS],
+                        default=None,
+                        required=False,
+                        help='only look up this kind of resource, may be repeated')
+    lookup.add_argument('-Match',
+                        dest='Match',
+                        choices=['exact', 'prefix', 'substring', 'regex'],
+                        default='exact',
+                        required=False,
+                        help='how name matches; anything but exact searches a local index')
+    lookup.add_argument('-Org',
+                        dest='Org',
+                        default=None,
+                        required=False,
+                        help='only resources of this org (local index)')
+    lookup.add_argument('-Space',
+                        dest='Space',
+                        default=None,
+                        required=False,
+                        help='only resources of spaces with this name (local index)')
+    lookup.add_argument('-Label',
+                        dest='Label',
+                        default=None,
+                        required=False,
+                        help='only service instances of this service, e.g. hsdp-rds (local index)')
+    lookup.add_argument('-BoundTo',
+                        dest='BoundTo',
+                        default=None,
+                        required=False,
+                        help='only apps bound to the service instance, or instances bound to the '
+                             'app, with this name (local index)')
+    lookup.add_argument('-Index',
+                        dest='Index',
+                        default=None,
+                        required=False,
+                        help='build the local index from this inventory snapshot (see report '
+                             '-Snapshot), re-crawling only the spaces changed since it was written')
+    lookup.add_argument('-Offline',
+                        dest='Offline',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help='search the -Index snapshot as it is, without API requests')
+    lookup.set_defaults(func=command_lookup)
+
+    watch = commands.add_parser('watch', parents=[common, polling],
+                                help='crawl once, keep the inventory fresh from /v2/events and write '
+                                     'the workbook from memory on SIGUSR1')
+    watch.set_defaults(func=command_watch)
+
+    serve = commands.add_parser('serve', parents=[common, polling, foundation],
+                                help='like watch, and answer v2 style inventory queries from memory')
+    serve.add_argument('-ServeAddress',
+                       dest='ServeAddress',
+                       default='127.0.0.1:8080',
+                       required=False,
+                       help='host:port to listen on, or a Unix socket path')
+    serve.set_defaults(func=command_serve)
+
+    worker = commands.add_parser('shard-worker', parents=[common],
+                                 help='crawl report shards from a shared queue directory')
+    worker.add_argument('-ShardQueue',
+                        dest='ShardQueue',
+                        default=None,
+                        required=True,
+                        help='the queue directory to consume')
+    worker.set_defaults(func=command_shard_worker)
+
+    check = commands.add_parser('check-startup',
+                                help='fail when startup exceeds its time budget or imports heavy modules')
+    check.set_defaults(func=check_startup, ProfileApi=None, RecordApi=None, ReplayApi=None)
+
+    args = parser.parse_args(argv)
     return args
 
 
-def cfapi_login(username, password):
+def api_session(api_host, login_host, username, password, profiler=None, max_workers=8):
+    """Return the CfSession of a foundation and user, created on first use.
+
+    Every client of the foundation, foundation-wide or scoped to an org and
+    space, shares its login, connections and lookups.
+    """
+    with SESSIONS_LOCK:
+        session = SESSIONS.get((api_host, username))
+        if session is None:
+            session = SESSIONS[(api_host, username)] = CfSession(
+                username=username, password=password, login_host=login_host, api_host=api_host,
+                max_workers=max_workers, profiler=profiler, **API_OPTIONS)
+    return session
+
+
+def cfapi_login(username, password, profiler=None):
     global cfapi
-    cfapi = CfApi(username=username, password=password, login_host=LOGIN_HOST, api_host=API_HOST)
+    cfapi = api_session(API_HOST, LOGIN_HOST, username, password, profiler).scope()
     return cfapi
 
 
+def load_foundations():
+    """Return the foundations to report on.
+
+    Foundations come from the FOUNDATIONS section of input.yaml, the
+    API_HOST/LOGIN_HOST pair is used when none are configured.
+    """
+    foundations = load_input().get('FOUNDATIONS') or []
+    if not foundations:
+        return [{'name': '', 'api_host': API_HOST, 'login_host': LOGIN_HOST}]
+    return foundations
+
+
+def crawl_foundation(foundation, username, password, sdate, edate, profiler=None, sharding=None,
+                     snapshot=None, space_summary=False, history=None):
+    """Crawl a single foundation with its CfSession, token and worker budget.
+
+    With sharding the org-level work is split into shards run on a local
+    process pool or a shared work queue, see crawl_sharded.  With a
+    snapshot file only the spaces changed since the last run are
+    re-crawled, see collect_incremental_report.  With space_summary the
+    orgs are crawled with crawl_orgs_summary.  A CostHistory orders the
+    shards largest first and receives the measured costs.
+    """
+    api = api_session(foundation['api_host'], foundation['login_host'], username, password, profiler,
+                      foundation.get('max_workers', 8)).scope()
+    if snapshot:
+        return collect_incremental_report(api, sdate, edate, foundation.get('name', ''),
+                                          snapshot_file(snapshot, foundation))
+    org_crawler = None
+    if sharding:
+        org_crawler = lambda orgs: crawl_sharded(foundation, orgs, dict(sharding, space_summary=space_summary),
+                                                 api, history)
+    elif space_summary:
+        org_crawler = lambda orgs: crawl_orgs_summary(api, orgs, foundation.get('name', ''))
+    return collect_report(api, sdate, edate, foundation.get('name', ''), org_crawler)
+
+
+def snapshot_file(snapshot, foundation):
+    """Return the snapshot file of a foundation, named foundations get their own file."""
+    if not foundation.get('name'):
+        return snapshot
+    base, ext = path.splitext(snapshot)
+    return '{0}-{1}{2}'.format(base, foundation['name'], ext)
+
+
+def crawl_foundations(foundations, credentials, sdate, edate, profiler=None, sharding=None,
+                      snapshot=None, space_summary=False, history=None):
+    """Crawl all foundations concurrently and merge their report rows.
+
+    credentials maps a username to its password, each foundation logs in
+    with its own 'username' or the default one.
+    """
+    def crawl(foundation):
+        username = foundation['username']
+        return crawl_foundation(foundation, username, credentials[username], sdate, edate, profiler,
+                                sharding, snapshot, space_summary, history)
+
+    if len(foundations) == 1:
+        return crawl(foundations[0])
+    pool = ThreadPool(len(foundations))
+    try:
+        reports = pool.map(crawl, foundations)
+    finally:
+        pool.close()
+        pool.join()
+    return merge_reports(reports)
+
+
+SHARD_CREDENTIALS = {}
+
+
+def init_shard_worker(credentials):
+    """Give a shard worker process the passwords it logs in with."""
+    SHARD_CREDENTIALS.clear()
+    SHARD_CREDENTIALS.update(credentials)
+    SESSIONS.clear()
+
+
+def crawl_shard(payload):
+    """Shard task: crawl the orgs of one shard, one CfSession per foundation and process."""
+    foundation = payload['foundation']
+    api = foundation_api(foundation, SHARD_CREDENTIALS)
+    return merge_reports([crawl_org_costed(api, org, foundation.get('name', ''), payload.get('space_summary'))
+                          for org in payload['items']])
+
+
+def crawl_sharded(foundation, orgs, sharding, api=None, history=None):
+    """Run the org-level crawl of a foundation in shards and merge the partial results.
+
+    sharding holds 'shard_size' and either 'processes' for a local process
+    pool or 'queue' for a shared work queue directory consumed by
+    'cfoperations shard-worker' processes.  With a CostHistory and the
+    foundation's api the orgs are sharded most expensive first, workers
+    take the next shard when they are idle, and the measured costs are
+    recorded.
+    """
+    from cfshard import make_shards, run_local, run_queue, FileWorkQueue
+    if history is not None and api is not None and orgs:
+        from cfcost import lpt_order
+        orgs = lpt_order(orgs, estimate_org_costs(api, orgs, history).get)
+    shards = make_shards(orgs, sharding.get('shard_size', 1),
+                         {'foundation': foundation, 'space_summary': sharding.get('space_summary', False)})
+    if sharding.get('queue'):
+        partials = run_queue(FileWorkQueue(os.path.join(sharding['queue'], foundation.get('name') or 'default')),
+                             shards)
+    else:
+        partials = run_local(shards, crawl_shard, sharding['processes'], init_shard_worker,
+                             (sharding['credentials'],))
+    report = merge_reports(partials)
+    if history is not None:
+        for cost in report['costs']:
+            history.record(foundation['api_host'], cost)
+    return report
+
+
+def run_shard_worker(queue_dir, foundations, credentials, exit_when_idle=False):
+    """Consume report shards of every configured foundation from a shared queue directory."""
+    from cfshard import run_worker, FileWorkQueue
+    init_shard_worker(credentials)
+    queues = [FileWorkQueue(os.path.join(queue_dir, f.get('name') or 'default')) for f in foundations]
+    log("Shard worker {0} consuming {1}.".format(socket.gethostname(), queue_dir))
+    while True:
+        completed = sum(run_worker(queue, crawl_shard, exit_when_idle=True) for queue in queues)
+        if completed:
+            log("Completed {0} shard(s).".format(completed))
+        elif exit_when_idle:
+            return
+        else:
+            sleep(2)
+
+
 def page_count(pagecount):
     pagenumber = 1
     while pagecount > 100:
@@ -72,12 +528,12 @@ def page_count(pagecount):
     return pagenumber
 
 
-def get_orginzation_list():
-    orgcompletelistcount = cfapi.get_generic_request("/v2/organizations")['total_results']
+def get_orginzation_list(api):
+    orgcompletelistcount = api.get_generic_request("/v2/organizations")['total_results']
     pagenumber = page_count(orgcompletelistcount)
     orgcompletelist = []
     for pg in range(pagenumber):
-        temp_gen = (cfapi.get_generic_request1(
+        temp_gen = (api.get_generic_request1(
             "/v2/organizations?order-direction=asc&page=" + str(pg + 1) + "&results-per-page=100"))
         temp_assign = next(temp_gen)
         for tempass in temp_assign['resources']:
@@ -85,147 +541,434 @@ def get_orginzation_list():
     return orgcompletelist
 
 
-def get_org_spaces_details(orgname):
-    org_guid = cfapi.get_org_guid(orgname)
-    oguid = cfapi.org_spaces(org_guid)
+def get_org_spaces_details(api, orgname):
+    org_guid = api.get_org_guid(orgname)
+    oguid = api.org_spaces(org_guid, records=True, fields=('name', 'url'))
     spacelist = []
     for orgspace in oguid:
-        sname = orgspace['entity']['name']
-        spacelist.append({'name': sname, 'spaceurl': orgspace['metadata']['url']})
+        spacelist.append({'name': orgspace.name, 'spaceurl': orgspace.url})
     return spacelist
 
 
-def get_spacename(orgname):
-    spaurl = get_org_spaces_details(orgname)
+def get_spacename(api, orgname):
+    spaurl = get_org_spaces_details(api, orgname)
     spacename = []
     for spa in spaurl:
         spacename.append({'orgname': orgname, 'spacename': spa['name'], 'spaceguid': (spa['spaceurl']).split("/")[3]})
     return spacename
 
 
-def get_app_url_details(appurl):
+def get_app_url_details(api, appurl):
     app_details = []
-    appdetails = cfapi.get_generic_request(appurl)
-    for apd in appdetails['resources']:
-        app_details.append({'name': apd['entity']['name'],
-                            'state': apd['entity']['state'], 'date': apd['metadata']['updated_at']})
+    for appdetails in api.get_generic_request1(appurl + '?results-per-page=100'):
+        for apd in appdetails['resources']:
+            app_details.append({'name': apd['entity']['name'],
+                                'state': apd['entity']['state'], 'date': apd['metadata']['updated_at']})
     return app_details
 
 
-def get_app_status(orgname):
-    spaurl = get_org_spaces_details(orgname)
+def get_app_status(api, orgname):
+    spaurl = get_org_spaces_details(api, orgname)
     app_status = []
     for spa in spaurl:
         app_status.append({'orgname': orgname, 'SpaceName': spa['name'],
-                           'app_state': get_app_url_details(spa['spaceurl'] + '/apps')})
+                           'app_state': get_app_url_details(api, spa['spaceurl'] + '/apps')})
     return app_status
 
 
-def get_user_provider_service():
-    userproviderservicecount = cfapi.get_generic_request("/v2/user_provided_service_instances")['total_results']
+def resolve_space_names(api, space_guids, spaces, orgs):
+    """Resolve space and org names for a page of resources.
+
+    Unknown space GUIDs are looked up with one batched ``guid IN`` query,
+    then their unknown orgs with another, instead of one request per row.
+
+    Args:
+        space_guids (iterable(str)): The space GUIDs referenced by the page.
+        spaces (dict): Space GUIDs to ``(org guid, space name)``, updated
+            in place.
+        orgs (dict): Org GUIDs to org names, updated in place.
+    """
+    missing = set(g for g in space_guids if g and g not in spaces)
+    if missing:
+        for guid, space in api.spaces_by_guid(missing, records=True).items():
+            spaces[guid] = (space.organization_guid, space.name)
+    missing = set(o for o, _ in spaces.values() if o and o not in orgs)
+    if missing:
+        for guid, org in api.orgs_by_guid(missing, records=True).items():
+            orgs[guid] = org.name
+
+
+def get_user_provider_service(api):
+    userproviderservicecount = api.get_generic_request("/v2/user_provided_service_instances")['total_results']
     pagenumber = page_count(userproviderservicecount)
     userproviderservice = []
-    org_name = []
+    spaces = {}
+    orgs = {}
     for pg in range(pagenumber):
         temp_gen = (
-            cfapi.get_generic_request1("/v2/user_provided_service_instances?order-direction=asc&page=" + str(pg + 1) +
-                                       "&results-per-page=100"))
+            api.get_generic_request1("/v2/user_provided_service_instances?order-direction=asc&page=" + str(pg + 1) +
+                                     "&results-per-page=100"))
         temp_assign = next(temp_gen)
+        resolve_space_names(api, [t['entity']['space_guid'] for t in temp_assign['resources']], spaces, orgs)
         for tempass in temp_assign['resources']:
-            tempspace = cfapi.get_generic_request(tempass['entity']['space_url'])
-            spacename = tempspace['entity']['name']
-            orgid = tempspace['entity']['organization_guid']
-            if orgid not in str(org_name):
-                oname = cfapi.get_generic_request("/v2/organizations/" + orgid)['entity']['name']
-                org_name.append({"orgname": oname, "orggid": orgid})
-            for og in org_name:
-                if orgid in str(og):
-                    orgorganizations = og['orgname']
+            orgid, spacename = spaces.get(tempass['entity']['space_guid'], (None, None))
             userproviderservice.append(
-                {'orgname': orgorganizations, 'name': tempass['entity']['name'],
+                {'orgname': orgs.get(orgid), 'name': tempass['entity']['name'],
                  'date': tempass['metadata']['created_at'], 'space_name': spacename})
     return userproviderservice
 
 
-def get_service(orgname):
-    spacedetails = get_org_spaces_details(orgname)
+def get_service(api, orgname):
+    spacedetails = get_org_spaces_details(api, orgname)
     service_status = []
     for space in spacedetails:
-        userproviderservice = cfapi.get_generic_request(space['spaceurl'] + '/service_instances')
-        for ser in userproviderservice['resources']:
-            service_status.append({'orgname': orgname, 'name': ser['entity']['name'],
-                                   'date': ser['entity']['last_operation']['created_at'],
-                                   'space_name': space['name']})
+        for userproviderservice in api.get_generic_request1(space['spaceurl'] +
+                                                            '/service_instances?results-per-page=100'):
+            for ser in userproviderservice['resources']:
+                service_status.append({'orgname': orgname, 'name': ser['entity']['name'],
+                                       'date': ser['entity']['last_operation']['created_at'],
+                                       'space_name': space['name']})
     return service_status
 
 
-def get_time_difference(tztimes):
-    tztime = datetime.datetime.strptime(tztimes + '.001', '%Y-%m-%dT%H:%M:%S.%f')
-    ltime = datetime.datetime.now()
-    datetimeformat = '%Y-%m-%d %H:%M:%S.%f'
-    diff = (datetime.datetime.strptime(str(ltime), datetimeformat) - datetime.datetime.strptime(str(tztime),
-                                                                                                datetimeformat))
-    return diff
+def crawl_orgs(api, orgs, foundation=''):
+    """Org-level part of the report crawl.
 
+    Returns a partial report with the 'spaces', 'apps' and 'services'
+    rows of the given orgs.
+    """
+    report = {'spaces': [], 'apps': [], 'services': [], 'events': []}
+    for oglist in orgs:
+        for sp in get_spacename(api, oglist):
+            report['spaces'].append({'foundation': foundation, 'orgname': sp['orgname'],
+                                     'spacename': sp['spacename'], 'spaceguid': sp['spaceguid']})
+        for ass1 in get_app_status(api, oglist):
+            for ass in ass1['app_state']:
+                report['apps'].append({'foundation': foundation, 'orgname': ass1['orgname'],
+                                       'spacename': ass1['SpaceName'], 'name': ass['name'],
+                                       'state': ass['state'], 'date': ass['date']})
+        for sstate in get_service(api, oglist):
+            report['services'].append({'foundation': foundation, 'orgname': sstate['orgname'],
+                                       'spacename': sstate['space_name'], 'name': sstate['name'],
+                                       'date': sstate['date']})
+    return report
+
+
+def crawl_orgs_summary(api, orgs, foundation='', history=None):
+    """Org-level part of the report crawl using one space summary per space.
+
+    Returns the same partial report as crawl_orgs.  The spaces of the orgs
+    are listed once and their summaries fetched concurrently, each summary
+    holds all apps and services of its space.  Summary apps carry no
+    metadata, so the app date is the package_updated_at of the app.
+    User-provided services are left to the foundation-wide listing.  With
+    a CostHistory the slowest spaces of the last run are fetched first,
+    the seconds every summary took are returned in 'space_seconds' by
+    space GUID.
+    """
+    report = {'spaces': [], 'apps': [], 'services': [], 'events': [], 'space_seconds': {}}
+    spaces = [sp for orgspaces in api.map_concurrent(lambda org: get_spacename(api, org), orgs)
+              for sp in orgspaces]
+
+    def fetch(sp):
+        start = time()
+        summary = api.space_summary(sp['spaceguid'])
+        report['space_seconds'][sp['spaceguid']] = time() - start
+        return sp['spaceguid'], summary
+
+    order = spaces
+    if history is not None:
+        from cfcost import lpt_order
+        order = lpt_order(spaces, lambda sp: history.space_seconds(api.api_host, sp['orgname'],
+                                                                   sp['spacename']))
+    summaries = dict(api.map_concurrent(fetch, order))
+    for sp in spaces:
+        summary = summaries[sp['spaceguid']]
+        report['spaces'].append({'foundation': foundation, 'orgname': sp['orgname'],
+                                 'spacename': sp['spacename'], 'spaceguid': sp['spaceguid']})
+        for app in summary.get('apps', []):
+            report['apps'].append({'foundation': foundation, 'orgname': sp['orgname'],
+                                   'spacename': sp['spacename'], 'name': app['name'],
+                                   'state': app['state'], 'date': app.get('package_updated_at')})
+        for ser in summary.get('services', []):
+            if 'service_plan' not in ser:
+                continue
+            report['services'].append({'foundation': foundation, 'orgname': sp['orgname'],
+                                       'spacename': sp['spacename'], 'name': ser['name'],
+                                       'date': (ser.get('last_operation') or {}).get('created_at')})
+    return report
+
+
+def crawl_org_costed(api, org, foundation='', space_summary=False, history=None):
+    """Crawl one org and measure what it cost.
+
+    Returns the partial report of crawl_orgs (or crawl_orgs_summary) with
+    a 'costs' list holding the org's requests, seconds and resource
+    counts, per org and per space, see CostHistory.record.
+    """
+    counter = RequestCounter()
+    start = time()
+    with api.counting(counter):
+        if space_summary:
+            report = crawl_orgs_summary(api, [org], foundation, history)
+        else:
+            report = crawl_orgs(api, [org], foundation)
+    seconds = time() - start
+    space_seconds = report.pop('space_seconds', {})
+    spaces = {}
+    for sp in report['spaces']:
+        spaces[sp['spacename']] = {'resources': 1}
+        if sp['spaceguid'] in space_seconds:
+            spaces[sp['spacename']]['seconds'] = space_seconds[sp['spaceguid']]
+    for row in report['apps'] + report['services']:
+        spaces.setdefault(row['spacename'], {'resources': 1})['resources'] += 1
+    report['costs'] = [{'org': org, 'requests': counter.requests, 'seconds': seconds,
+                        'resources': sum(sp['resources'] for sp in spaces.values()), 'spaces': spaces}]
+    return report
+
+
+def estimate_org_costs(api, orgs, history):
+    """Estimate the crawl seconds of orgs from the history.
+
+    Orgs without history are sized with total_results probes counting
+    their apps and service instances.
+    """
+    def probe(unknown):
+        guids = dict((o.name, o.guid) for o in api.orgs(records=True, fields=('guid', 'name')))
 
-def get_app_events(orgname, sdate, edate):
-    appeventcount = cfapi.get_generic_request1("/v2/events?&order-direction=desc&q=timestamp>" + sdate +
-                                               "T00:00:00Z&q=timestamp<" + edate + "T:23:59:00Z")
-    appeventcount = next(appeventcount)['total_results']
-    space_details = orgname
-    pagenumber = page_count(appeventcount)
-    appeventdetails = []
-    org_name = []
-    for pg in range(pagenumber):
-        temp_gen = (cfapi.get_generic_request1("/v2/events?order-by=timestamp&order-by=id&page=" +
-                                               str(pg + 1) + "&q=timestamp%3E" + sdate + "T00:00:00Z&q=timestamp%3C" +
-                                               edate + "T:23:59:00Z&results-per-page=100"))
-        temp_assign = next(temp_gen)
-        for tempass in temp_assign['resources']:
-            space_name = tempass['entity']['space_guid']
-            if space_name not in str(space_details):
-                sdetails = cfapi.get_generic_request("/v2/spaces/" + space_name)['entity']['name']
-                space_details.append({'spacename': sdetails, 'spaceguid': space_name})
-            for spn in space_details:
-                for spname in spn:
-                    if space_name in str(spname):
-                        spacename = spname['spacename']
-            orgid = tempass['entity']['organization_guid']
-            if orgid not in str(org_name):
-                oname = cfapi.get_generic_request("/v2/organizations/" + orgid)['entity']['name']
-                org_name.append({"orgname": oname, "orggid": orgid})
-            for og in org_name:
-                if orgid in str(og):
-                    orgorganizations = og['orgname']
-            appeventdetails.append(
-                {'OrgName': orgorganizations, 'SpaceName': spacename,
-                 'Application_Name': tempass['entity']['actee_name'],
-                 'User': tempass['entity']['actor_name'],
-                 'Event': tempass['entity']['type'], "Time": str(tempass['entity']['timestamp'])})
-    return appeventdetails
+        def size(org):
+            if org not in guids:
+                return 0
+            filters = {'q': 'organization_guid:{0}'.format(guids[org])}
+            return sum(api.count(p, filters) for p in ('/v2/apps', '/v2/service_instances'))
 
+        return dict(zip(unknown, api.map_concurrent(size, unknown)))
 
-"""To get Particular organization and space details:"""
+    return history.estimate(api.api_host, orgs, probe)
+
+
+def collect_report(api, sdate, edate, foundation='', org_crawler=None):
+    """Crawl one foundation and return the report rows.
+
+    Returns a dict with the 'spaces', 'apps', 'services' and 'events' rows,
+    every row tagged with the foundation name.  org_crawler runs the
+    org-level work for a list of org names, crawl_orgs with api by default.
+    """
+    org_list = get_orginzation_list(api)
+    if org_crawler is None:
+        report = crawl_orgs(api, org_list, foundation)
+    else:
+        report = org_crawler(org_list)
+    userprovidestatus = get_user_provider_service(api)
+    for sstate in userprovidestatus:
+        report['services'].append({'foundation': foundation, 'orgname': sstate['orgname'],
+                                   'spacename': sstate['space_name'], 'name': sstate['name'],
+                                   'date': sstate['date']})
+    add_event_rows(report, api, sdate, edate, foundation)
+    return report
+
+
+def collect_incremental_report(api, sdate, edate, foundation, snapshot):
+    """Build the report rows from the last snapshot, re-crawling only dirty spaces.
+
+    The snapshot file is created by the first run, which crawls
+    everything, and is updated after every run.  See Inventory.refresh.
+    """
+    from cfinventory import Inventory
+    inventory = Inventory.from_snapshot(snapshot) if path.isfile(snapshot) else Inventory()
+    dirty = inventory.refresh(api)
+    if dirty is None:
+        log("{0}: full crawl, no recent snapshot in {1}.".format(foundation or api.api_host, snapshot))
+    else:
+        log("{0}: re-crawled {1} of {2} spaces.".format(foundation or api.api_host, dirty,
+                                                       len(inventory.spaces)))
+    inventory.save(snapshot)
+    report = inventory.report_rows(foundation)
+    add_event_rows(report, api, sdate, edate, foundation)
+    return report
+
+
+def event_row(apevent, foundation=''):
+    """Turn an iter_app_events row into an App Events report row."""
+    return {'foundation': foundation, 'orgname': apevent['OrgName'], 'spacename': apevent['SpaceName'],
+            'name': apevent['Application_Name'], 'user': apevent['User'], 'event': apevent['Event'],
+            'time': apevent['Time']}
+
+
+def add_event_rows(report, api, sdate, edate, foundation=''):
+    """Add the app event rows of the date range to the report."""
+    for apevent in iter_app_events(api, [report['spaces']], sdate, edate):
+        report['events'].append(event_row(apevent, foundation))
+
+
+def iter_event_chunks(api, sdate, edate, foundation='', size=500):
+    """Yield the event rows of the date range in timestamp order, size rows at a time."""
+    chunk = []
+    for apevent in iter_app_events(api, [], sdate, edate):
+        chunk.append(event_row(apevent, foundation))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_org_reports(api, orgs, foundation='', space_summary=False, history=None):
+    """Yield ``(orgname, partial report)`` for every org, in org name order.
+
+    Orgs are crawled concurrently, a few ahead of the consumer, see
+    CfApi.imap_concurrent.  With space_summary every org is crawled with
+    crawl_orgs_summary instead of crawl_orgs.  With a CostHistory the
+    max_workers most expensive orgs are started first and every report
+    carries its measured 'costs', see crawl_org_costed.
+    """
+    orgs = sorted(orgs)
+    first = ()
+    if history is not None and orgs:
+        from cfcost import lpt_order
+        costs = estimate_org_costs(api, orgs, history)
+        first = lpt_order(orgs, costs.get)[:api.max_workers]
+    return api.imap_concurrent(
+        lambda org: (org, crawl_org_costed(api, org, foundation, space_summary, history)), orgs, first)
+
+
+def merge_reports(reports):
+    merged = {'spaces': [], 'apps': [], 'services': [], 'events': [], 'costs': []}
+    for report in reports:
+        for key in merged:
+            merged[key].extend(report.get(key, []))
+    return merged
+
+
+def build_app_table(rows, now=None):
+    """Build the application table with durations.
+
+    Rows are sorted by foundation, org, space and application name and
+    carry the time since the last start/stop both as seconds and as
+    formatted text.
+    """
+    from cfreport import ReportTable
+    table = ReportTable(['foundation', 'orgname', 'spacename', 'name', 'state', 'date'])
+    table.extend(rows)
+    table.add_durations('date', now=now)
+    return table.sort_by('foundation', 'orgname', 'spacename', 'name')
+
+
+def build_service_table(rows, now=None):
+    """Build the managed and user-provided service table with durations."""
+    from cfreport import ReportTable
+    table = ReportTable(['foundation', 'orgname', 'spacename', 'name', 'date'])
+    table.extend(rows)
+    table.add_durations('date', now=now)
+    return table.sort_by('foundation', 'orgname', 'spacename', 'name')
 
-with open('input.yaml', "r") as INPUTF:
-    INPUT = yaml.safe_load(INPUTF)
+
+def write_table(workbook, sheetname, headers, table, columns, foundation=False):
+    """Write a report table to a new worksheet, NaN seconds become blanks.
+
+    With foundation set the foundation column is written first.
+    """
+    worksheet, columns = add_sheet(workbook, sheetname, headers, columns, foundation)
+    write_rows(worksheet, 1, table.rows(*columns))
+    return worksheet
 
 
-if INPUT['COMMON']:
-    ssorg_name = INPUT['COMMON']['cf_org_name']
-    ssspace_name = INPUT['COMMON']['cf_space_name']
+def add_sheet(workbook, sheetname, headers, columns, foundation=False):
+    """Add a worksheet with its header row.
 
+    Returns the worksheet and the columns to write, with foundation set
+    the foundation column comes first.
+    """
+    if foundation:
+        headers = ["FOUNDATION"] + headers
+        columns = ['foundation'] + columns
+    worksheet = workbook.add_worksheet(sheetname)
+    for column, header in enumerate(headers):
+        worksheet.write(0, column, header)
+    return worksheet, columns
+
+
+def write_rows(worksheet, row, rows):
+    """Write rows of values starting at row, NaN seconds become blanks.
+
+    Returns the next free row.
+    """
+    for values in rows:
+        for column, value in enumerate(values):
+            if isinstance(value, float) and value != value:
+                value = None
+            worksheet.write(row, column, value)
+        row += 1
+    return row
 
-if INPUT['CLOUDFOUNDRYSERVICENAMES']:
-    vaultservice = INPUT['CLOUDFOUNDRYSERVICENAMES']['vaultservice']
-    s3service = INPUT['CLOUDFOUNDRYSERVICENAMES']['s3service']
-    rabbitmqservice = INPUT['CLOUDFOUNDRYSERVICENAMES']['rabbitmqservice']
 
+def date_range(sdate, edate):
+    """Return the epoch seconds from the start of sdate to the end of edate (UTC)."""
+    start = calendar.timegm(datetime.datetime.strptime(sdate, '%Y-%m-%d').timetuple())
+    end = calendar.timegm(datetime.datetime.strptime(edate, '%Y-%m-%d').timetuple()) + 86400
+    return start, end
 
-def specific_space_cfapi_login(username, password):
+
+def iter_app_events(api, orgname, sdate, edate):
+    """Yield the event rows of a date range in timestamp order.
+
+    Events are listed in concurrently fetched time windows (see
+    CfApi.events_by_window) and each window's spaces and orgs are resolved
+    with batched lookups.
+    """
+    # Spaces already crawled for the report seed the name cache.
+    spaces = {}
+    for spn in orgname:
+        for spname in spn:
+            spaces[spname['spaceguid']] = (None, spname['spacename'])
+    orgs = {}
+    start, end = date_range(sdate, edate)
+    for events in api.events_by_window(start, end, records=True):
+        resolve_space_names(api, [e.space_guid for e in events], spaces, orgs)
+        missing = set(e.organization_guid for e in events if e.organization_guid) - set(orgs)
+        if missing:
+            orgs.update((g, o.name) for g, o in api.orgs_by_guid(missing, records=True).items())
+        for event in events:
+            yield {'OrgName': orgs.get(event.organization_guid),
+                   'SpaceName': spaces.get(event.space_guid, (None, None))[1],
+                   'Application_Name': event.actee_name,
+                   'User': event.actor_name,
+                   'Event': event.type, "Time": str(event.timestamp)}
+
+
+def get_app_events(api, orgname, sdate, edate):
+    return list(iter_app_events(api, orgname, sdate, edate))
+
+
+"""To get Particular organization and space details:"""
+
+INPUT = None
+
+
+def load_input(filename='input.yaml'):
+    """Read input.yaml on first use.
+
+    Only the commands that need the configuration read it, and pay for
+    importing yaml.
+    """
+    global INPUT, ssorg_name, ssspace_name, vaultservice, s3service, rabbitmqservice
+    if INPUT is None:
+        import yaml
+        with open(filename, "r") as INPUTF:
+            INPUT = yaml.safe_load(INPUTF)
+        if INPUT['COMMON']:
+            ssorg_name = INPUT['COMMON']['cf_org_name']
+            ssspace_name = INPUT['COMMON']['cf_space_name']
+        if INPUT['CLOUDFOUNDRYSERVICENAMES']:
+            vaultservice = INPUT['CLOUDFOUNDRYSERVICENAMES']['vaultservice']
+            s3service = INPUT['CLOUDFOUNDRYSERVICENAMES']['s3service']
+            rabbitmqservice = INPUT['CLOUDFOUNDRYSERVICENAMES']['rabbitmqservice']
+    return INPUT
+
+
+def specific_space_cfapi_login(username, password, profiler=None):
     global sscfapi
-    sscfapi = CfApi(username=username, password=password, login_host=LOGIN_HOST, api_host=API_HOST, org_name=ssorg_name,
-                  space_name=ssspace_name)
+    sscfapi = api_session(API_HOST, LOGIN_HOST, username, password, profiler).scope(ssorg_name, ssspace_name)
     return sscfapi
 
 
@@ -246,34 +989,34 @@ def duplicate_elminate_services(inputstring):
     return serdeplist
 
 
-def get_app_env(appname):
-    appguid = sscfapi.get_app_status(appname)
-    appenv = sscfapi.get_generic_request('/v2/apps/' + appguid['guid'] + '/env')
+def parse_vcap_services(vcap_services):
+    """Extract the credentials the teardown needs from VCAP_SERVICES.
+
+    Walks the already decoded VCAP_SERVICES document once and classifies
+    every bound instance by its service label and credential keys.
+    """
+    if not vcap_services:
+        return "None"
     manage_services = []
-    if appenv['system_env_json']['VCAP_SERVICES']:
-        for env in appenv['system_env_json']['VCAP_SERVICES']:
-            if "port" in str(appenv['system_env_json']['VCAP_SERVICES'][env]):
-                for env1 in appenv['system_env_json']['VCAP_SERVICES'][env]:
-                    manage_services.append(
-                        {"instance_name": env1['instance_name'], "host": env1['credentials']['hostname'],
-                         "username": env1['credentials']['username'], "password": env1['credentials']['password'],
-                         "port": env1['credentials']['port'], 'db_name': env1['credentials']['db_name']})
-            if s3service in str(appenv['system_env_json']['VCAP_SERVICES'][env]):
-                for env1 in appenv['system_env_json']['VCAP_SERVICES'][env]:
-                    manage_services.append(
-                        {'instance_name': env1['instance_name'], 'bucket': env1['credentials']['bucket'],
-                         'api_key': env1['credentials']['api_key'], 'secret_key': env1['credentials']['secret_key']})
-            if "user-provided" in str(appenv['system_env_json']['VCAP_SERVICES'][env]):
-                for env1 in appenv['system_env_json']['VCAP_SERVICES'][env]:
-                    manage_services.append({'instance_name': env1['instance_name'], 'userprovided': 'yes'})
-            if vaultservice in str(appenv['system_env_json']['VCAP_SERVICES'][env]):
-                for env1 in appenv['system_env_json']['VCAP_SERVICES'][env]:
-                    manage_services.append(
-                        {'instance_name': env1['instance_name'], 'endpoint': env1['credentials']['endpoint'],
-                         'service_secret_path': env1['credentials']['service_secret_path'],
-                         'role_id': env1['credentials']['role_id'], 'secret_id': env1['credentials']['secret_id']})
-    else:
-        manage_services = "None"
+    for label, instances in vcap_services.items():
+        for env1 in instances:
+            credentials = env1.get('credentials') or {}
+            if label == "user-provided":
+                manage_services.append({'instance_name': env1['instance_name'], 'userprovided': 'yes'})
+            elif label == s3service:
+                manage_services.append(
+                    {'instance_name': env1['instance_name'], 'bucket': credentials['bucket'],
+                     'api_key': credentials['api_key'], 'secret_key': credentials['secret_key']})
+            elif label == vaultservice:
+                manage_services.append(
+                    {'instance_name': env1['instance_name'], 'endpoint': credentials['endpoint'],
+                     'service_secret_path': credentials['service_secret_path'],
+                     'role_id': credentials['role_id'], 'secret_id': credentials['secret_id']})
+            elif "port" in credentials:
+                manage_services.append(
+                    {"instance_name": env1['instance_name'], "host": credentials['hostname'],
+                     "username": credentials['username'], "password": credentials['password'],
+                     "port": credentials['port'], 'db_name': credentials['db_name']})
     return manage_services
 
 
@@ -282,11 +1025,11 @@ def generate_env():
     filedict = []
     if INPUT['APPLICATIONS']:
         dupelimitapp = duplicate_elminate(INPUT['APPLICATIONS'])
+        appenvs = sscfapi.app_envs(dupelimitapp)
         for appnames in dupelimitapp:
-            appenvname = (appnames).replace("-", "")
-            appcheck = sscfapi.get_app_status(appnames)
-            if len(appcheck) != 0:
-                value = get_app_env(appnames)
+            if appnames in appenvs:
+                appenvname = (appnames).replace("-", "")
+                value = parse_vcap_services(appenvs[appnames]['system_env_json'].get('VCAP_SERVICES'))
                 globals()[appenvname] = value
                 servicecredlist.append(appenvname)
                 filedict.append({appenvname: value})
@@ -298,7 +1041,7 @@ def generate_env():
 def get_service_credenital(servicename):
     servicecheck = sscfapi.verify_servicename(servicename)
     if servicecheck:
-        vservicecred = sscfapi.get_service_credentials(servicename)
+        vservicecred = sscfapi.get_service_credentials(servicename, create_missing=True)
         return vservicecred
 
 
@@ -341,37 +1084,91 @@ def delete_services(servicecredlist):
         sys.exit("Script is exiting, because final confirmation of service deletion is NO. \n \
                  If you want to delete services, re-execute this script.\n")
     if servicecredlist:
-        serdeplist1 = duplicate_elminate_services(servicecredlist)
-        for value in serdeplist1:
-            for dvalue in delete_service:
-                servicename = value['instance_name']
-                if servicename == dvalue:
-                    if "userprovided" in str(value):
-                        getstatus = sscfapi.get_user_provided_service(servicename)
-                        if servicename in str(getstatus):
-                            log('{0} Service Status check --> {1}'.format(servicename, getstatus))
-                            sscfapi.user_provided_service_delete(servicename)
-                            log('{0} Service is delete process initiated'.format(servicename))
-                    else:
-                        sstatus = sscfapi.get_service_status(servicename)
-                        log('{0} Service Status check --> {1}'.format(servicename, sstatus))
-                        if len(sstatus) != 0:
-                            if sstatus['state'] != 'in progress' or sstatus['type'] != 'delete':
-                                log('{0} Service is delete process initiated'.format(servicename))
-                                sscfapi.user_delete_service(servicename)
-                            else:
-                                log('{0} Service can not be deleted, due {1}'.format(servicename, sstatus))
-                        else:
-                            log('{0} Service is not available.'.format(servicename))
+        selected = [value for value in duplicate_elminate_services(servicecredlist)
+                    if value['instance_name'] in delete_service]
+        space = {'q': 'space_guid:{0}'.format(sscfapi.space_guid)}
+        listings = [sscfapi.service_instances, sscfapi.user_provided_service_instances]
+        managed, user_provided = sscfapi.map_concurrent(lambda listing: listing(space), listings)
+        deletes = {}
+        for value in selected:
+            servicename = value['instance_name']
+            if "userprovided" in str(value):
+                matched = [s for s in user_provided if re.match("^" + servicename + "$", s['entity']['name'])]
+                if matched:
+                    getstatus = {'name': matched[-1]['entity']['name'], 'guid': matched[-1]['metadata']['guid']}
+                    log('{0} Service Status check --> {1}'.format(servicename, getstatus))
+                    deletes.update((s['metadata']['guid'], (servicename, False, s)) for s in matched)
+                    log('{0} Service is delete process initiated'.format(servicename))
+                continue
+            matched = [s for s in managed if re.match("^" + servicename + "$", s['entity']['name'])]
+            sstatus = {}
+            if matched:
+                sstatus = {'name': matched[-1]['entity']['name'],
+                           'state': matched[-1]['entity']['last_operation']['state'],
+                           'type': matched[-1]['entity']['last_operation']['type']}
+            log('{0} Service Status check --> {1}'.format(servicename, sstatus))
+            if len(sstatus) != 0:
+                if sstatus['state'] != 'in progress' or sstatus['type'] != 'delete':
+                    log('{0} Service is delete process initiated'.format(servicename))
+                    deletes.update((s['metadata']['guid'], (servicename, True, s)) for s in matched)
+                else:
+                    log('{0} Service can not be deleted, due {1}'.format(servicename, sstatus))
+            else:
+                log('{0} Service is not available.'.format(servicename))
+        if deletes:
+            confirm_service_deletes(deletes)
+
+
+def delete_service_instance(delete):
+    """Delete one service instance, and the keys of a managed one, reporting errors as values."""
+    guid, (_, is_managed, resource) = delete
+    try:
+        if is_managed:
+            sscfapi.service_key_manager.delete(guid)
+        sscfapi.delete_service(resource['metadata']['url'])
+        if is_managed:
+            sscfapi.service_key_manager.forget(guid)
+        return None
+    except Exception as e:
+        return e
+
+
+def confirm_service_deletes(deletes):
+    """Delete service instances concurrently and log their final state.
+
+    The keys of every managed instance are listed with one batched lookup
+    before the deletes, and the outcome is confirmed with one re-listing
+    of the space instead of a status check per service.
+
+    Args:
+        deletes (dict): Instance GUIDs to ``(servicename, is_managed,
+            resource)`` tuples.
+    """
+    sscfapi.service_key_manager.load([g for g, (_, is_managed, _) in deletes.items() if is_managed])
+    errors = dict(zip(deletes, sscfapi.map_concurrent(delete_service_instance, deletes.items())))
+    space = {'q': 'space_guid:{0}'.format(sscfapi.space_guid)}
+    listings = [sscfapi.service_instances, sscfapi.user_provided_service_instances]
+    remaining = dict((s['metadata']['guid'], s) for instances in sscfapi.map_concurrent(
+        lambda listing: listing(space), listings) for s in instances)
+    for guid, (servicename, _, resource) in sorted(deletes.items(), key=lambda d: d[1][0]):
+        name = resource['entity']['name']
+        if errors[guid] is not None:
+            log('{0} Service delete failed: {1}'.format(name, errors[guid]))
+        elif guid not in remaining:
+            log('{0} Service is deleted.'.format(name))
+        else:
+            operation = remaining[guid]['entity'].get('last_operation') or {}
+            log('{0} Service delete state --> {1} {2}'.format(
+                name, operation.get('type'), operation.get('state')))
 
 
 def ssget_space(space_name):
     orguid = sscfapi.get_org_guid(ssorg_name)
-    spaces = sscfapi.org_spaces(orguid)
+    spaces = sscfapi.org_spaces(orguid, records=True, fields=('name', 'guid'))
     spaceguid = ''
     for space in spaces:
-        if space['entity']['name'] == space_name:
-            spaceguid = space['metadata']['guid']
+        if space.name == space_name:
+            spaceguid = space.guid
     return spaceguid
 
 
@@ -380,7 +1177,7 @@ def delete_space(space_name):
     log("{0} space delete operation initiated.".format(space_name))
     if spaceguid:
         sscfapi.delete_space("/v2/spaces/" + spaceguid)
-    spaceguid1 = get_space()
+    spaceguid1 = ssget_space(space_name)
     if not spaceguid1:
         spaceguid1 = 'NONE'
     if spaceguid1 != 'NONE':
@@ -390,120 +1187,587 @@ def delete_space(space_name):
         log("{0} space is not available. {0} space guid is {1}.".format(space_name, spaceguid1))
 
 
-def main():
-    args = parse_args()
-    username = args.cfUsername
-    print('Enter Ldap password to login Cloud Foundry')
-    password = getpass.getpass('Password: ')
-    cfapi_login(username, password)
-    org_list = get_orginzation_list()
-    spname = []
-    appstatus = []
-    serstatus = []
-    for oglist in org_list:
-        spname.append(get_spacename(oglist))
-        appstatus.append(get_app_status(oglist))
-        serstatus.append(get_service(oglist))
-    if args.StartDate:
-        SDate = args.StartDate
+# Workbook sheets in order: report rows key, sheet name, header row and the
+# row columns written under the headers.
+REPORT_SHEETS = (
+    ('spaces', "SPACE-Details", ["ORG NAME", "SPACE NAME"], ['orgname', 'spacename']),
+    ('apps', "Application",
+     ["ORG NAME", "SPACE NAME", "APPLICATION NAME", "STATUS", "DURATION of Since Start/Stop",
+      "DURATION (SECONDS)"],
+     ['orgname', 'spacename', 'name', 'state', 'duration', 'duration_seconds']),
+    ('services', "Services",
+     ["ORG NAME", "SPACE NAME", "SERVICE NAME", "RUNNING DURATION", "DURATION (SECONDS)"],
+     ['orgname', 'spacename', 'name', 'duration', 'duration_seconds']),
+    ('events', "App Events",
+     ["ORG NAME", "SPACE NAME", "Application Name", "User", "Event", "Time"],
+     ['orgname', 'spacename', 'name', 'user', 'event', 'time']),
+)
+
+
+# Columns of the report's event rows, see event_row.
+EVENT_COLUMNS = ['foundation', 'orgname', 'spacename', 'name', 'user', 'event', 'time']
+
+
+# Header of the Event Summary sheet, see EventAggregator.rows.
+EVENT_SUMMARY_HEADERS = ["SECTION", "KEY", "EVENTS", "FIRST", "LAST", "MAX OVERCOUNT"]
+
+
+def write_event_summary(workbook, aggregator):
+    """Add the Event Summary sheet of an EventAggregator."""
+    worksheet, _ = add_sheet(workbook, "Event Summary", EVENT_SUMMARY_HEADERS, [])
+    write_rows(worksheet, 1, aggregator.rows())
+    return worksheet
+
+
+def event_aggregator(event_summary):
+    """Return an EventAggregator when the event summary is wanted."""
+    if not event_summary:
+        return None
+    from cfaggregate import EventAggregator
+    return EventAggregator()
+
+
+def write_report(report, filename, now=None, event_rows=True, event_summary=False):
+    """Write the merged report rows to an xlsx workbook.
+
+    event_rows writes the App Events sheet, event_summary adds the Event
+    Summary sheet.  Used for sharded and snapshot reports, whose rows are
+    already in memory: the sheets are sorted in memory and only the
+    workbook is written in constant_memory mode.  Memory stays bounded
+    only with stream_report, the default for the report command.
+    """
+    foundation = any(r['foundation'] for r in report['spaces'])
+    now = time() if now is None else now
+    import xlsxwriter
+    from cfreport import ReportTable
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    spacetable = ReportTable(['foundation', 'orgname', 'spacename'])
+    spacetable.extend(report['spaces'])
+    tables = {'spaces': spacetable.sort_by('foundation', 'orgname', 'spacename'),
+              'apps': build_app_table(report['apps'], now),
+              'services': build_service_table(report['services'], now)}
+    aggregator = event_aggregator(event_summary)
+    if event_rows or aggregator is not None:
+        eventtable = ReportTable(EVENT_COLUMNS)
+        eventtable.extend(report['events'])
+        tables['events'] = eventtable.sort_by('time')
+    for key, sheetname, headers, columns in REPORT_SHEETS:
+        if key != 'events' or event_rows:
+            write_table(workbook, sheetname, headers, tables[key], columns, foundation)
+    if aggregator is not None:
+        # The rows in time order, like stream_report feeds them.
+        for values in tables['events'].rows(*EVENT_COLUMNS):
+            aggregator.add_row(dict(zip(EVENT_COLUMNS, values)))
+        write_event_summary(workbook, aggregator)
+    workbook.close()
+
+
+def stream_report(foundations, credentials, sdate, edate, filename, profiler=None, space_summary=False,
+                  now=None, queue_size=16, event_rows=True, event_summary=False, history=None):
+    """Crawl the foundations and write the workbook at the same time.
+
+    Produces the same workbook as crawl_foundations followed by
+    write_report: every sheet gets the same rows in the same order.
+    Every foundation's orgs, user-provided services and event windows are
+    crawled by their own pipeline stages into bounded channels, and one
+    more stage merges the event rows of all foundations by time.
+    xlsxwriter workbooks are not thread-safe, so the main thread writes
+    every sheet: the space, application and service rows org by org, and
+    after each org the event rows merged so far.  The workbook is written
+    in constant_memory mode, so memory is bounded by the channel sizes
+    instead of the size of the foundations.  The event summary is
+    aggregated as the event rows are written.  A CostHistory starts the
+    most expensive orgs first and receives the measured costs.
+    """
+    import heapq
+    import xlsxwriter
+    from cfpipeline import Pipeline
+    from cfreport import ReportTable
+    now = time() if now is None else now
+    show_foundation = any(f.get('name') for f in foundations)
+    foundations = sorted(foundations, key=lambda f: f.get('name', ''))
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    sheets = {}
+    for key, sheetname, headers, columns in REPORT_SHEETS:
+        if key != 'events' or event_rows:
+            worksheet, columns = add_sheet(workbook, sheetname, headers, columns, show_foundation)
+            sheets[key] = [worksheet, columns, 1]
+    aggregator = event_aggregator(event_summary)
+
+    def write(key, table):
+        sheet = sheets[key]
+        sheet[2] = write_rows(sheet[0], sheet[2], table.rows(*sheet[1]))
+
+    def merge_events(channels, merged):
+        def timed(index, channel):
+            for seq, row in enumerate(row for chunk in channel for row in chunk):
+                yield row['time'], index, seq, row
+        batch = []
+        for _, _, _, row in heapq.merge(*[timed(i, c) for i, c in enumerate(channels)]):
+            batch.append(row)
+            if len(batch) == 100:
+                merged.put(batch)
+                batch = []
+        if batch:
+            merged.put(batch)
+        merged.close()
+
+    def write_events(batches):
+        sheet = sheets.get('events')
+        for row in (row for batch in batches for row in batch):
+            if aggregator is not None:
+                aggregator.add_row(row)
+            if sheet is not None:
+                sheet[2] = write_rows(sheet[0], sheet[2], [tuple(row[c] for c in sheet[1])])
+
+    def write_org(name, report, ups, api_host):
+        if history is not None:
+            for cost in report.get('costs', []):
+                history.record(api_host, cost)
+        # User-provided services are listed foundation wide, the ones that
+        # sort before the next org are written with this one.
+        while ups and (name is None or ups[0]['orgname'] <= name):
+            report['services'].append(ups.popleft())
+        spaces = ReportTable(['foundation', 'orgname', 'spacename'])
+        spaces.extend(report['spaces'])
+        write('spaces', spaces.sort_by('foundation', 'orgname', 'spacename'))
+        write('apps', build_app_table(report['apps'], now))
+        write('services', build_service_table(report['services'], now))
+
+    with Pipeline(queue_size) as pipeline:
+        streams = []
+        for foundation in foundations:
+            api = foundation_api(foundation, credentials, profiler)
+            name = foundation.get('name', '')
+            prefix = '{0}: '.format(name) if name else ''
+            streams.append((api.api_host, pipeline.source(
+                prefix + 'orgs', lambda api=api, name=name: iter_org_reports(
+                    api, get_orginzation_list(api), name, space_summary, history)), pipeline.source(
+                prefix + 'user-provided services', lambda api=api, name=name: [[
+                    {'foundation': name, 'orgname': s['orgname'], 'spacename': s['space_name'],
+                     'name': s['name'], 'date': s['date']} for s in get_user_provider_service(api)]]),
+                pipeline.source(prefix + 'events', lambda api=api, name=name: iter_event_chunks(
+                    api, sdate, edate, name))))
+        merged = pipeline.channel('merged events')
+        pipeline.spawn(merge_events, [events for _, _, _, events in streams], merged)
+        for api_host, orgs, ups, _ in streams:
+            ups = deque(sorted(next(iter(ups)), key=lambda r: r['orgname']))
+            for orgname, report in orgs:
+                write_org(orgname, report, ups, api_host)
+                write_events(merged.drain())
+            if ups:
+                write_org(None, {'spaces': [], 'apps': [], 'services': []}, ups, api_host)
+        write_events(merged)
+    if aggregator is not None:
+        write_event_summary(workbook, aggregator)
+    workbook.close()
+    for line in pipeline.stats():
+        log("Pipeline {0}".format(line))
+
+
+def run_watch(foundations, credentials, poll_interval, reconcile_interval, profiler=None):
+    """Keep an in-memory inventory of every foundation fresh until interrupted.
+
+    Each foundation gets its own CfApi and InventoryWatcher.  Sending
+    SIGUSR1 writes the report workbook straight from memory.
+    """
+    from cfinventory import InventoryWatcher
+    watchers = []
+    for foundation in foundations:
+        api = foundation_api(foundation, credentials, profiler)
+        watchers.append((foundation.get('name', ''),
+                         InventoryWatcher(api, poll_interval=poll_interval, reconcile_interval=reconcile_interval)))
+    report_requested = threading.Event()
+    stop = threading.Event()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: report_requested.set())
+    for name, watcher in watchers:
+        watcher.reconcile()
+        log("{0} inventory loaded: {1} apps, {2} services.".format(
+            name or API_HOST, len(watcher.inventory.apps),
+            len(watcher.inventory.services) + len(watcher.inventory.user_provided_services)))
+    try:
+        while not stop.is_set():
+            for name, watcher in watchers:
+                changed = watcher.tick()
+                if changed:
+                    log("{0}: applied {1} inventory changes.".format(name or API_HOST, changed))
+            report_requested.wait(poll_interval)
+            if report_requested.is_set():
+                report_requested.clear()
+                filename = 'cfdetails-' + str(datetime.date.today()) + '.xlsx'
+                write_report(merge_reports([w.inventory.report_rows(name) for name, w in watchers]), filename)
+                log("Report written to {0} from memory.".format(filename))
+    except KeyboardInterrupt:
+        stop.set()
+
+
+def run_serve(foundation, credentials, address, poll_interval, reconcile_interval, profiler=None):
+    """Serve the inventory of one foundation over HTTP while keeping it fresh.
+
+    The last day of audit events is loaded as event history.
+    """
+    from cfinventory import InventoryWatcher
+    from cfquery import make_server
+    api = foundation_api(foundation, credentials, profiler)
+    watcher = InventoryWatcher(api, poll_interval=poll_interval, reconcile_interval=reconcile_interval,
+                               event_backlog=86400)
+    watcher.reconcile()
+    if '/' in address:
+        server = make_server(watcher.inventory, unix_socket=address)
     else:
-        SDate = YDate
-    if args.EndDate:
-        EDate = args.EndDate
+        host, _, port = address.rpartition(':')
+        server = make_server(watcher.inventory, host=host or '127.0.0.1', port=int(port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    log("Serving {0} inventory on {1}.".format(foundation.get('name') or foundation['api_host'], address))
+    stop = threading.Event()
+    try:
+        watcher.run(stop)
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def log(message):
+    print('{0} {1}'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), message))
+
+
+def write_api_profile(profiler, destination):
+    if destination == '-':
+        profiler.report(sys.stderr)
     else:
-        EDate = YDate
-    appevent = get_app_events(spname, SDate, EDate)
-    workbook = xlsxwriter.Workbook('cfdetails-' + DATE + '.xlsx')
-    worksheet = workbook.add_worksheet("SPACE-Details")
-    row = 1
-    column = 0
-    worksheet.write(0, 0, "ORG NAME")
-    worksheet.write(0, 1, "SPACE NAME")
-    for sp1 in spname:
-        for sp in sp1:
-            worksheet.write(row, column, sp['orgname'])
-            worksheet.write(row, column + 1, sp['spacename'])
-            row += 1
-    worksheet = workbook.add_worksheet("Application")
-    worksheet.write(0, 0, "ORG NAME")
-    worksheet.write(0, 1, "SPACE NAME")
-    worksheet.write(0, 2, "APPLICATION NAME")
-    worksheet.write(0, 3, "STATUS")
-    worksheet.write(0, 4, "DURATION of Since Start/Stop")
-    row = 1
-    column = 0
-    for apstat in appstatus:
-        for ass1 in apstat:
-            for ass in ass1['app_state']:
-                totalruntime = get_time_difference(str(ass['date']).strip("Z"))
-                worksheet.write(row, column, ass1['orgname'])
-                worksheet.write(row, column + 1, ass1['SpaceName'])
-                worksheet.write(row, column + 2, ass['name'])
-                worksheet.write(row, column + 3, ass['state'])
-                worksheet.write(row, column + 4, str(totalruntime))
-                row += 1
-    userprovidestatus = get_user_provider_service()
-    worksheet = workbook.add_worksheet("Services")
-    worksheet.write(0, 0, "ORG NAME")
-    worksheet.write(0, 1, "SPACE NAME")
-    worksheet.write(0, 2, "SERVICE NAME")
-    worksheet.write(0, 3, "RUNNING DURATION")
-    row = 1
-    column = 0
-    for serstat in serstatus:
-        for sstate in serstat:
-            totalruntime = get_time_difference(str(sstate['date']).strip("Z"))
-            worksheet.write(row, column, sstate['orgname'])
-            worksheet.write(row, column + 1, sstate['space_name'])
-            worksheet.write(row, column + 2, sstate['name'])
-            worksheet.write(row, column + 3, str(totalruntime))
-            row += 1
-    for sstate in userprovidestatus:
-        totalruntime = get_time_difference(str(sstate['date']).strip("Z"))
-        worksheet.write(row, column, sstate['orgname'])
-        worksheet.write(row, column + 1, sstate['space_name'])
-        worksheet.write(row, column + 2, sstate['name'])
-        worksheet.write(row, column + 3, str(totalruntime))
-        row += 1
-    worksheet = workbook.add_worksheet("App Events")
-    worksheet.write(0, 0, "ORG NAME")
-    worksheet.write(0, 1, "SPACE NAME")
-    worksheet.write(0, 2, "Application Name")
-    worksheet.write(0, 3, "User")
-    worksheet.write(0, 4, "Event")
-    worksheet.write(0, 5, "Time")
-    row = 1
-    column = 0
-    for apevent in appevent:
-        worksheet.write(row, column, apevent['OrgName'])
-        worksheet.write(row, column + 1, apevent['SpaceName'])
-        worksheet.write(row, column + 2, apevent['Application_Name'])
-        worksheet.write(row, column + 3, apevent['User'])
-        worksheet.write(row, column + 4, apevent['Event'])
-        worksheet.write(row, column + 5, apevent['Time'])
-        row += 1
-    workbook.close()
+        with open(destination, "w") as file:
+            profiler.report(file)
+
+
+def check_startup(args=None, profiler=None):
+    """Check the startup cost of the tool.
+
+    Fails when importing the module and parsing arguments took longer than
+    STARTUP_BUDGET or pulled in one of HEAVY_MODULES.  CI runs
+    ``cfoperations.py check-startup`` to keep subcommands fast to start.
+    """
+    elapsed = time() - STARTED
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    log("Startup took {0:.3f}s of a {1:.3f}s budget.".format(elapsed, STARTUP_BUDGET))
+    if loaded:
+        sys.exit("Heavy modules imported at startup: {0}".format(', '.join(loaded)))
+    if elapsed > STARTUP_BUDGET:
+        sys.exit("Startup exceeded its {0:.3f}s budget.".format(STARTUP_BUDGET))
+
+
+def prompt_credentials(username):
+    print('Enter Ldap password to login Cloud Foundry')
+    return {username: getpass.getpass('Password: ')}
+
+
+def configured_foundations(username, credentials):
+    """Return the configured foundations with their login usernames.
+
+    Passwords of usernames missing from credentials are prompted for and
+    added to it.
+    """
+    foundations = []
+    for foundation in load_foundations():
+        foundation = dict(foundation, username=foundation.get('username', username))
+        if foundation['username'] not in credentials:
+            print('Enter Ldap password of {0} for {1}'.format(foundation['username'], foundation['name']))
+            credentials[foundation['username']] = getpass.getpass('Password: ')
+        foundations.append(foundation)
+    return foundations
+
+
+def select_foundation(foundations, name):
+    selected = [f for f in foundations if name in (None, f.get('name'))]
+    if len(selected) != 1:
+        sys.exit("Select one of the configured foundations with -Foundation.")
+    return selected[0]
+
+
+def foundation_api(foundation, credentials, profiler=None):
+    """Return a foundation-wide client of the foundation's shared session."""
+    username = foundation['username']
+    return api_session(foundation['api_host'], foundation['login_host'], username, credentials[username],
+                       profiler, foundation.get('max_workers', 8)).scope()
+
 
-""" Below will be used for specific organization and space access"""
-    specific_space_cfapi_login(org_name, space_name, username, password)
-    if args.func == "delete_space":
-        delete_space()
+def report_dates(args):
+    """Return the event date range, yesterday by default."""
+    return args.StartDate or YDate, args.EndDate or YDate
+
+
+LOOKUP_KINDS = (
+    ('org', 'orgs'),
+    ('space', 'spaces'),
+    ('app', 'apps'),
+    ('service', 'service_instances'),
+    ('user-provided', 'user_provided_service_instances'),
+)
+
+
+def lookup(api, name, kinds=None):
+    """Find the resources of a foundation with the given name.
+
+    Every kind is queried with a ``name:`` filter concurrently, the orgs
+    and spaces of the matches are resolved with batched lookups.
+
+    Returns:
+        list(dict): 'kind', 'orgname', 'spacename', 'name' and 'guid' rows.
+    """
+    selected = [k for k in LOOKUP_KINDS if kinds is None or k[0] in kinds]
+    found = api.map_concurrent(
+        lambda kind: getattr(api, kind[1])(filters={'q': 'name:' + name}, records=True), selected)
+    spaces = {}
+    orgs = {}
+    matches = []
+    for (kind, _), records in zip(selected, found):
+        for r in records:
+            if kind == 'space':
+                spaces[r.guid] = (r.organization_guid, r.name)
+            elif kind == 'org':
+                orgs[r.guid] = r.name
+            matches.append((kind, r))
+    resolve_space_names(api, [getattr(r, 'space_guid', None) for _, r in matches], spaces, orgs)
+    rows = []
+    for kind, r in matches:
+        if kind == 'org':
+            orgid, spacename = r.guid, None
+        elif kind == 'space':
+            orgid, spacename = r.organization_guid, None
+        else:
+            orgid, spacename = spaces.get(r.space_guid, (None, None))
+        rows.append({'kind': kind, 'orgname': orgs.get(orgid), 'spacename': spacename,
+                     'name': r.name, 'guid': r.guid})
+    return rows
+
+
+def command_report(args, profiler=None):
+    credentials = prompt_credentials(args.cfUsername)
+    foundations = configured_foundations(args.cfUsername, credentials)
+    sdate, edate = report_dates(args)
+    sharding = None
+    if (args.Shards or args.ShardQueue) and not args.Snapshot:
+        sharding = {'processes': args.Shards, 'queue': args.ShardQueue, 'shard_size': args.ShardSize,
+                    'credentials': credentials}
+    filename = 'cfdetails-' + DATE + '.xlsx'
+    history = None
+    if args.CostHistory and not args.Snapshot:
+        from cfcost import CostHistory
+        history = CostHistory.load(args.CostHistory)
+    if sharding or args.Snapshot:
+        report = crawl_foundations(foundations, credentials, sdate, edate, profiler, sharding, args.Snapshot,
+                                   args.SpaceSummary, history)
+        write_report(report, filename, event_rows=args.EventRows, event_summary=args.EventSummary)
     else:
-        if path.isfile("tempcreds.txt"):
-            servicecredlist = []
-            with open("tempcreds.txt", "r") as f:
-                servicecredlist1 = yaml.safe_load(f)
-            for ser in servicecredlist1:
-                for ser1 in ser:
-                    servicecredlist.append(ser1)
-                    globals()[ser1] = ser[ser1]
+        stream_report(foundations, credentials, sdate, edate, filename, profiler, args.SpaceSummary,
+                      queue_size=args.PipelineDepth, event_rows=args.EventRows,
+                      event_summary=args.EventSummary, history=history)
+    if history is not None:
+        history.save()
+
+
+def command_events(args, profiler=None):
+    credentials = prompt_credentials(args.cfUsername)
+    foundations = configured_foundations(args.cfUsername, credentials)
+    sdate, edate = report_dates(args)
+    aggregator = None
+    if args.Summary:
+        from cfaggregate import EventAggregator
+        aggregator = EventAggregator(top=args.Top)
+    output = None
+    if args.Output or not args.Summary:
+        output = sys.stdout if args.Output in (None, '-') else open(args.Output, "w")
+    try:
+        for foundation in foundations:
+            api = foundation_api(foundation, credentials, profiler)
+            for event in iter_app_events(api, [], sdate, edate):
+                if aggregator is not None:
+                    aggregator.add_row(event_row(event, foundation.get('name', '')))
+                if output is not None:
+                    event = dict(event, Foundation=foundation.get('name', ''))
+                    output.write(json.dumps(event, sort_keys=True) + '\n')
+    finally:
+        if output not in (None, sys.stdout):
+            output.close()
+    if aggregator is not None:
+        summary = json.dumps(aggregator.summary(), indent=2, sort_keys=True) + '\n'
+        if args.Summary == '-':
+            sys.stdout.write(summary)
         else:
-            servicecredlist = generate_env()
+            with open(args.Summary, "w") as f:
+                f.write(summary)
+
+
+def command_env(args, profiler=None):
+    load_input()
+    credentials = prompt_credentials(args.cfUsername)
+    specific_space_cfapi_login(args.cfUsername, credentials[args.cfUsername], profiler)
+    servicecredlist = generate_env()
+    log("Saved the service credentials of {0} to tempcreds.txt.".format(servicecredlist))
+
+
+def command_teardown(args, profiler=None):
+    load_input()
+    credentials = prompt_credentials(args.cfUsername)
+    # Below will be used for specific organization and space access
+    specific_space_cfapi_login(args.cfUsername, credentials[args.cfUsername], profiler)
+    if args.DeleteSpace:
+        delete_space(ssspace_name)
+        return
+    if path.isfile("tempcreds.txt"):
+        servicecredlist = []
+        with open("tempcreds.txt", "r") as f:
+            servicecredlist1 = json.load(f)
+        for ser in servicecredlist1:
+            for ser1 in ser:
+                servicecredlist.append(ser1)
+                globals()[ser1] = ser[ser1]
+    else:
+        servicecredlist = generate_env()
     delete_all_cfapps()
-    delete_services()
+    delete_services(servicecredlist)
+
+
+def command_provision(args, profiler=None):
+    from cfprovision import Provisioner
+    manifest = load_input().get('PROVISION')
+    if not manifest:
+        sys.exit("input.yaml has no PROVISION section.")
+    credentials = prompt_credentials(args.cfUsername)
+    api = specific_space_cfapi_login(args.cfUsername, credentials[args.cfUsername], profiler)
+    result = Provisioner(api, args.PollInterval, args.ProvisionTimeout).provision(manifest)
+    for kind, name in result.existing:
+        log("{0} {1} already exists.".format(kind, name))
+    for kind, name in result.created:
+        log("Created {0} {1}.".format(kind, name))
+    for kind, name, error in result.failed:
+        log("Failed to create {0} {1}: {2}".format(kind, name, error))
+    if not result.ok:
+        sys.exit(1)
+
+
+def index_lookup(api, name, match='exact', kinds=None, org=None, space=None, label=None, bound_to=None,
+                 snapshot=None):
+    """Find the resources of a foundation with a local SearchIndex.
+
+    The index is built from an inventory: the snapshot refreshed by
+    crawling only its dirty spaces and saved again, or a full crawl
+    without snapshot.  Without api the snapshot is searched as it is.
+    Service labels and bindings are listed only when label or bound_to
+    need them.  The index lives for this one lookup, the snapshot is what
+    carries over to the next run.
+
+    Returns:
+        list(dict): 'kind', 'orgname', 'spacename', 'name', 'guid' and
+            'label' rows.
+    """
+    from cfinventory import Inventory
+    from cfsearch import SearchIndex
+    if api is None and (label is not None or bound_to is not None):
+        sys.exit("-Label and -BoundTo list services and bindings, they do not work with -Offline.")
+    inventory = Inventory.from_snapshot(snapshot) if snapshot and path.isfile(snapshot) else Inventory()
+    if api is not None:
+        inventory.refresh(api)
+        if snapshot:
+            inventory.save(snapshot)
+    index = SearchIndex()
+    index.sync(inventory)
+    if label is not None:
+        index.set_labels(api.service_catalog.load())
+    if bound_to is not None:
+        index.set_bindings(api.service_bind_guid('/v2/service_bindings', {'results-per-page': 100}))
+    try:
+        return index.search(name, match, kinds, org, space, label, bound_to)
+    except re.error as e:
+        sys.exit("Invalid regular expression {0}: {1}".format(name, e))
+
+
+def command_lookup(args, profiler=None):
+    local = (args.Match != 'exact' or args.Index or args.Offline or
+             any(a is not None for a in (args.Org, args.Space, args.Label, args.BoundTo)))
+    if args.Offline:
+        if not args.Index:
+            sys.exit("-Offline searches an -Index snapshot.")
+        rows = index_lookup(None, args.name, args.Match, args.Kind, args.Org, args.Space,
+                            snapshot=args.Index)
+    else:
+        credentials = prompt_credentials(args.cfUsername)
+        foundation = select_foundation(configured_foundations(args.cfUsername, credentials), args.Foundation)
+        api = foundation_api(foundation, credentials, profiler)
+        if local:
+            rows = index_lookup(api, args.name, args.Match, args.Kind, args.Org, args.Space, args.Label,
+                                args.BoundTo, args.Index and snapshot_file(args.Index, foundation))
+        else:
+            rows = lookup(api, args.name, args.Kind)
+    for row in sorted(rows,
+                      key=lambda r: (r['kind'], r['orgname'], r['spacename'], r['guid'])):
+        print('\t'.join(str(row[k] or '-') for k in ('kind', 'orgname', 'spacename', 'name', 'guid')))
+
+
+def command_watch(args, profiler=None):
+    credentials = prompt_credentials(args.cfUsername)
+    foundations = configured_foundations(args.cfUsername, credentials)
+    run_watch(foundations, credentials, args.PollInterval, args.ReconcileInterval, profiler)
+
 
+def command_serve(args, profiler=None):
+    credentials = prompt_credentials(args.cfUsername)
+    foundation = select_foundation(configured_foundations(args.cfUsername, credentials), args.Foundation)
+    run_serve(foundation, credentials, args.ServeAddress, args.PollInterval, args.ReconcileInterval, profiler)
 
 
+def command_shard_worker(args, profiler=None):
+    credentials = prompt_credentials(args.cfUsername)
+    foundations = configured_foundations(args.cfUsername, credentials)
+    run_shard_worker(args.ShardQueue, foundations, credentials)
+
+
+def api_options(args):
+    """Return the CfApi options selected on the command line.
+
+    --replay-api answers from a cassette, --record-api records the urllib2
+    transport, or with --http2-api the HTTP/2 transport, to one.
+    """
+    options = {'connect_timeout': args.ConnectTimeout, 'read_timeout': args.ReadTimeout}
+    if args.HedgeApi:
+        options.update(hedge=True, hedge_max_extra=args.HedgeApi)
+    if args.Http2Api:
+        options.update(http2=True, http2_max_streams=args.Http2Api,
+                       http2_connections=args.Http2Connections)
+    if args.ReplayApi or args.RecordApi:
+        from cftransport import (UrllibTransport, Http2Transport, RecordingTransport,
+                                 ReplayTransport)
+        if args.ReplayApi:
+            options['transport'] = ReplayTransport(args.ReplayApi, latency_scale=args.ReplayLatency)
+        else:
+            if args.Http2Api:
+                transport = Http2Transport(args.ConnectTimeout, args.ReadTimeout,
+                                           max_streams=args.Http2Api,
+                                           connections=args.Http2Connections)
+            else:
+                transport = UrllibTransport(args.ConnectTimeout, args.ReadTimeout)
+            options['transport'] = RecordingTransport(transport, args.RecordApi)
+    return options
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = ApiProfiler() if args.ProfileApi else None
+    API_OPTIONS.clear()
+    SESSIONS.clear()
+    if args.func is not check_startup:
+        API_OPTIONS.update(api_options(args))
+    try:
+        args.func(args, profiler)
+    finally:
+        if profiler is not None:
+            write_api_profile(profiler, args.ProfileApi)
+        if args.RecordApi and not args.ReplayApi:
+            API_OPTIONS['transport'].save()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,238 @@
+"""Threaded producer/consumer pipelines with bounded channels.
+
+Stages run in their own threads and pass items through Channels, bounded
+queues whose put blocks while the channel is full.  A slow consumer
+therefore slows its producers down instead of letting items pile up in
+memory, and producers and consumers overlap their work (for the report:
+network requests and JSON decoding against writing the workbook).
+
+The first error raised in any stage cancels the whole pipeline: blocked
+puts and gets in the other stages give up and the error is re-raised in
+the thread that leaves the Pipeline context.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+import sys
+import threading
+import Queue
+from time import time
+
+# Seconds between checks for cancellation while blocked on a channel.
+_POLL = 0.1
+
+
+class Cancelled(Exception):
+    """Raised in a stage blocked on a channel when the pipeline is cancelled."""
+
+
+class Channel(object):
+    """A bounded queue between two pipeline stages.
+
+    Args:
+        name (str): Name used in the statistics.
+        maxsize (int): Items the channel holds before put blocks.
+        cancelled (threading.Event): Set when the pipeline is cancelled.
+
+    Attributes:
+        items (int): Items put so far.
+        high_water (int): Most items held at once.
+        put_wait (float): Seconds producers spent blocked on a full channel.
+        get_wait (float): Seconds the consumer spent waiting for items.
+    """
+
+    _CLOSED = object()
+
+    def __init__(self, name, maxsize, cancelled):
+        self.name = name
+        self.maxsize = maxsize
+        self.items = 0
+        self.high_water = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+        self._queue = Queue.Queue(maxsize)
+        self._cancelled = cancelled
+        self._closed = False
+
+    def _put(self, item):
+        start = time()
+        while True:
+            if self._cancelled.is_set():
+                raise Cancelled()
+            try:
+                self._queue.put(item, timeout=_POLL)
+                break
+            except Queue.Full:
+                continue
+        self.put_wait += time() - start
+
+    def put(self, item):
+        """Add an item, blocking while the channel is full.
+
+        Raises:
+            Cancelled: When the pipeline is cancelled while waiting.
+        """
+        self._put(item)
+        self.items += 1
+        self.high_water = max(self.high_water, self._queue.qsize())
+
+    def close(self):
+        """Tell the consumer that no more items follow."""
+        self._put(self._CLOSED)
+
+    def drain(self):
+        """Return the items queued right now without waiting for more.
+
+        Lets a consumer with other work pick up whatever has arrived.
+        Iterating the channel afterwards yields the items that follow.
+
+        Raises:
+            Cancelled: When the pipeline is cancelled.
+        """
+        items = []
+        while not self._closed:
+            if self._cancelled.is_set():
+                raise Cancelled()
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is self._CLOSED:
+                self._closed = True
+            else:
+                items.append(item)
+        return items
+
+    def __iter__(self):
+        while not self._closed:
+            start = time()
+            while True:
+                if self._cancelled.is_set():
+                    raise Cancelled()
+                try:
+                    item = self._queue.get(timeout=_POLL)
+                    break
+                except Queue.Empty:
+                    continue
+            self.get_wait += time() - start
+            if item is self._CLOSED:
+                self._closed = True
+                return
+            yield item
+
+
+class Pipeline(object):
+    """A set of stages connected by channels.
+
+    Used as a context manager: leaving the context waits for every stage
+    and re-raises the first error raised by a stage.  An error in the
+    body of the with statement cancels the stages.
+
+    Keyword Args:
+        maxsize (Optional[int]): Default capacity of new channels.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.channels = []
+        self._threads = []
+        self._errors = []
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self._cancelled.set()
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(_POLL)
+        if self._errors and (exc_type is None or issubclass(exc_type, Cancelled)):
+            error = self._errors[0]
+            raise error[0], error[1], error[2]
+        return False
+
+    def cancel(self):
+        """Stop every stage at its next channel operation."""
+        self._cancelled.set()
+
+    def channel(self, name, maxsize=None):
+        """Create a channel.
+
+        Args:
+            name (str): Name used in the statistics.
+
+        Keyword Args:
+            maxsize (Optional[int]): Capacity, the pipeline default when
+                omitted.
+
+        Returns:
+            Channel: The new channel.
+        """
+        channel = Channel(name, maxsize or self.maxsize, self._cancelled)
+        self.channels.append(channel)
+        return channel
+
+    def spawn(self, func, *args):
+        """Run a stage in a new thread.
+
+        Args:
+            func (callable): The stage, called with args.
+        """
+        def run():
+            try:
+                func(*args)
+            except Cancelled:
+                pass
+            except BaseException:
+                with self._lock:
+                    self._errors.append(sys.exc_info())
+                self._cancelled.set()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def source(self, name, produce, maxsize=None):
+        """Run a producer stage feeding a new channel.
+
+        Args:
+            name (str): Name of the channel.
+            produce (callable): Called without arguments in the stage
+                thread, returns an iterable of the items to put.
+
+        Keyword Args:
+            maxsize (Optional[int]): Capacity of the channel.
+
+        Returns:
+            Channel: The channel to consume.
+        """
+        channel = self.channel(name, maxsize)
+
+        def run():
+            for item in produce():
+                channel.put(item)
+            channel.close()
+
+        self.spawn(run)
+        return channel
+
+    def stats(self):
+        """Describe how full the channels ran and who waited on whom.
+
+        Producers blocked on full channels mean the consumer is the
+        bottleneck, a consumer waiting on empty channels means the
+        producers are.
+
+        Returns:
+            list(str): One line per channel.
+        """
+        return ['{0}: {1} items, peak {2}/{3} queued, producer blocked {4:.2f}s, '
+                'consumer waited {5:.2f}s'.format(c.name, c.items, c.high_water, c.maxsize,
+                                                   c.put_wait, c.get_wait)
+                for c in self.channels]
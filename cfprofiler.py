@@ -0,0 +1,330 @@
+"""API call profiler for the Cloud Foundry API wrapper.
+
+Records every request sent by a CfApi instance together with the Python
+call site that triggered it, and reports the call sites that issue many
+near-identical requests (typically per-row lookups inside a loop) so it
+is clear where batching or caching would pay off.
+"""
+# pylint: disable=protected-access
+# pylint: disable=invalid-name
+#
+# The protected-access warnings are disabled because the profiler walks
+# interpreter frames with sys._getframe to find the caller of a request.
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+import os
+import re
+import sys
+import threading
+import urllib
+from time import time
+from functools import wraps
+from urlparse import urlparse, parse_qsl
+
+GUID_RE = re.compile(
+    r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+    r'[0-9a-fA-F]{12}')
+NUMBER_RE = re.compile(r'^\d+$')
+
+# Frames from these modules are plumbing, the call site is the first frame
+# outside of them.
+_INTERNAL_FILES = ('cloudfoundryapi.py', 'cfprofiler.py')
+
+# CfApi helpers that every public method funnels through.
+_PLUMBING = ('_request', '_request_all', 'wrapped_f', 'recorded', 'coalesced',
+             'map_concurrent', 'imap_concurrent', '_counted', 'counted', 'carried')
+
+# Thread pool frames reached when a pool thread runs a CfApi method
+# directly, the call site is then the one that submitted the work.
+_POOL_FILES = ('pool.py', 'threading.py')
+
+# The call site that submitted the work running on this thread, see
+# ApiProfiler.carry.
+_submitted = threading.local()
+
+
+def url_template(url):
+    """Reduce a request url to a template shared by near-identical calls.
+
+    GUIDs and numeric ids in the path are replaced with placeholders and
+    the query string is reduced to its sorted parameter names, so
+    ``/v2/spaces/<guid>`` fetched for many different spaces collapses into
+    a single template.
+
+    Args:
+        url (str): The full request url.
+
+    Returns:
+        str: The url template.
+    """
+    parsed = urlparse(url)
+    segments = []
+    for segment in parsed.path.split('/'):
+        if GUID_RE.match(segment):
+            segment = ':guid'
+        elif NUMBER_RE.match(segment):
+            segment = ':id'
+        segments.append(segment)
+    template = '/'.join(segments)
+    names = sorted(set(k for k, _ in parse_qsl(parsed.query)))
+    if names:
+        template = '{0}?{1}'.format(template, '&'.join(names))
+    return template
+
+
+def _call_site(depth=2):
+    """Find the caller of a request and the CfApi method it went through.
+
+    On a pool thread running a CfApi method directly there is no caller
+    outside the wrapper, the call site that submitted the work is used.
+
+    Keyword Args:
+        depth (Optional[int]): Frames to skip, those of the profiler.
+
+    Returns:
+        tuple: ``(call_site, api_method)`` where call_site is a
+            ``file:line (function)`` string for the first frame outside the
+            API wrapper and api_method is the outermost CfApi method used.
+    """
+    frame = sys._getframe(depth)
+    api_method = None
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        if filename in _POOL_FILES:
+            break
+        if filename not in _INTERNAL_FILES:
+            site = '{0}:{1} ({2})'.format(
+                filename, frame.f_lineno, code.co_name)
+            return site, api_method
+        if code.co_name not in _PLUMBING:
+            api_method = code.co_name
+        frame = frame.f_back
+    submitted = getattr(_submitted, 'call_site', None)
+    if submitted is not None:
+        return submitted[0], submitted[1] or api_method
+    return '<unknown>', api_method
+
+
+class ApiCall(object):
+    """A single recorded API request."""
+
+    __slots__ = ('method', 'url', 'template', 'call_site', 'api_method',
+                 'elapsed', 'error')
+
+    def __init__(self, method, url, call_site, api_method, elapsed,
+                 error=None):
+        self.method = method
+        self.url = url
+        self.template = url_template(url)
+        self.call_site = call_site
+        self.api_method = api_method
+        self.elapsed = elapsed
+        self.error = error
+
+
+class ApiProfiler(object):
+    """Collects API calls and reports batching and caching opportunities.
+
+    Keyword Args:
+        threshold (Optional[int]): Number of calls from one call site to
+            one url template before the call site is flagged.  Defaults to
+            10.
+    """
+
+    def __init__(self, threshold=10):
+        self.threshold = threshold
+        self.calls = []
+        self.single_flights = []
+        self.hedgers = []
+        self._lock = threading.Lock()
+
+    def wrap(self, request):
+        """Wrap a CfApi request function so every call is recorded.
+
+        Args:
+            request (callable): A function with the signature of
+                CfApi._request.
+
+        Returns:
+            callable: The wrapped function.
+        """
+        @wraps(request)
+        def recorded(url, headers=None, params=None, body=None,
+                     method='GET'):
+            # pylint: disable=missing-docstring
+            full_url = url
+            if params:
+                full_url = '?'.join([url, urllib.urlencode(
+                    sorted(params.items()), doseq=True)])
+            call_site, api_method = _call_site()
+            start = time()
+            error = None
+            try:
+                return request(url, headers=headers, params=params, body=body,
+                               method=method)
+            except Exception as e:
+                error = e.__class__.__name__
+                raise
+            finally:
+                self.record(ApiCall(str(method).upper(), full_url, call_site,
+                                    api_method, time() - start, error))
+
+        return recorded
+
+    def carry(self, func):
+        """Make requests of func, run on a pool thread, keep their call site.
+
+        Called on the submitting thread, e.g. by CfApi.map_concurrent.
+
+        Args:
+            func (callable): A function of one item.
+
+        Returns:
+            callable: The wrapped function.
+        """
+        call_site = _call_site()
+
+        def carried(item):
+            # pylint: disable=missing-docstring
+            previous = getattr(_submitted, 'call_site', None)
+            _submitted.call_site = call_site
+            try:
+                return func(item)
+            finally:
+                _submitted.call_site = previous
+
+        return carried
+
+    def track_single_flight(self, single_flight):
+        """Include the counters of a CfApi SingleFlight in the report.
+
+        Args:
+            single_flight (SingleFlight): The request coalescer.
+        """
+        with self._lock:
+            self.single_flights.append(single_flight)
+
+    def track_hedging(self, hedging):
+        """Include the counters of a HedgingTransport in the report.
+
+        Args:
+            hedging (HedgingTransport): The hedging transport.
+        """
+        with self._lock:
+            self.hedgers.append(hedging)
+
+    def record(self, call):
+        """Add a recorded call.
+
+        Args:
+            call (ApiCall): The call to add.
+        """
+        with self._lock:
+            self.calls.append(call)
+
+    def by_template(self):
+        """Group the recorded calls by HTTP method and url template.
+
+        Returns:
+            list(dict): One dict per template with the call count, total
+                time and the call sites using it, most frequent first.
+        """
+        groups = {}
+        for call in self.calls:
+            key = (call.method, call.template)
+            group = groups.setdefault(key, {
+                'method': call.method, 'template': call.template,
+                'count': 0, 'elapsed': 0.0, 'call_sites': set()})
+            group['count'] += 1
+            group['elapsed'] += call.elapsed
+            group['call_sites'].add(call.call_site)
+        return sorted(groups.values(), key=lambda g: (-g['count'], g['template']))
+
+    def hotspots(self):
+        """Find call sites issuing many near-identical requests.
+
+        A call site is flagged when it sends at least ``threshold`` requests
+        that share a url template.  Each hotspot is classified so the report
+        can suggest a fix:
+
+        * ``duplicate``: the same url is requested over and over, cache it.
+        * ``pagination``: only the page number changes, use larger pages.
+        * ``per-row``: a different resource is fetched per row, batch the
+          lookups with a ``q=guid IN ...`` filter or cache them.
+
+        Returns:
+            list(dict): Hotspots ordered by the time they cost.
+        """
+        sites = {}
+        for call in self.calls:
+            key = (call.call_site, call.method, call.template)
+            sites.setdefault(key, []).append(call)
+        hotspots = []
+        for (call_site, method, template), calls in sites.items():
+            if len(calls) < self.threshold:
+                continue
+            urls = set(c.url for c in calls)
+            if len(urls) == 1:
+                kind = 'duplicate'
+                advice = 'same url requested {0} times, cache the response'.format(
+                    len(calls))
+            elif len(set(re.sub(r'page=\d+', '', u) for u in urls)) == 1:
+                kind = 'pagination'
+                advice = 'paging through {0} pages, raise results-per-page'.format(
+                    len(urls))
+            else:
+                kind = 'per-row'
+                advice = ('{0} distinct resources fetched one by one, batch '
+                          'with a q=guid IN filter or cache'.format(len(urls)))
+            api_methods = sorted(set(c.api_method for c in calls if c.api_method))
+            hotspots.append({
+                'call_site': call_site, 'method': method, 'template': template,
+                'count': len(calls), 'distinct': len(urls),
+                'elapsed': sum(c.elapsed for c in calls),
+                'api_methods': api_methods, 'kind': kind, 'advice': advice})
+        return sorted(hotspots, key=lambda h: (-h['elapsed'], -h['count']))
+
+    def report(self, stream=None):
+        """Write a human readable profile report.
+
+        Args:
+            stream (Optional[file]): Where to write the report.  Defaults to
+                sys.stderr.
+        """
+        stream = stream if stream is not None else sys.stderr
+        total = sum(c.elapsed for c in self.calls)
+        print('API profile: {0} calls, {1:.2f}s in requests'.format(
+            len(self.calls), total), file=stream)
+        if self.single_flights:
+            print('Coalesced GETs: {0} of {1} answered by a request already in '
+                  'flight'.format(sum(f.saved for f in self.single_flights),
+                                  sum(f.requests for f in self.single_flights)),
+                  file=stream)
+        if self.hedgers:
+            print('Hedged GETs: {0} duplicates sent for {1} GETs, {2} answered '
+                  'first'.format(sum(h.hedged for h in self.hedgers),
+                                 sum(h.requests for h in self.hedgers),
+                                 sum(h.won for h in self.hedgers)),
+                  file=stream)
+        print('', file=stream)
+        print('Calls by url template:', file=stream)
+        for group in self.by_template():
+            print('  {0:>6} {1:>9.2f}s  {2} {3}  [{4} call site(s)]'.format(
+                group['count'], group['elapsed'], group['method'],
+                group['template'], len(group['call_sites'])), file=stream)
+        print('', file=stream)
+        hotspots = self.hotspots()
+        if not hotspots:
+            print('No call site issued {0} or more similar requests.'.format(
+                self.threshold), file=stream)
+            return
+        print('Batching/caching opportunities:', file=stream)
+        for h in hotspots:
+            via = ' via {0}'.format(', '.join(h['api_methods'])) if h['api_methods'] else ''
+            print('  {0}{1}'.format(h['call_site'], via), file=stream)
+            print('    {0} {1}: {2} calls, {3:.2f}s [{4}] {5}'.format(
+                h['method'], h['template'], h['count'], h['elapsed'],
+                h['kind'], h['advice']), file=stream)
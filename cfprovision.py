@@ -0,0 +1,234 @@
+"""Bulk provisioning of apps, services and bindings from a manifest.
+
+A manifest (the ``PROVISION`` section of input.yaml) lists managed service
+instances, user-provided service instances and apps with the services
+they bind::
+
+    services:
+      - name: my-db
+        broker: hsdp-rds
+        plan: postgres-micro-dev
+        parameters: {}
+    user_provided_services:
+      - name: my-config
+        credentials: {url: 'https://example.com'}
+    apps:
+      - name: my-app
+        services: [my-db, my-config]
+
+Provisioning is idempotent: what already exists in the target space is
+listed once up front and left alone.  The service catalog is resolved once,
+every missing instance and app is created concurrently, and managed
+instances that brokers create asynchronously are polled with one batched
+``q=guid IN ...`` listing per round.  An app is bound to a service as soon
+as the service is ready, so bindings to fast services do not wait for
+slow ones.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+from time import time, sleep
+from cfrecords import App, ServiceInstance, UserProvidedService
+
+# last_operation states of a managed service instance.
+IN_PROGRESS = 'in progress'
+FAILED = 'failed'
+
+
+class ProvisionResult(object):
+    """Outcome of a provisioning run.
+
+    Every list holds ``(kind, name)`` tuples, kind being ``service``,
+    ``user_provided_service``, ``app`` or ``binding``.  Binding names are
+    ``app -> service``.
+
+    Attributes:
+        created (list(tuple)): Resources created by this run.
+        existing (list(tuple)): Resources that already existed.
+        failed (list(tuple)): ``(kind, name, error)`` for resources that
+            could not be created.
+    """
+
+    def __init__(self):
+        self.created = []
+        self.existing = []
+        self.failed = []
+
+    @property
+    def ok(self):
+        """bool: True when nothing failed."""
+        return not self.failed
+
+
+class Provisioner(object):
+    """Creates the resources of a manifest in the space of a CfApi.
+
+    Args:
+        api (CfApi): An API instance logged in to the target org and space.
+
+    Keyword Args:
+        poll_interval (Optional[float]): Seconds between polls of service
+            instances that are still being created.
+        timeout (Optional[float]): Seconds to wait for asynchronous service
+            creation before giving up on the instance.
+    """
+
+    def __init__(self, api, poll_interval=5, timeout=1800):
+        self.api = api
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def _space_filter(self):
+        return {'q': 'space_guid:{0}'.format(self.api.space_guid)}
+
+    def _existing(self):
+        """List the instances and apps of the target space concurrently.
+
+        Returns:
+            tuple: Name to record dicts for managed instances, user-provided
+                instances and apps.
+        """
+        listings = [
+            lambda: self.api.service_instances(self._space_filter(), records=True),
+            lambda: self.api.user_provided_service_instances(self._space_filter(), records=True),
+            lambda: self.api.apps(self._space_filter(), records=True),
+        ]
+        return tuple(dict((r.name, r) for r in records)
+                     for records in self.api.map_concurrent(lambda f: f(), listings))
+
+    def _create(self, task):
+        """Create one resource, reporting errors as values."""
+        kind, spec = task
+        try:
+            if kind == 'service':
+                resource = self.api.create_service(
+                    spec['name'], spec['broker'], spec['plan'], spec.get('parameters'))
+                return kind, spec['name'], ServiceInstance.from_resource(resource), None
+            if kind == 'user_provided_service':
+                resource = self.api.create_user_provided_service(
+                    spec['name'], spec.get('credentials'))
+                return kind, spec['name'], UserProvidedService.from_resource(resource), None
+            resource = self.api.create_app(spec['name'])
+            return kind, spec['name'], App.from_resource(resource), None
+        except Exception as e:
+            return kind, spec['name'], None, e
+
+    def _bind(self, pair):
+        """Bind one service to one app, reporting errors as values."""
+        app, service = pair
+        try:
+            self.api.bind_service(service.guid, app.guid)
+            return pair, None
+        except Exception as e:
+            return pair, e
+
+    def provision(self, manifest):
+        """Create the missing resources of a manifest.
+
+        Args:
+            manifest (dict): The manifest, see the module docstring.
+
+        Returns:
+            ProvisionResult: What was created, found or failed.
+        """
+        result = ProvisionResult()
+        managed, user_provided, apps = self._existing()
+        tasks = []
+        for kind, specs, existing in (
+                ('service', manifest.get('services') or [], managed),
+                ('user_provided_service', manifest.get('user_provided_services') or [], user_provided),
+                ('app', manifest.get('apps') or [], apps)):
+            for spec in specs:
+                if spec['name'] in existing:
+                    result.existing.append((kind, spec['name']))
+                else:
+                    tasks.append((kind, spec))
+        if any(kind == 'service' for kind, _ in tasks):
+            # Resolve the catalog once, before the concurrent creates.
+            self.api.service_catalog.load()
+        for kind, name, record, error in self.api.map_concurrent(self._create, tasks):
+            if error is not None:
+                result.failed.append((kind, name, str(error)))
+                continue
+            result.created.append((kind, name))
+            {'service': managed, 'user_provided_service': user_provided,
+             'app': apps}[kind][name] = record
+
+        services = dict(managed)
+        services.update(user_provided)
+        wanted = []
+        for spec in manifest.get('apps') or []:
+            for service_name in spec.get('services') or []:
+                if spec['name'] not in apps:
+                    continue
+                if service_name not in services:
+                    result.failed.append(('binding', '{0} -> {1}'.format(spec['name'], service_name),
+                                          'unknown service instance'))
+                    continue
+                wanted.append((apps[spec['name']], services[service_name]))
+        bound = set()
+        if wanted:
+            bound = set((b['entity']['app_guid'], b['entity']['service_instance_guid'])
+                        for b in self.api.resources_in(
+                            '/v2/service_bindings', 'app_guid', set(a.guid for a, _ in wanted)))
+        pending = dict((managed[spec['name']].guid, managed[spec['name']])
+                       for spec in manifest.get('services') or []
+                       if spec['name'] in managed and
+                       managed[spec['name']].last_operation_state == IN_PROGRESS)
+        gone = set()
+        deadline = time() + self.timeout
+        while True:
+            waiting = []
+            ready = []
+            for app, service in wanted:
+                name = '{0} -> {1}'.format(app.name, service.name)
+                if (app.guid, service.guid) in bound:
+                    result.existing.append(('binding', name))
+                elif service.guid in pending:
+                    waiting.append((app, service))
+                elif (service.guid in gone or
+                      getattr(service, 'last_operation_state', None) == FAILED):
+                    result.failed.append(('binding', name, 'service instance creation failed'))
+                else:
+                    ready.append((app, service))
+            for (app, service), error in self.api.map_concurrent(self._bind, ready):
+                name = '{0} -> {1}'.format(app.name, service.name)
+                if error is not None:
+                    result.failed.append(('binding', name, str(error)))
+                else:
+                    result.created.append(('binding', name))
+            wanted = waiting
+            if not pending:
+                break
+            if time() > deadline:
+                for service in pending.values():
+                    result.failed.append(('service', service.name, 'not ready after {0}s'.format(
+                        self.timeout)))
+                for app, service in wanted:
+                    result.failed.append(('binding', '{0} -> {1}'.format(app.name, service.name),
+                                          'service instance not ready'))
+                break
+            sleep(self.poll_interval)
+            polled = dict((r.guid, r) for r in self.api.resources_in(
+                '/v2/service_instances', 'guid', list(pending), ServiceInstance))
+            for guid in list(pending):
+                record = polled.get(guid)
+                if record is not None and record.last_operation_state == IN_PROGRESS:
+                    continue
+                name = pending.pop(guid).name
+                if record is None:
+                    # Deleted while it was being created, e.g. by a broker
+                    # cleaning up after a failed create.
+                    gone.add(guid)
+                    error = 'service instance is gone'
+                elif record.last_operation_state == FAILED:
+                    error = 'creation failed'
+                else:
+                    continue
+                if ('service', name) in result.created:
+                    result.created.remove(('service', name))
+                result.failed.append(('service', name, error))
+            wanted = [(app, polled.get(service.guid, service)) for app, service in wanted]
+        return result
@@ -0,0 +1,266 @@
+"""Local read-only query service over a cached inventory.
+
+Serves the records of a cfinventory.Inventory over HTTP (TCP or a Unix
+socket) using the v2 Cloud Controller url layout and paginated response
+shape, so tools that read inventory data with CfApi can be pointed at the
+local service.  The service speaks plain HTTP and does not check tokens,
+build the client with ``scheme='http'`` and ``login=False``::
+
+    api = CfApi(api_host='127.0.0.1:8080', scheme='http', login=False)
+
+Every answer comes from memory.
+
+Supported requests (GET only)::
+
+    /v2/organizations /v2/spaces /v2/apps /v2/service_instances
+    /v2/user_provided_service_instances /v2/events
+    /v2/<collection>/<guid>
+    /v2/organizations/<guid>/spaces
+    /v2/spaces/<guid>/apps
+    /v2/spaces/<guid>/service_instances
+
+with ``q`` filters (``field:value``, ``field IN a,b``, ``field>value``,
+``field<value``, ``field>=value``, ``field<=value``), ``page``,
+``results-per-page`` and ``order-direction``.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+import json
+import os
+import re
+import urllib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from urlparse import urlparse, parse_qs
+
+# v2 collection path to inventory collection name.
+COLLECTIONS = {
+    'organizations': 'orgs',
+    'spaces': 'spaces',
+    'apps': 'apps',
+    'service_instances': 'services',
+    'user_provided_service_instances': 'user_provided_services',
+    'events': 'events',
+}
+
+# Nested listings: (parent collection, child collection) to the record
+# attribute linking the child to the parent.
+NESTED = {
+    ('organizations', 'spaces'): 'organization_guid',
+    ('spaces', 'apps'): 'space_guid',
+    ('spaces', 'service_instances'): 'space_guid',
+}
+
+FILTER_RE = re.compile(r'^(\w+)( IN |>=|<=|:|>|<)(.*)$')
+
+
+class QueryError(Exception):
+    """Raised for requests the service cannot answer."""
+
+    def __init__(self, status, description):
+        Exception.__init__(self, description)
+        self.status = status
+        self.description = description
+
+
+def record_value(inventory, record, field):
+    """Return a filterable field of a record.
+
+    Besides the record's own fields ``organization_guid`` is resolved
+    through the space for records that only know their space.
+    """
+    if field == 'organization_guid' and not hasattr(record, field):
+        space = inventory.spaces.get(getattr(record, 'space_guid', None))
+        return space.organization_guid if space is not None else None
+    if not hasattr(record, field):
+        raise QueryError(400, 'Unknown filter field {0}'.format(field))
+    return getattr(record, field)
+
+
+def make_filter(inventory, expression):
+    """Compile one v2 ``q`` expression into a predicate."""
+    match = FILTER_RE.match(expression)
+    if match is None:
+        raise QueryError(400, 'Invalid filter {0}'.format(expression))
+    field, op, value = match.groups()
+    if op == ' IN ':
+        values = frozenset(value.split(','))
+        return lambda r: record_value(inventory, r, field) in values
+    compare = {
+        ':': lambda a: a == value,
+        '>': lambda a: a is not None and a > value,
+        '<': lambda a: a is not None and a < value,
+        '>=': lambda a: a is not None and a >= value,
+        '<=': lambda a: a is not None and a <= value,
+    }[op]
+    return lambda r: compare(record_value(inventory, r, field))
+
+
+class InventoryQuery(object):
+    """Answers v2 style queries from an inventory.
+
+    Args:
+        inventory (Inventory): The inventory to query.
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def records(self, collection):
+        """Return a snapshot of the records of a v2 collection."""
+        if collection not in COLLECTIONS:
+            raise QueryError(404, 'Unknown collection {0}'.format(collection))
+        with self.inventory.lock:
+            items = self.inventory.collection(COLLECTIONS[collection])
+            return list(items) if collection == 'events' else list(items.values())
+
+    def resource(self, collection, guid):
+        """Return one record of a v2 collection as a resource."""
+        if collection not in COLLECTIONS:
+            raise QueryError(404, 'Unknown collection {0}'.format(collection))
+        with self.inventory.lock:
+            items = self.inventory.collection(COLLECTIONS[collection])
+            if collection == 'events':
+                record = next((e for e in items if e.guid == guid), None)
+            else:
+                record = items.get(guid)
+            if record is None:
+                raise QueryError(404, 'Resource {0} not found'.format(guid))
+            return record.to_resource()
+
+    def get(self, path, query):
+        """Answer a request.
+
+        Args:
+            path (str): The url path, e.g. ``/v2/apps``.
+            query (dict): Parsed query string, values are lists.
+
+        Returns:
+            dict: A v2 shaped resource or page.
+        """
+        parts = [p for p in path.split('/') if p]
+        if len(parts) < 2 or parts[0] != 'v2':
+            raise QueryError(404, 'Unknown path {0}'.format(path))
+        collection = parts[1]
+        if len(parts) == 3:
+            return self.resource(collection, parts[2])
+        predicates = [make_filter(self.inventory, q) for q in query.get('q', [])]
+        if len(parts) == 2:
+            records = self.records(collection)
+        elif len(parts) == 4 and (collection, parts[3]) in NESTED:
+            # Only the listed children are copied, never the parent collection.
+            link = NESTED[(collection, parts[3])]
+            parent = parts[2]
+            records = self.records(parts[3])
+            predicates.append(
+                lambda r: record_value(self.inventory, r, link) == parent)
+        else:
+            raise QueryError(404, 'Unknown path {0}'.format(path))
+        matched = [r for r in records if all(p(r) for p in predicates)]
+        return self.page(path, query, matched)
+
+    @staticmethod
+    def page(path, query, records):
+        """Slice matched records into a v2 page."""
+        order_key = 'timestamp' if records and hasattr(records[0], 'timestamp') else 'created_at'
+        records.sort(key=lambda r: (getattr(r, order_key) or '', r.guid),
+                     reverse=query.get('order-direction', ['asc'])[0] == 'desc')
+        try:
+            per_page = max(1, min(int(query.get('results-per-page', ['50'])[0]), 100))
+            page = max(1, int(query.get('page', ['1'])[0]))
+        except ValueError:
+            raise QueryError(400, 'Invalid page parameters')
+        total = len(records)
+        total_pages = (total + per_page - 1) // per_page
+
+        def page_url(number):
+            if number < 1 or number > total_pages:
+                return None
+            params = [(k, v) for k in sorted(query) for v in query[k]
+                      if k not in ('page', 'results-per-page')]
+            params += [('page', number), ('results-per-page', per_page)]
+            return '{0}?{1}'.format(path, urllib.urlencode(params))
+
+        start = (page - 1) * per_page
+        return {
+            'total_results': total,
+            'total_pages': total_pages,
+            'prev_url': page_url(page - 1),
+            'next_url': page_url(page + 1),
+            'resources': [r.to_resource() for r in records[start:start + per_page]],
+        }
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler delegating to the server's InventoryQuery."""
+
+    def do_GET(self):
+        # pylint: disable=missing-docstring
+        parsed = urlparse(self.path)
+        try:
+            status, body = 200, self.server.query.get(parsed.path, parse_qs(parsed.query))
+        except QueryError as e:
+            status, body = e.status, {'code': e.status, 'description': e.description}
+        payload = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ThreadingQueryServer(ThreadingMixIn, HTTPServer):
+    """Threaded TCP query server."""
+
+    daemon_threads = True
+
+
+class ThreadingUnixQueryServer(ThreadingMixIn, UnixStreamServer):
+    """Threaded Unix socket query server."""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(inventory, host='127.0.0.1', port=8080, unix_socket=None,
+                verbose=False):
+    """Create a query server for an inventory.
+
+    Args:
+        inventory (Inventory): The inventory to serve.
+
+    Keyword Args:
+        host (Optional[str]): TCP address to bind.
+        port (Optional[int]): TCP port to bind.
+        unix_socket (Optional[str]): Bind this Unix socket path instead of
+            a TCP address.
+        verbose (Optional[bool]): Log every request.
+
+    Returns:
+        SocketServer.BaseServer: The server, call serve_forever() to run it.
+    """
+    if unix_socket:
+        server = ThreadingUnixQueryServer(unix_socket, QueryRequestHandler)
+    else:
+        server = ThreadingQueryServer((host, port), QueryRequestHandler)
+    server.query = InventoryQuery(inventory)
+    server.verbose = verbose
+    return server
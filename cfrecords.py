@@ -0,0 +1,216 @@
+"""Compact records for Cloud Foundry v2 API resources.
+
+The v2 API returns every resource as a ``metadata``/``entity`` dict pair
+holding far more keys than the reports use.  The record classes in this
+module keep only a fixed set of fields in ``__slots__`` and are built
+straight from the page JSON, so large crawls hold a few pointers per
+resource instead of the full nested dicts.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+
+
+class Record(object):
+    """Base class for projected v2 resources.
+
+    Subclasses declare ``FIELDS``, an ordered tuple of
+    ``(name, path)`` pairs where path is the key sequence leading to the
+    value in the raw resource, and list the same names in ``__slots__``.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, **values):
+        for name, _ in self.FIELDS:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def field_names(cls):
+        """Return the names of all fields the record can hold.
+
+        Returns:
+            tuple(str): The field names.
+        """
+        return tuple(name for name, _ in cls.FIELDS)
+
+    @classmethod
+    def from_resource(cls, resource, fields=None):
+        """Build a record from a raw v2 resource.
+
+        Args:
+            resource (dict): A resource from the ``resources`` list of a v2
+                API page.
+
+        Keyword Args:
+            fields (Optional[iterable(str)]): Field names to project.  Fields
+                that are not requested are left as None.  Defaults to all
+                fields of the record.
+
+        Returns:
+            Record: The projected record.
+        """
+        record = cls.__new__(cls)
+        wanted = None if fields is None else frozenset(fields)
+        for name, path in cls.FIELDS:
+            value = None
+            if wanted is None or name in wanted:
+                value = resource
+                for key in path:
+                    if not isinstance(value, dict):
+                        value = None
+                        break
+                    value = value.get(key)
+            setattr(record, name, value)
+        return record
+
+    @classmethod
+    def from_page(cls, page, fields=None):
+        """Build records for every resource of a v2 API page.
+
+        Args:
+            page (dict): A deserialized v2 API page.
+
+        Keyword Args:
+            fields (Optional[iterable(str)]): See from_resource.
+
+        Returns:
+            list(Record): One record per resource.
+        """
+        fields = None if fields is None else frozenset(fields)
+        return [cls.from_resource(r, fields) for r in page.get('resources', [])]
+
+    def to_dict(self):
+        """Return the record as a flat dict of field names to values.
+
+        Returns:
+            dict: The field values.
+        """
+        return dict((name, getattr(self, name)) for name, _ in self.FIELDS)
+
+    def to_resource(self):
+        """Rebuild a v2 shaped ``metadata``/``entity`` dict from the record.
+
+        Only the projected fields are present in the result.
+
+        Returns:
+            dict: The resource.
+        """
+        resource = {'metadata': {}, 'entity': {}}
+        for name, path in self.FIELDS:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            target = resource
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+        return resource
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, ', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name, _ in self.FIELDS if getattr(self, name) is not None))
+
+
+_METADATA = (
+    ('guid', ('metadata', 'guid')),
+    ('url', ('metadata', 'url')),
+    ('created_at', ('metadata', 'created_at')),
+    ('updated_at', ('metadata', 'updated_at')),
+)
+
+
+class Org(Record):
+    """A Cloud Foundry organization."""
+
+    __slots__ = ('guid', 'url', 'created_at', 'updated_at', 'name', 'status')
+    FIELDS = _METADATA + (
+        ('name', ('entity', 'name')),
+        ('status', ('entity', 'status')),
+    )
+
+
+class Space(Record):
+    """A Cloud Foundry space."""
+
+    __slots__ = ('guid', 'url', 'created_at', 'updated_at', 'name',
+                 'organization_guid')
+    FIELDS = _METADATA + (
+        ('name', ('entity', 'name')),
+        ('organization_guid', ('entity', 'organization_guid')),
+    )
+
+
+class App(Record):
+    """A Cloud Foundry application."""
+
+    __slots__ = ('guid', 'url', 'created_at', 'updated_at', 'name', 'state',
+                 'space_guid', 'instances', 'memory', 'package_updated_at')
+    FIELDS = _METADATA + (
+        ('name', ('entity', 'name')),
+        ('state', ('entity', 'state')),
+        ('space_guid', ('entity', 'space_guid')),
+        ('instances', ('entity', 'instances')),
+        ('memory', ('entity', 'memory')),
+        ('package_updated_at', ('entity', 'package_updated_at')),
+    )
+
+
+class ServiceInstance(Record):
+    """A managed service instance."""
+
+    __slots__ = ('guid', 'url', 'created_at', 'updated_at', 'name',
+                 'space_guid', 'service_plan_guid', 'last_operation_type',
+                 'last_operation_state', 'last_operation_created_at')
+    FIELDS = _METADATA + (
+        ('name', ('entity', 'name')),
+        ('space_guid', ('entity', 'space_guid')),
+        ('service_plan_guid', ('entity', 'service_plan_guid')),
+        ('last_operation_type', ('entity', 'last_operation', 'type')),
+        ('last_operation_state', ('entity', 'last_operation', 'state')),
+        ('last_operation_created_at', ('entity', 'last_operation', 'created_at')),
+    )
+
+
+class UserProvidedService(Record):
+    """A user-provided service instance.
+
+    Credentials are deliberately not part of the record.
+    """
+
+    __slots__ = ('guid', 'url', 'created_at', 'updated_at', 'name',
+                 'space_guid', 'type')
+    FIELDS = _METADATA + (
+        ('name', ('entity', 'name')),
+        ('space_guid', ('entity', 'space_guid')),
+        ('type', ('entity', 'type')),
+    )
+
+
+class Event(Record):
+    """An audit event."""
+
+    __slots__ = ('guid', 'url', 'created_at', 'updated_at', 'type', 'actor',
+                 'actor_name', 'actee', 'actee_type', 'actee_name',
+                 'timestamp', 'space_guid', 'organization_guid')
+    FIELDS = _METADATA + (
+        ('type', ('entity', 'type')),
+        ('actor', ('entity', 'actor')),
+        ('actor_name', ('entity', 'actor_name')),
+        ('actee', ('entity', 'actee')),
+        ('actee_type', ('entity', 'actee_type')),
+        ('actee_name', ('entity', 'actee_name')),
+        ('timestamp', ('entity', 'timestamp')),
+        ('space_guid', ('entity', 'space_guid')),
+        ('organization_guid', ('entity', 'organization_guid')),
+    )
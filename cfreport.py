@@ -0,0 +1,229 @@
+"""Columnar report model for the Cloud Foundry inventory report.
+
+Report datasets are kept as one list (or NumPy array when NumPy is
+installed) per column instead of one dict per row.  Timestamps are parsed
+in bulk, durations are computed for a whole column against one reference
+time, and sorting and grouping work on row indices so large inventories
+stay cheap to reorder.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+from array import array
+from calendar import timegm
+from collections import OrderedDict
+from time import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float('nan')
+
+
+def parse_timestamps(values):
+    """Parse Cloud Foundry ISO 8601 timestamps to epoch seconds in bulk.
+
+    Accepts the ``YYYY-MM-DDTHH:MM:SSZ`` values returned by the v2 API.
+    Missing values become NaN.
+
+    Args:
+        values (list(str)): The timestamps to parse.
+
+    Returns:
+        array: Epoch seconds as a float64 NumPy array, or an ``array('d')``
+            when NumPy is not installed.
+    """
+    if numpy is not None:
+        cleaned = [v[:19] if v else 'NaT' for v in values]
+        stamps = numpy.array(cleaned, dtype='datetime64[s]')
+        seconds = stamps.astype('int64').astype('float64')
+        seconds[numpy.isnat(stamps)] = numpy.nan
+        return seconds
+    seconds = array('d')
+    for v in values:
+        if v:
+            seconds.append(timegm((int(v[0:4]), int(v[5:7]), int(v[8:10]),
+                                   int(v[11:13]), int(v[14:16]),
+                                   int(v[17:19]), 0, 0, 0)))
+        else:
+            seconds.append(NAN)
+    return seconds
+
+
+def format_duration(seconds):
+    """Format a number of seconds the way str(datetime.timedelta) does.
+
+    Args:
+        seconds (float): The duration in seconds.
+
+    Returns:
+        str: ``[D day[s], ]H:MM:SS`` or an empty string for NaN.
+    """
+    if seconds != seconds:
+        return ''
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    clock = '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+    if days:
+        return '{0} day{1}, {2}'.format(days, '' if abs(days) == 1 else 's', clock)
+    return clock
+
+
+class ReportTable(object):
+    """A column oriented table of report rows.
+
+    Args:
+        columns (list(str)): The column names, in order.
+    """
+
+    def __init__(self, columns):
+        self.columns = OrderedDict((name, []) for name in columns)
+
+    def __len__(self):
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def append(self, row):
+        """Append one row.
+
+        Args:
+            row (dict): Column name to value mapping.  Missing columns are
+                stored as None.
+        """
+        for name, values in self.columns.items():
+            values.append(row.get(name))
+
+    def extend(self, rows):
+        """Append several rows.
+
+        Args:
+            rows (iterable(dict)): Rows as accepted by append.
+        """
+        for row in rows:
+            self.append(row)
+
+    def add_column(self, name, values):
+        """Add or replace a whole column.
+
+        Args:
+            name (str): The column name.
+            values (sequence): One value per row.
+        """
+        if len(values) != len(self) and self.columns:
+            raise ValueError('Column {0} has {1} values, table has {2} rows.'.format(
+                name, len(values), len(self)))
+        self.columns[name] = values
+
+    def add_durations(self, source, now=None, seconds_column='duration_seconds',
+                      text_column='duration'):
+        """Compute the time elapsed since a timestamp column.
+
+        The timestamps are parsed once and every duration is computed
+        against the same reference time, so all rows of a report agree on
+        what "now" is.
+
+        Args:
+            source (str): Name of the column holding v2 API timestamps.
+
+        Keyword Args:
+            now (Optional[float]): Reference epoch seconds.  Defaults to the
+                current time.
+            seconds_column (Optional[str]): Column receiving the duration
+                as numeric seconds.
+            text_column (Optional[str]): Column receiving the formatted
+                duration.
+        """
+        now = time() if now is None else now
+        stamps = parse_timestamps(self.columns[source])
+        if numpy is not None:
+            seconds = now - stamps
+        else:
+            seconds = array('d', (now - s for s in stamps))
+        self.add_column(seconds_column, seconds)
+        self.add_column(text_column, [format_duration(s) for s in seconds])
+
+    def sort_indices(self, *keys):
+        """Return the row order sorted by the given columns.
+
+        Args:
+            *keys (str): Column names, most significant first.
+
+        Returns:
+            list(int): Row indices in sorted order.
+        """
+        if not keys or not len(self):
+            return list(range(len(self)))
+        if numpy is not None:
+            order = numpy.lexsort([numpy.asarray(self.columns[k]) for k in reversed(keys)])
+            return order.tolist()
+        columns = [self.columns[k] for k in keys]
+        return sorted(range(len(self)), key=lambda i: tuple(c[i] for c in columns))
+
+    def take(self, indices):
+        """Build a new table holding the given rows, in the given order.
+
+        Args:
+            indices (list(int)): Row indices.
+
+        Returns:
+            ReportTable: The new table.
+        """
+        table = ReportTable([])
+        for name, values in self.columns.items():
+            if numpy is not None and isinstance(values, numpy.ndarray):
+                table.columns[name] = values[indices]
+            elif isinstance(values, array):
+                table.columns[name] = array(values.typecode, (values[i] for i in indices))
+            else:
+                table.columns[name] = [values[i] for i in indices]
+        return table
+
+    def sort_by(self, *keys):
+        """Return a copy of the table sorted by the given columns.
+
+        Args:
+            *keys (str): Column names, most significant first.
+
+        Returns:
+            ReportTable: The sorted table.
+        """
+        return self.take(self.sort_indices(*keys))
+
+    def group_by(self, *keys):
+        """Group row indices by the values of the given columns.
+
+        Args:
+            *keys (str): Column names to group on.
+
+        Returns:
+            OrderedDict: Maps a tuple of key values to the list of row
+                indices in that group, in first-seen order.
+        """
+        columns = [self.columns[k] for k in keys]
+        groups = OrderedDict()
+        for i in range(len(self)):
+            groups.setdefault(tuple(c[i] for c in columns), []).append(i)
+        return groups
+
+    def rows(self, *names):
+        """Iterate over rows as tuples.
+
+        Args:
+            *names (str): The columns to include.  Defaults to all columns.
+
+        Yields:
+            tuple: One tuple of values per row.
+        """
+        columns = [self.columns[n] for n in (names or self.columns.keys())]
+        for i in range(len(self)):
+            yield tuple(c[i] for c in columns)
@@ -0,0 +1,281 @@
+"""Local search index over the orgs, spaces, apps and services of an Inventory.
+
+Finding resources by pattern through the API means listing every space
+of every org.  A SearchIndex answers the same questions from memory:
+names are kept in inverted indexes, a sorted name list for prefix
+queries and trigram postings for substring queries, regular expressions
+are matched once per distinct name.  Results can be narrowed to an org,
+a space, a service label or the resources bound to a given app or
+service.
+
+The index is fed from an Inventory (see cfinventory).  sync skips the
+collections whose version did not change since the last sync and, in the
+others, re-indexes only the records whose indexed fields changed, so a
+long-lived index over an inventory kept fresh by an InventoryWatcher
+follows it at the cost of the collections that changed.  Org and space
+names are resolved at query time, renaming a space does not re-index its
+apps.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+import re
+import threading
+from bisect import bisect_left, insort
+
+# Inventory collection to the kind reported by lookup.
+COLLECTION_KINDS = (
+    ('orgs', 'org'),
+    ('spaces', 'space'),
+    ('apps', 'app'),
+    ('services', 'service'),
+    ('user_provided_services', 'user-provided'),
+)
+
+MATCH_MODES = ('exact', 'prefix', 'substring', 'regex')
+
+
+def trigrams(text):
+    """Return the set of three character substrings of text."""
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class SearchIndex(object):
+    """Inverted indexes over resource names and their relationships.
+
+    Prefix and substring queries ignore case, exact and regex queries do
+    not (use ``(?i)`` in the pattern to ignore it).
+
+    Attributes:
+        labels (dict): Service plan GUIDs to service labels, see
+            set_labels.
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self._docs = {}
+        self._keys = dict((kind, set()) for _, kind in COLLECTION_KINDS)
+        self._versions = {}
+        self._names = {}
+        self._sorted = []
+        self._trigrams = {}
+        self._bound = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _index_name(self, name, key):
+        keys = self._names.get(name)
+        if keys is None:
+            keys = self._names[name] = set()
+            insort(self._sorted, (name.lower(), name))
+            for trigram in trigrams(name.lower()):
+                self._trigrams.setdefault(trigram, set()).add(name)
+        keys.add(key)
+
+    def _unindex_name(self, name, key):
+        keys = self._names[name]
+        keys.discard(key)
+        if keys:
+            return
+        del self._names[name]
+        del self._sorted[bisect_left(self._sorted, (name.lower(), name))]
+        for trigram in trigrams(name.lower()):
+            names = self._trigrams[trigram]
+            names.discard(name)
+            if not names:
+                del self._trigrams[trigram]
+
+    def add(self, kind, record):
+        """Index or re-index a record.
+
+        Args:
+            kind (str): The kind, see COLLECTION_KINDS.
+            record (cfrecords.Record): The org, space, app or service
+                instance.
+
+        Returns:
+            bool: True when the index changed.
+        """
+        key = (kind, record.guid)
+        doc = (record.name or '',
+               getattr(record, 'organization_guid', None),
+               getattr(record, 'space_guid', None),
+               getattr(record, 'service_plan_guid', None))
+        with self._lock:
+            previous = self._docs.get(key)
+            if previous == doc:
+                return False
+            if previous is not None:
+                self._unindex_name(previous[0], key)
+            self._docs[key] = doc
+            self._keys.setdefault(kind, set()).add(record.guid)
+            self._index_name(doc[0], key)
+        return True
+
+    def remove(self, kind, guid):
+        """Drop a record, missing records are ignored.
+
+        Returns:
+            bool: True when the record was indexed.
+        """
+        key = (kind, guid)
+        with self._lock:
+            doc = self._docs.pop(key, None)
+            if doc is not None:
+                self._keys[kind].discard(guid)
+                self._unindex_name(doc[0], key)
+        return doc is not None
+
+    def sync(self, inventory):
+        """Bring the index in line with an inventory.
+
+        Collections whose version did not change since the last sync
+        are skipped (see Inventory.versions).  In the others only records
+        that are new, gone or whose indexed fields changed are touched.
+
+        Args:
+            inventory (Inventory): The inventory.
+
+        Returns:
+            int: The number of records added, changed or removed.
+        """
+        changed = 0
+        with self._lock:
+            synced = dict(self._versions)
+        with inventory.lock:
+            collections = [(kind, inventory.versions[name], dict(inventory.collection(name)))
+                           for name, kind in COLLECTION_KINDS
+                           if synced.get(kind) != inventory.versions[name]]
+        with self._lock:
+            for kind, version, records in collections:
+                for record in records.values():
+                    changed += self.add(kind, record)
+                for guid in self._keys[kind].difference(records):
+                    changed += self.remove(kind, guid)
+                self._versions[kind] = version
+        return changed
+
+    def set_labels(self, catalog):
+        """Set the service labels of managed service instances.
+
+        Args:
+            catalog (dict): Service labels to plan names to plan GUIDs, as
+                returned by ServiceCatalog.load.
+        """
+        labels = {}
+        for label, plans in catalog.items():
+            for plan_guid in plans.values():
+                labels[plan_guid] = label
+        with self._lock:
+            self.labels = labels
+
+    def set_bindings(self, bindings):
+        """Set which apps are bound to which service instances.
+
+        Args:
+            bindings (list(dict)): Raw ``/v2/service_bindings`` resources.
+        """
+        bound = {}
+        for b in bindings:
+            app, instance = b['entity']['app_guid'], b['entity']['service_instance_guid']
+            bound.setdefault(app, set()).add(instance)
+            bound.setdefault(instance, set()).add(app)
+        with self._lock:
+            self._bound = bound
+
+    def _matching_names(self, pattern, match):
+        if match == 'exact':
+            return [pattern] if pattern in self._names else []
+        if match == 'regex':
+            regex = re.compile(pattern)
+            return [n for n in self._names if regex.search(n)]
+        lowered = pattern.lower()
+        if match == 'prefix':
+            names = []
+            i = bisect_left(self._sorted, (lowered,))
+            while i < len(self._sorted) and self._sorted[i][0].startswith(lowered):
+                names.append(self._sorted[i][1])
+                i += 1
+            return names
+        if match != 'substring':
+            raise ValueError('Unknown match mode {0}'.format(match))
+        if len(lowered) < 3:
+            return [n for n in self._names if lowered in n.lower()]
+        postings = sorted((self._trigrams.get(t, ()) for t in trigrams(lowered)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return [n for n in candidates if lowered in n.lower()]
+
+    def _where(self, kind, doc, guid):
+        """Return the org GUID and space GUID a document lives in."""
+        if kind == 'org':
+            return guid, None
+        if kind == 'space':
+            return doc[1], guid
+        space = self._docs.get(('space', doc[2]))
+        return (space[1] if space else None), doc[2]
+
+    def search(self, pattern, match='exact', kinds=None, org=None, space=None, label=None,
+               bound_to=None):
+        """Find resources by name.
+
+        Args:
+            pattern (str): The name, name prefix, substring or regular
+                expression, see match.
+
+        Keyword Args:
+            match (Optional[str]): One of MATCH_MODES.
+            kinds (Optional[iterable(str)]): Only these kinds.
+            org (Optional[str]): Only resources of the org with this name.
+            space (Optional[str]): Only resources of spaces with this name.
+            label (Optional[str]): Only managed service instances of this
+                service label, see set_labels.
+            bound_to (Optional[str]): Only apps bound to a service instance
+                with this name and service instances bound to an app with
+                this name, see set_bindings.
+
+        Returns:
+            list(dict): 'kind', 'orgname', 'spacename', 'name', 'guid' and
+                'label' rows.
+
+        Raises:
+            ValueError: For an unknown match mode.
+            re.error: For an invalid regular expression.
+        """
+        kinds = set(kinds) if kinds else None
+        rows = []
+        with self._lock:
+            for name in self._matching_names(pattern, match):
+                for kind, guid in self._names[name]:
+                    if kinds is not None and kind not in kinds:
+                        continue
+                    doc = self._docs[(kind, guid)]
+                    org_guid, space_guid = self._where(kind, doc, guid)
+                    org_doc = self._docs.get(('org', org_guid))
+                    space_doc = self._docs.get(('space', space_guid))
+                    orgname = org_doc[0] if org_doc else None
+                    spacename = space_doc[0] if space_doc and kind != 'space' else None
+                    if org is not None and orgname != org:
+                        continue
+                    if space is not None and (space_doc[0] if space_doc else None) != space:
+                        continue
+                    service_label = self.labels.get(doc[3]) if kind == 'service' else None
+                    if label is not None and service_label != label:
+                        continue
+                    if bound_to is not None and not any(
+                            self._bound_name(other) == bound_to
+                            for other in self._bound.get(guid, ())):
+                        continue
+                    rows.append({'kind': kind, 'orgname': orgname, 'spacename': spacename,
+                                 'name': name, 'guid': guid, 'label': service_label})
+        return rows
+
+    def _bound_name(self, guid):
+        for kind in ('app', 'service', 'user-provided'):
+            doc = self._docs.get((kind, guid))
+            if doc is not None:
+                return doc[0]
+        return None
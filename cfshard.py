@@ -0,0 +1,334 @@
+"""Sharded execution of crawl work across processes and hosts.
+
+Work is split into shards (for the report: small sets of orgs).  Shards
+are either handed to a local process pool or put on a directory based
+work queue that worker processes on other hosts consume, e.g. over a
+shared NFS mount.  Idle workers pull the next shard, so work is balanced
+dynamically, and a failed shard is retried on its own instead of
+restarting the run.
+
+Shards are plain dicts with an ``id``, an ``attempts`` counter and a
+JSON serializable ``payload``.  Shards on a FileWorkQueue also carry the
+``run`` they belong to, so results left over from an earlier run are
+never mistaken for results of the current one.  A task is a module level function taking
+the payload and returning a JSON serializable partial result.
+"""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import socket
+import traceback
+import Queue
+from time import time, sleep
+
+
+class ShardError(Exception):
+    """Raised when a shard keeps failing after all retries."""
+
+
+def make_shards(items, shard_size, payload=None):
+    """Split work items into shards.
+
+    Args:
+        items (list): The work items, e.g. org names.
+        shard_size (int): Items per shard.
+
+    Keyword Args:
+        payload (Optional[dict]): Extra payload shared by every shard.
+            Each shard's items are stored under ``items``.
+
+    Returns:
+        list(dict): The shards.
+    """
+    shards = []
+    for i in range(0, len(items), max(1, shard_size)):
+        shard_payload = dict(payload or {})
+        shard_payload['items'] = items[i:i + max(1, shard_size)]
+        shards.append({'id': len(shards), 'attempts': 0, 'payload': shard_payload})
+    return shards
+
+
+def new_run_id():
+    """Return a run id unique across hosts, ordered by start time."""
+    return '{0}.{1}.{2}'.format(int(time() * 1000), socket.gethostname(), os.getpid())
+
+
+def _guarded(task, shard):
+    """Run a task in a pool process and report errors as values."""
+    try:
+        return 'ok', shard, task(shard['payload'])
+    except Exception:
+        return 'error', shard, traceback.format_exc()
+
+
+def run_local(shards, task, processes, initializer=None, initargs=(),
+              max_attempts=3):
+    """Run shards on a local process pool.
+
+    Shards are submitted one task at a time so idle processes pick up the
+    next shard as soon as they finish.  Failed shards are resubmitted
+    until they have been attempted max_attempts times.
+
+    Args:
+        shards (list(dict)): Shards from make_shards.
+        task (callable): Module level function run with each payload.
+        processes (int): Number of worker processes.
+
+    Keyword Args:
+        initializer (Optional[callable]): Run once in every worker process.
+        initargs (Optional[tuple]): Arguments for initializer.
+        max_attempts (Optional[int]): Attempts per shard.
+
+    Returns:
+        list: Partial results, one per shard, in shard id order.
+    """
+    done = Queue.Queue()
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    results = {}
+    try:
+        for shard in shards:
+            pool.apply_async(_guarded, (task, shard), callback=done.put)
+        while len(results) < len(shards):
+            # A timeout keeps the wait interruptible with Ctrl-C.
+            try:
+                status, shard, value = done.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if status == 'ok':
+                results[shard['id']] = value
+                continue
+            shard['attempts'] += 1
+            if shard['attempts'] >= max_attempts:
+                raise ShardError('Shard {0} failed {1} times:\n{2}'.format(
+                    shard['id'], shard['attempts'], value))
+            pool.apply_async(_guarded, (task, shard), callback=done.put)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return [results[i] for i in sorted(results)]
+
+
+def _key(shard):
+    return shard.get('run', ''), shard['id']
+
+
+class FileWorkQueue(object):
+    """Directory based work queue shared by a coordinator and workers.
+
+    Shards move between ``pending``, ``claimed``, ``done`` and ``failed``
+    sub-directories with atomic renames, so any number of workers on any
+    host that sees the directory can consume it.  Claims older than the
+    lease are considered lost and requeued.  Shard files are named after
+    the run and the shard id, a queue directory serves one coordinator at
+    a time (see run_queue).
+
+    Args:
+        root (str): The queue directory.
+
+    Keyword Args:
+        lease (Optional[float]): Seconds a worker may hold a shard.
+        max_attempts (Optional[int]): Attempts per shard.
+    """
+
+    STATES = ('pending', 'claimed', 'done', 'failed')
+
+    def __init__(self, root, lease=1800, max_attempts=3):
+        self.root = root
+        self.lease = lease
+        self.max_attempts = max_attempts
+        for state in self.STATES:
+            path = os.path.join(root, state)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def _path(self, state, key):
+        return os.path.join(self.root, state, '{0}-{1}.json'.format(*key))
+
+    def _write(self, state, shard):
+        path = self._path(state, _key(shard))
+        tmp = '{0}.{1}.{2}.tmp'.format(path, socket.gethostname(), os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(shard, f)
+        os.rename(tmp, path)
+
+    def _read(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def _keys(self, state, run=None):
+        """Return the sorted (run, shard id) keys of the shards in a state."""
+        keys = []
+        for name in os.listdir(os.path.join(self.root, state)):
+            if not name.endswith('.json'):
+                continue
+            shard_run, _, shard_id = name[:-5].rpartition('-')
+            if run is None or shard_run == run:
+                keys.append((shard_run, int(shard_id)))
+        return sorted(keys)
+
+    def clear(self):
+        """Remove every shard, in any state, left over from earlier runs."""
+        for state in self.STATES:
+            directory = os.path.join(self.root, state)
+            for name in os.listdir(directory):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def put(self, shard):
+        """Add a shard to the pending queue."""
+        self._write('pending', shard)
+
+    def claim(self):
+        """Take the next pending shard.
+
+        Returns:
+            dict: The claimed shard or None when nothing is pending.
+        """
+        for key in self._keys('pending'):
+            claimed = self._path('claimed', key)
+            try:
+                os.rename(self._path('pending', key), claimed)
+            except OSError:
+                # Another worker was faster.
+                continue
+            os.utime(claimed, None)
+            return self._read(claimed)
+        return None
+
+    def complete(self, shard, result):
+        """Store the result of a claimed shard."""
+        shard = dict(shard, result=result)
+        self._write('done', shard)
+        self._remove('claimed', _key(shard))
+
+    def fail(self, shard, error):
+        """Return a failed shard to the queue or give up on it."""
+        shard = dict(shard, attempts=shard['attempts'] + 1, error=error)
+        state = 'failed' if shard['attempts'] >= self.max_attempts else 'pending'
+        self._write(state, shard)
+        self._remove('claimed', _key(shard))
+
+    def _remove(self, state, key):
+        try:
+            os.remove(self._path(state, key))
+        except OSError:
+            pass
+
+    def requeue_stale(self):
+        """Requeue shards whose worker held them longer than the lease.
+
+        Returns:
+            int: The number of shards requeued.
+        """
+        requeued = 0
+        for key in self._keys('claimed'):
+            path = self._path('claimed', key)
+            try:
+                if time() - os.path.getmtime(path) < self.lease:
+                    continue
+                shard = self._read(path)
+            except (OSError, IOError, ValueError):
+                continue
+            self.fail(shard, 'lease expired')
+            requeued += 1
+        return requeued
+
+    def collect(self, run=None):
+        """Read and remove finished shards.
+
+        Keyword Args:
+            run (Optional[str]): Only shards of this run, shards of other
+                runs are left alone.
+
+        Returns:
+            list(dict): Finished shards with their ``result``.
+
+        Raises:
+            ShardError: When a shard ran out of attempts.
+        """
+        failed = self._keys('failed', run)
+        if failed:
+            shard = self._read(self._path('failed', failed[0]))
+            raise ShardError('Shard {0} failed {1} times:\n{2}'.format(
+                shard['id'], shard['attempts'], shard.get('error')))
+        finished = []
+        for key in self._keys('done', run):
+            path = self._path('done', key)
+            finished.append(self._read(path))
+            os.remove(path)
+        return finished
+
+
+def run_queue(queue, shards, poll_interval=2):
+    """Coordinate shards through a FileWorkQueue and wait for the results.
+
+    Workers (see run_worker) must be started separately, on this or on
+    other hosts.  Shards left on the queue by an earlier run, finished or
+    not, are cleared first and the shards of this run are tagged with a
+    new run id, so a late worker of an earlier run cannot leak its result
+    into this one.
+
+    Args:
+        queue (FileWorkQueue): The shared queue.
+        shards (list(dict)): Shards from make_shards.
+
+    Keyword Args:
+        poll_interval (Optional[float]): Seconds between queue scans.
+
+    Returns:
+        list: Partial results, one per shard, in shard id order.
+    """
+    run = new_run_id()
+    queue.clear()
+    for shard in shards:
+        queue.put(dict(shard, run=run))
+    results = {}
+    while len(results) < len(shards):
+        queue.requeue_stale()
+        for shard in queue.collect(run):
+            results[shard['id']] = shard['result']
+        if len(results) < len(shards):
+            sleep(poll_interval)
+    return [results[i] for i in sorted(results)]
+
+
+def run_worker(queue, task, poll_interval=2, exit_when_idle=False):
+    """Consume shards from a FileWorkQueue.
+
+    Args:
+        queue (FileWorkQueue): The shared queue.
+        task (callable): Function run with each shard payload.
+
+    Keyword Args:
+        poll_interval (Optional[float]): Seconds to wait when idle.
+        exit_when_idle (Optional[bool]): Return once the queue is empty
+            instead of waiting for more work.
+
+    Returns:
+        int: The number of shards completed.
+    """
+    completed = 0
+    while True:
+        shard = queue.claim()
+        if shard is None:
+            if exit_when_idle:
+                return completed
+            sleep(poll_interval)
+            continue
+        try:
+            result = task(shard['payload'])
+        except Exception:
+            queue.fail(shard, traceback.format_exc())
+            continue
+        queue.complete(shard, result)
+        completed += 1
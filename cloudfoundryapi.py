@@ -14,10 +14,16 @@ import sys
 import json
 import urllib
 import urllib2
-from time import time
+from time import time, gmtime, strftime
 from functools import wraps
 from urlparse import urlparse
 import re
+import threading
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from cfrecords import Org, Space, App, ServiceInstance, UserProvidedService, Event
+from cftransport import UrllibTransport, Http2Transport, HedgingTransport
 
 
 def require_access_token(func):
@@ -30,44 +36,558 @@ def require_access_token(func):
         #
         # Disabled becuase it does not make sense to document the
         # inner function.
-        if self._access_token is None:
-            self.login()
-        elif time() > self._access_token_expire_time:
-            self.refresh_token()
+        self.session.authenticate()
         return func(self, *args, **kwargs)
 
     return wrapped_f
 
 
-class CfApi(object):
+class _Flight(object):
+    """A request in flight shared by every caller asking for it."""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical GET requests.
+
+    While a GET for a url, query and Authorization header is in flight,
+    further identical GETs wait for it and receive the same decoded
+    response instead of sending their own request.  Callers must treat
+    responses as read-only since they may be shared.
+
+    Attributes:
+        requests (int): GET requests seen.
+        saved (int): GET requests answered by a request already in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.requests = 0
+        self.saved = 0
+
+    def wrap(self, request):
+        """Wrap a CfApi request function with request coalescing.
+
+        Args:
+            request (callable): A function with the signature of
+                CfApi._request.
+
+        Returns:
+            callable: The wrapped function.
+        """
+        @wraps(request)
+        def coalesced(url, headers=None, params=None, body=None,
+                      method='GET'):
+            # pylint: disable=missing-docstring
+            if str(method).upper() != 'GET' or body is not None:
+                return request(url, headers=headers, params=params,
+                               body=body, method=method)
+            key = (url, urllib.urlencode(sorted((params or {}).items()), doseq=True),
+                   (headers or {}).get('Authorization'))
+            with self._lock:
+                self.requests += 1
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    self.saved += 1
+            if leader:
+                try:
+                    flight.result = request(url, headers=headers,
+                                            params=params, method=method)
+                except Exception as e:
+                    flight.error = e
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+            else:
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        return coalesced
+
+
+class RequestCounter(object):
+    """Counts the requests sent while it is active, see CfApi.counting.
+
+    Attributes:
+        requests (int): Requests sent to the transport.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        """Count one request."""
+        with self._lock:
+            self.requests += 1
+
+
+class ServiceKeyManager(object):
+    """Session cache of service keys and their credentials.
+
+    Keys of many service instances are listed with one bulk
+    ``q=service_instance_guid IN ...`` query and kept in memory for the
+    lifetime of the CfApi instance.  Keys are only created or deleted when
+    explicitly requested, existing keys are reused.
+
+    Args:
+        api (CfApi): The API instance used to talk to the Cloud Controller.
+    """
+
+    def __init__(self, api):
+        self._api = api
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def load(self, instance_guids):
+        """Bulk load the keys of several service instances into the cache.
+
+        Instances already cached are not listed again.
+
+        Args:
+            instance_guids (list(str)): The service instance GUIDs.
+        """
+        with self._lock:
+            missing = [g for g in set(instance_guids) if g not in self._keys]
+        url = '{0}/v2/service_keys'.format(self._api.api_url)
+        for chunk, filters in self._api._in_filter_chunks(
+                url, 'service_instance_guid', sorted(missing)):
+            keys = dict((g, []) for g in chunk)
+            for key in self._api.service_keys(filters=filters):
+                keys.setdefault(key['entity']['service_instance_guid'], []).append(key)
+            with self._lock:
+                self._keys.update(keys)
+
+    def keys(self, instance_guid):
+        """Return the cached keys of a service instance.
+
+        Args:
+            instance_guid (str): The service instance GUID.
+
+        Returns:
+            list(dict): The service key resources.
+        """
+        self.load([instance_guid])
+        with self._lock:
+            return list(self._keys.get(instance_guid, []))
+
+    def credentials(self, instance_guid, create=False, key_name='testkey'):
+        """Return credentials of a service instance from an existing key.
+
+        Args:
+            instance_guid (str): The service instance GUID.
+
+        Keyword Args:
+            create (Optional[bool]): Create key_name when the instance has no
+                key yet.  The new key is kept and reused.
+            key_name (Optional[str]): Name of the key to create.
+
+        Returns:
+            dict: The credentials, or None when the instance has no key and
+                create is False.
+        """
+        keys = self.keys(instance_guid)
+        if not keys:
+            if not create:
+                return None
+            keys = [self.create(instance_guid, key_name)]
+        named = [k for k in keys if k['entity'].get('name') == key_name]
+        return (named or keys)[0]['entity'].get('credentials')
+
+    def create(self, instance_guid, key_name):
+        """Create a service key and add it to the cache.
+
+        Args:
+            instance_guid (str): The service instance GUID.
+            key_name (str): The name of the new key.
+
+        Returns:
+            dict: The new service key resource.
+        """
+        key = self._api.create_service_key(instance_guid, key_name)
+        with self._lock:
+            self._keys.setdefault(instance_guid, []).append(key)
+        return key
+
+    def delete(self, instance_guid, key_name=None):
+        """Delete keys of a service instance.
+
+        Args:
+            instance_guid (str): The service instance GUID.
+
+        Keyword Args:
+            key_name (Optional[str]): Only delete the key with this name.
+                All keys of the instance are deleted when omitted.
+        """
+        for key in self.keys(instance_guid):
+            if key_name is None or key['entity'].get('name') == key_name:
+                self._api.delete_service_key_url(key['metadata']['url'])
+                with self._lock:
+                    self._keys[instance_guid] = [
+                        k for k in self._keys.get(instance_guid, [])
+                        if k['metadata']['url'] != key['metadata']['url']
+                    ]
+
+    def forget(self, instance_guid):
+        """Drop a service instance from the cache.
+
+        Args:
+            instance_guid (str): The service instance GUID.
+        """
+        with self._lock:
+            self._keys.pop(instance_guid, None)
+
+
+class ServiceCatalog(object):
+    """Session cache of the marketplace: service labels to plan GUIDs.
+
+    The services and service plans are listed once, concurrently, on first
+    use and kept for the lifetime of the CfApi instance, so provisioning
+    many instances does not list the catalog again for every instance.
+
+    Args:
+        api (CfApi): The API instance used to talk to the Cloud Controller.
+    """
+
+    def __init__(self, api):
+        self._api = api
+        self._plans = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the catalog, listing it on first use.
+
+        Returns:
+            dict: Service labels to dicts of plan names to plan GUIDs.
+        """
+        with self._lock:
+            if self._plans is None:
+                services, plans = self._api.map_concurrent(
+                    lambda listing: listing(), [self._api.services,
+                                                self._api.service_plans])
+                labels = dict((s['metadata']['guid'], s['entity']['label'])
+                              for s in services)
+                catalog = dict((label, {}) for label in labels.values())
+                for p in plans:
+                    label = labels.get(p['entity']['service_guid'])
+                    if label is not None:
+                        catalog[label][p['entity']['name']] = p['metadata']['guid']
+                self._plans = catalog
+            return self._plans
+
+    def plan_guid(self, broker_name, plan_name):
+        """Resolve a service plan.
+
+        Args:
+            broker_name (str): The service label, e.g. ``hsdp-rds``.
+            plan_name (str): The plan name.
+
+        Returns:
+            str: The service plan GUID.
+
+        Raises:
+            ValueError: When the service or the plan is unknown.
+        """
+        catalog = self.load()
+        if broker_name not in catalog:
+            raise ValueError('Unknown service broker.')
+        if plan_name not in catalog[broker_name]:
+            raise ValueError('Invalid service plan')
+        return catalog[broker_name][plan_name]
+
+    def forget(self):
+        """Drop the cached catalog so it is listed again on next use."""
+        with self._lock:
+            self._plans = None
+
+
+class CfSession(object):
+    """Login, transport, caches and metrics shared by scoped CfApi clients.
+
+    A session belongs to one foundation and user.  It holds the UAA token,
+    the transport with its connections, request coalescing, the profiler,
+    the marketplace and service key caches, and the org and space GUIDs
+    resolved so far.  Clients returned by scope share all of it, so working
+    in many orgs and spaces at once costs no extra logins, connections or
+    repeated lookups.
+
+    Keyword Args:
+        api_host (str): The Cloud Controller host.
+        login_host (str): The UAA host.
+        username (str): The user logging in.
+        password (str): The user's password.
+        scheme (Optional[str]): The url scheme of both hosts, 'https' unless
+            talking to a local stand-in such as a cfquery server.
+        login (Optional[bool]): Log in to UAA before the first request.
+            Disable it for servers that do not check tokens.
+        max_workers (Optional[int]): Default concurrency of scoped clients.
+        max_url_length (Optional[int]): Longest url sent, see
+            CfApi.resources_in.
+        transport (Optional[object]): The transport, see cftransport.
+            Built from the options below when omitted.
+        connect_timeout (Optional[float]): Seconds to wait for a connection.
+        read_timeout (Optional[float]): Seconds to wait for each read.
+        http2 (Optional[bool]): Use the multiplexed Http2Transport, with
+            http2_max_streams and http2_connections.
+        hedge (Optional[bool]): Hedge slow GETs, adding at most
+            hedge_max_extra requests, see HedgingTransport.
+        profiler (Optional[ApiProfiler]): Records every request.
+        coalesce (Optional[bool]): Share identical concurrent GETs.
+    """
 
     def __init__(self, **kwargs):
         self.api_host = kwargs.get('api_host', '')
         self.login_host = kwargs.get('login_host', '')
         self.username = kwargs.get('username', '')
         self.password = kwargs.get('password', '')
-        self.org_name = kwargs.get('org_name', '')
-        self.space_name = kwargs.get('space_name', '')
-        self.org_guid = None
-        self.space_guid = None
+        self.scheme = kwargs.get('scheme', 'https')
+        self.api_url = '{0}://{1}'.format(self.scheme, self.api_host)
+        self.login_enabled = kwargs.get('login', True)
+        self.max_workers = kwargs.get('max_workers', 8)
+        self.max_url_length = kwargs.get('max_url_length', 4096)
         self._access_token = None
         self._access_token_expire_time = 0
         self._refresh_token = None
         self._client_id = 'cf'
         self._client_secret = ''
-        self._resolve_instance_guids()
+        self._token_lock = threading.RLock()
+        self.transport = kwargs.get('transport')
+        if self.transport is None and kwargs.get('http2'):
+            self.transport = Http2Transport(
+                kwargs.get('connect_timeout', 10), kwargs.get('read_timeout', 120),
+                max_streams=kwargs.get('http2_max_streams', 100),
+                connections=kwargs.get('http2_connections', 2))
+        elif self.transport is None:
+            self.transport = UrllibTransport(
+                kwargs.get('connect_timeout', 10), kwargs.get('read_timeout', 120))
+        self.hedging = None
+        if kwargs.get('hedge'):
+            self.hedging = HedgingTransport(
+                self.transport, max_extra=kwargs.get('hedge_max_extra', 0.05))
+            self.transport = self.hedging
+        self.profiler = kwargs.get('profiler')
+        if self.profiler is not None:
+            self._request = self.profiler.wrap(self._request)
+        self.single_flight = None
+        if kwargs.get('coalesce', True):
+            self.single_flight = SingleFlight()
+            self._request = self.single_flight.wrap(self._request)
+            if self.profiler is not None:
+                self.profiler.track_single_flight(self.single_flight)
+        if self.profiler is not None and self.hedging is not None:
+            self.profiler.track_hedging(self.hedging)
+        self._org_guids = {}
+        self._space_guids = {}
+        self._lock = threading.Lock()
+        # The unscoped client the shared caches list through.
+        self.api = CfApi(session=self)
+        self.service_key_manager = ServiceKeyManager(self.api)
+        self.service_catalog = ServiceCatalog(self.api)
+
+    def scope(self, org_name='', space_name='', **kwargs):
+        """Return a client for an org and space sharing this session.
+
+        Keyword Args:
+            org_name (Optional[str]): The org, none for foundation-wide work.
+            space_name (Optional[str]): The space within the org.
+            max_workers (Optional[int]): Concurrency of the client, the
+                session default when omitted.
+
+        Returns:
+            CfApi: The scoped client.
+        """
+        return CfApi(session=self, org_name=org_name, space_name=space_name, **kwargs)
 
     @property
     def bearer_token(self):
         return 'Bearer {0}'.format(self._access_token)
 
-    @staticmethod
-    def _request(url, headers=None, params=None, body=None, method='GET'):
-        """Construct and send HTTP request.
+    def _request(self, url, headers=None, params=None, body=None, method='GET'):
+        """Send an HTTP request through the transport, see CfApi._request."""
+        return self.transport.request(url, headers=headers, params=params,
+                                      body=body, method=method)
+
+    def authenticate(self):
+        """Log in, or refresh the token once it has expired."""
+        if not self.login_enabled:
+            return
+        if (self._access_token is None or
+                time() > self._access_token_expire_time):
+            with self._token_lock:
+                if self._access_token is None:
+                    self.login()
+                elif time() > self._access_token_expire_time:
+                    self.refresh_token()
+
+    def _update_tokens(self, response):
+        """Updates all token attributes for the session.
+
+        Internal function to update all token related attributes whenever
+        login or refresh_token is called.
+
+        Args:
+            response (dict): The server response from a token-based operation
+                deserialized to a python dict.
+        """
+        expire_time = int(time() - 60) + int(response['expires_in'])
+        self._access_token = response['access_token']
+        self._refresh_token = response['refresh_token']
+        self._access_token_expire_time = expire_time
+
+    def login(self):
+        """Login to UAA and store token for future calls.
+
+        Uses username and password attributes to login to the UAA instance
+        defined in login_host.  The token and all information needed to refresh
+        the token on expiry are also stored as local attributes to the session.
+        """
+        url = "{0}://{1}/oauth/token".format(self.scheme, self.login_host)
+        body = {
+            'grant_type': 'password',
+            'username': self.username,
+            'password': self.password,
+            'client_id': self._client_id
+        }
+        headers = {'Authorization': 'Basic Y2Y6', 'Accept': 'application/json'}
+        response = self._request(
+            url, headers=headers, body=body, method='POST')
+        self._update_tokens(response)
+
+    def refresh_token(self):
+        """Refresh an expired token.
+
+        This will use the refresh_token to renew the access token.  Typically
+        not called directly since token operations for most other functions
+        that require tokens use the require_access_token decorator.
+        """
+        url = "{0}://{1}/oauth/token".format(self.scheme, self.login_host)
+        body = {
+            'grant_type': 'refresh_token',
+            'client_id': self._client_id,
+            'client_secret': self._client_secret,
+            'refresh_token': self._refresh_token
+        }
+        headers = {'Accept': 'application/json'}
+        response = self._request(
+            url, headers=headers, body=body, method='POST')
+        self._update_tokens(response)
+
+    def resolve(self, org_name, space_name=''):
+        """Resolve org and space names to GUIDs, once per session.
+
+        The spaces of an org are listed together, so further spaces of the
+        same org resolve without requests.
+
+        Args:
+            org_name (str): The org name.
+
+        Keyword Args:
+            space_name (Optional[str]): The space name.
+
+        Returns:
+            tuple: The org GUID, empty when there is no such org, and the
+                space GUID, None when there is no such space.
+        """
+        with self._lock:
+            org_guid = self._org_guids.get(org_name)
+        if org_guid is None:
+            org_guid = self.api.get_org_guid(org_name)
+            if org_guid:
+                with self._lock:
+                    self._org_guids[org_name] = org_guid
+        if not space_name or not org_guid:
+            return org_guid, None
+        with self._lock:
+            spaces = self._space_guids.get(org_guid)
+        if spaces is None:
+            spaces = dict((s.name, s.guid) for s in self.api.org_spaces(
+                org_guid, records=True, fields=('name', 'guid')))
+            with self._lock:
+                self._space_guids[org_guid] = spaces
+        return org_guid, spaces.get(space_name)
+
+    def forget_spaces(self):
+        """Drop the cached space GUIDs, e.g. after deleting a space."""
+        with self._lock:
+            self._space_guids.clear()
+
+
+class CfApi(object):
+    """Client for the Cloud Controller, optionally scoped to an org and space.
+
+    Clients of a CfSession share its login, transport and caches, see
+    CfSession.scope.  Without a session, the keyword arguments of
+    CfSession build a private one.
+
+    Keyword Args:
+        session (Optional[CfSession]): The session to share.
+        org_name (Optional[str]): The org resolved to org_guid.
+        space_name (Optional[str]): The space resolved to space_guid.
+        max_workers (Optional[int]): Concurrency of map_concurrent and
+            imap_concurrent, the session default when omitted.
+    """
+
+    def __init__(self, **kwargs):
+        session = kwargs.get('session')
+        if session is None:
+            # A private session builds its unscoped client without us.
+            session = CfSession(**dict((k, v) for k, v in kwargs.items()
+                                       if k not in ('org_name', 'space_name')))
+        self.session = session
+        self.api_host = session.api_host
+        self.api_url = session.api_url
+        self.login_host = session.login_host
+        self.org_name = kwargs.get('org_name', '')
+        self.space_name = kwargs.get('space_name', '')
+        self.org_guid = None
+        self.space_guid = None
+        self.max_workers = kwargs.get('max_workers', session.max_workers)
+        self.max_url_length = session.max_url_length
+        self._local = threading.local()
+        self._resolve_instance_guids()
+
+    @property
+    def service_key_manager(self):
+        return self.session.service_key_manager
+
+    @property
+    def service_catalog(self):
+        return self.session.service_catalog
+
+    @property
+    def transport(self):
+        return self.session.transport
+
+    @property
+    def profiler(self):
+        return self.session.profiler
+
+    def scope(self, org_name='', space_name='', **kwargs):
+        """Return a client for another org and space of the same session."""
+        return self.session.scope(org_name, space_name, **kwargs)
+
+    @property
+    def bearer_token(self):
+        return self.session.bearer_token
+
+    def _request(self, url, headers=None, params=None, body=None, method='GET'):
+        """Send an HTTP request through the transport.
 
         Should be considered internal to this class.  This is used by other
-        high level functions to create a request object and send the request
-        to the remote host.
+        high level functions to send a request to the remote host.
 
         Args:
             url (str): The url to send the request to.
@@ -78,6 +598,7 @@ class CfApi(object):
             params (Optional[dict]): A dict of query parameters that should be
                 attached to the request.  Should be simple key value pairs that
                 will be converted to a query string and appended to the url.
+                A list value repeats the parameter, e.g. several q filters.
             body (Optional[dict]): The body of the request.  Dict will be
                 converted to urlencoded string and attached to the request.
             method (Optional[str]): The HTTP method to use for the request.
@@ -86,34 +607,11 @@ class CfApi(object):
         Returns:
             object: The deserialized JSON response from the remote host.
         """
-        headers = headers if headers else {}
-        if params:
-            url = '?'.join([url, urllib.urlencode(params)])
-        req = urllib2.Request(url)
-        for k, v in headers.iteritems():
-            req.add_header(k, v)
-        req.get_method = lambda: str(method).upper()
-        if body is not None:
-            try:
-                body = urllib.urlencode(body)
-            except TypeError:
-                # pylint: disable=redefined-variable-type
-                #
-                # Certain API calls expect the content type to be
-                # urlencoded but the body to actually be a json string
-                # rather than an urlencoded string.  If we get a
-                # TypeError here we assume the caller knows what they
-                # are doing and just pass it along.
-                body = body
-            req.add_header(
-                'Content-Type', 'application/x-www-form-urlencoded')
-            res = urllib2.urlopen(req, body)
-        else:
-            res = urllib2.urlopen(req)
-        response = res.read()
-        if response:
-            response = json.loads(response)
-        return response
+        counter = getattr(self._local, 'counter', None)
+        if counter is not None:
+            counter.add()
+        return self.session._request(url, headers=headers, params=params,
+                                     body=body, method=method)
 
     def _request_all(self, *args, **kwargs):
         """Generator function to get all pages when present in response.
@@ -122,15 +620,301 @@ class CfApi(object):
         if you expect a paged response from the server.  See _request
         for supported args and kwargs.
         """
+        args = list(args)
         while True:
             response = self._request(*args, **kwargs)
             yield response
             if 'next_url' in response and response['next_url']:
-                params = urlparse(response['next_url']).query.split('&')
-                kwargs['params'] = dict([p.split('=') for p in params])
+                # next_url is already encoded and may repeat q, follow it
+                # as is instead of re-encoding its query.
+                base = urlparse(args[0])
+                args[0] = '{0}://{1}{2}'.format(
+                    base.scheme, base.netloc, response['next_url'])
+                kwargs['params'] = None
             else:
                 break
 
+    def _list_resources(self, url, filters=None, record_cls=None, fields=None):
+        """Collect the resources of every page of a paged listing.
+
+        Should be considered internal to this class.  When record_cls is
+        given each page is projected to records as soon as it arrives, so
+        the raw page JSON can be released before the next page is fetched.
+
+        Args:
+            url (str): The url of the listing.
+
+        Keyword Args:
+            filters (Optional[dict]): Query params for the listing.
+            record_cls (Optional[type]): A cfrecords.Record subclass to build
+                from each resource.  Raw resource dicts are returned when
+                this is None.
+            fields (Optional[iterable(str)]): Fields to project into the
+                records.  Defaults to all fields of record_cls.
+
+        Returns:
+            list: Raw resource dicts or records.
+        """
+        headers = {'Authorization': self.bearer_token}
+        resources = []
+        for r in self._request_all(url, params=filters, headers=headers):
+            if record_cls is None:
+                resources.extend(r['resources'])
+            else:
+                resources.extend(record_cls.from_page(r, fields))
+        return resources
+
+    @contextmanager
+    def counting(self, counter):
+        """Count the requests of the current thread with a RequestCounter.
+
+        Requests sent by map_concurrent and imap_concurrent workers on
+        behalf of the thread are counted as well.
+
+        Args:
+            counter (RequestCounter): The counter.
+        """
+        previous = getattr(self._local, 'counter', None)
+        self._local.counter = counter
+        try:
+            yield counter
+        finally:
+            self._local.counter = previous
+
+    def _counted(self, func):
+        """Make func count its requests with the caller's RequestCounter.
+
+        The profiler, if any, also attributes its requests to the caller.
+        """
+        if self.profiler is not None:
+            func = self.profiler.carry(func)
+        counter = getattr(self._local, 'counter', None)
+        if counter is None:
+            return func
+
+        def counted(item):
+            # pylint: disable=missing-docstring
+            with self.counting(counter):
+                return func(item)
+
+        return counted
+
+    def map_concurrent(self, func, items):
+        """Apply a function to every item using a pool of worker threads.
+
+        Used to overlap independent API requests.  At most max_workers
+        requests are in flight at once and results are returned in the
+        order of items.  Idle workers take the next item, so items listed
+        first start first and slow items do not hold up a fixed share of
+        the others.  The first exception raised by func is re-raised.
+
+        Args:
+            func (callable): The function to call with each item.
+            items (iterable): The items to process.
+
+        Returns:
+            list: The results of func, in the order of items.
+        """
+        items = list(items)
+        if len(items) < 2 or self.max_workers < 2:
+            return [func(item) for item in items]
+        pool = ThreadPool(min(self.max_workers, len(items)))
+        try:
+            return pool.map(self._counted(func), items, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def imap_concurrent(self, func, items, first=()):
+        """Lazily apply a function to every item using worker threads.
+
+        Like map_concurrent but results are yielded in the order of items as
+        soon as they are ready, and only a few results beyond the one being
+        waited for are held, so long streams of pages can be processed in
+        constant memory.
+
+        Args:
+            func (callable): The function to call with each item.
+            items (iterable): The items to process.
+
+        Keyword Args:
+            first (Optional[iterable]): Items, hashable, to start before all
+                others, e.g. the most expensive ones so they do not finish
+                last.  Their results are held until it is their turn.
+
+        Yields:
+            object: The results of func, in the order of items.
+        """
+        items = list(items)
+        if len(items) < 2 or self.max_workers < 2:
+            for item in items:
+                yield func(item)
+            return
+        first = set(first)
+        early = [i for i, item in enumerate(items) if item in first]
+        order = deque(early + [i for i, item in enumerate(items) if item not in first])
+        workers = min(self.max_workers, len(items))
+        # Results held: the lookahead of the workers plus the early items.
+        limit = workers + 1 + len(early)
+        func = self._counted(func)
+        pool = ThreadPool(workers)
+        pending = {}
+        try:
+            for index in range(len(items)):
+                while order and (len(pending) < limit or index not in pending):
+                    submitted = order.popleft()
+                    pending[submitted] = pool.apply_async(func, (items[submitted],))
+                yield pending.pop(index).get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _in_filter_chunks(self, url, field, values, per_page=100):
+        """Split values into ``q=<field> IN ...`` filters that fit a url.
+
+        Should be considered internal to this class.  Values are packed
+        greedily so each request url stays within max_url_length and each
+        chunk fits in a single page of per_page results.
+
+        Args:
+            url (str): The listing url the filters will be used with.
+            field (str): The field to filter on.
+            values (list(str)): The values to look up.
+
+        Keyword Args:
+            per_page (Optional[int]): Results per page, also the largest
+                chunk.
+
+        Returns:
+            list(tuple): ``(chunk, filters)`` pairs where chunk is the list
+                of values and filters the query params for the listing.
+        """
+        def filters_for(chunk):
+            return {'q': '{0} IN {1}'.format(field, ','.join(chunk)),
+                    'results-per-page': per_page}
+
+        chunks = []
+        chunk = []
+        for value in values:
+            candidate = chunk + [value]
+            length = len(url) + 1 + len(urllib.urlencode(filters_for(candidate)))
+            if chunk and (length > self.max_url_length or len(candidate) > per_page):
+                chunks.append(chunk)
+                chunk = [value]
+            else:
+                chunk = candidate
+        if chunk:
+            chunks.append(chunk)
+        return [(c, filters_for(c)) for c in chunks]
+
+    @require_access_token
+    def resources_in(self, path, field, values, record_cls=None, fields=None):
+        """List the resources of a collection whose field is one of values.
+
+        Values are batched into ``q=<field> IN ...`` listings that run
+        concurrently.
+
+        Args:
+            path (str): The collection path, e.g. ``/v2/apps``.
+            field (str): The field to filter on, e.g. ``space_guid``.
+            values (iterable(str)): The values to match.
+
+        Keyword Args:
+            record_cls (Optional[type]): Build records of this class instead
+                of returning raw resources.
+            fields (Optional[iterable(str)]): Record fields to keep.
+
+        Returns:
+            list: Raw resource dicts or records.
+        """
+        url = '{0}{1}'.format(self.api_url, path)
+        chunks = self._in_filter_chunks(url, field, sorted(set(values)))
+        pages = self.map_concurrent(
+            lambda chunk: self._list_resources(url, chunk[1], record_cls, fields),
+            chunks)
+        return [r for resources in pages for r in resources]
+
+    def _resources_by_guid(self, path, guids, record_cls=None, fields=None):
+        """Look up many resources of a collection by GUID.
+
+        Should be considered internal to this class.
+
+        Args:
+            path (str): The collection path, e.g. ``/v2/spaces``.
+            guids (iterable(str)): The GUIDs to resolve.
+
+        Keyword Args:
+            record_cls (Optional[type]): Build records of this class instead
+                of returning raw resources.
+            fields (Optional[iterable(str)]): Record fields to keep.
+
+        Returns:
+            dict: GUIDs to resources (or records).  Unknown GUIDs are left
+                out.
+        """
+        found = {}
+        for r in self.resources_in(path, 'guid', guids, record_cls, fields):
+            guid = r.guid if record_cls is not None else r['metadata']['guid']
+            found[guid] = r
+        return found
+
+    @require_access_token
+    def spaces_by_guid(self, guids, records=False, fields=None):
+        """Resolve many space GUIDs with batched ``guid IN`` queries.
+
+        Args:
+            guids (iterable(str)): The space GUIDs.
+
+        Keyword Args:
+            records (Optional[bool]): Return Space records instead of raw
+                resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep.
+
+        Returns:
+            dict: Space GUIDs to spaces.
+        """
+        return self._resources_by_guid(
+            '/v2/spaces', guids, Space if records else None, fields)
+
+    @require_access_token
+    def orgs_by_guid(self, guids, records=False, fields=None):
+        """Resolve many organization GUIDs with batched ``guid IN`` queries.
+
+        Args:
+            guids (iterable(str)): The organization GUIDs.
+
+        Keyword Args:
+            records (Optional[bool]): Return Org records instead of raw
+                resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep.
+
+        Returns:
+            dict: Organization GUIDs to organizations.
+        """
+        return self._resources_by_guid(
+            '/v2/organizations', guids, Org if records else None, fields)
+
+    @require_access_token
+    def count(self, path, filters=None):
+        """Count the resources of a listing without fetching them.
+
+        Sends a one result page request and returns its total_results.
+
+        Args:
+            path (str): The listing path, e.g. ``/v2/events``.
+
+        Keyword Args:
+            filters (Optional[dict]): Query params for the listing.
+
+        Returns:
+            int: The number of matching resources.
+        """
+        url = '{0}{1}'.format(self.api_url, path)
+        headers = {'Authorization': self.bearer_token}
+        params = dict(filters or {})
+        params['results-per-page'] = 1
+        return self._request(url, headers=headers, params=params)['total_results']
+
     @staticmethod
     def _json(data):
         """Serializes python object to JSON.
@@ -143,83 +927,31 @@ class CfApi(object):
         """
         return json.dumps(data, indent=4)
 
-    def _update_tokens(self, response):
-        """Updates all token attributes for the class instance.
-
-        Internal function to update all token related attributes whenever
-        login or refresh_token is called.
-
-        Args:
-            response (dict): The server response from a token-based operation
-                deserialized to a python dict.
-        """
-        expire_time = int(time() - 60) + int(response['expires_in'])
-        self._access_token = response['access_token']
-        self._refresh_token = response['refresh_token']
-        self._access_token_expire_time = expire_time
-
     def _resolve_instance_guids(self):
         """Resolve org and space names to GUIDs.
 
         Internal function to resolve org and space names to GUIDs when org
-        and space names are passed into the class constructor.
+        and space names are passed into the class constructor.  The session
+        remembers them for every other client.
         """
         try:
             if self.org_name:
-                self.org_guid = self.get_org_guid(self.org_name)
-                if self.space_name:
-                    spaces = self.org_spaces(self.org_guid)
-                    space_guid = [
-                        s['metadata']['guid'] for s in spaces
-                        if s['entity']['name'] == self.space_name
-                    ]
-                    if space_guid:
-                        self.space_guid = space_guid[0]
+                self.org_guid, self.space_guid = self.session.resolve(
+                    self.org_name, self.space_name)
         except urllib2.HTTPError as e:
             print('Error: {0}'.format(e.read()))
             sys.exit(127)
 
     def login(self):
-        """Login to UAA and store token for future calls.
-
-        Uses username and password attributes to login to the UAA instance
-        defined in login_host.  The token and all information needed to refresh
-        the token on expiry are also stored as local attributes to the class
-        instance.
-        """
-        url = "https://{0}/oauth/token".format(self.login_host)
-        body = {
-            'grant_type': 'password',
-            'username': self.username,
-            'password': self.password,
-            'client_id': self._client_id
-        }
-        headers = {'Authorization': 'Basic Y2Y6', 'Accept': 'application/json'}
-        response = self._request(
-            url, headers=headers, body=body, method='POST')
-        self._update_tokens(response)
+        """Login to UAA through the session, see CfSession.login."""
+        self.session.login()
 
     def refresh_token(self):
-        """Refresh an expired token.
-
-        This will use the refresh_token to renew the access token.  Typically
-        not called directly since token operations for most other functions
-        that require tokens use the require_access_token decorator.
-        """
-        url = "https://{0}/oauth/token".format(self.login_host)
-        body = {
-            'grant_type': 'refresh_token',
-            'client_id': self._client_id,
-            'client_secret': self._client_secret,
-            'refresh_token': self._refresh_token
-        }
-        headers = {'Accept': 'application/json'}
-        response = self._request(
-            url, headers=headers, body=body, method='POST')
-        self._update_tokens(response)
+        """Refresh an expired token, see CfSession.refresh_token."""
+        self.session.refresh_token()
 
     @require_access_token
-    def orgs(self, filters=None):
+    def orgs(self, filters=None, records=False, fields=None):
         """Retrieves a list of Cloud Foundry organizations.
 
         Pull a list of Cloud Foundry organizations and organization metadata
@@ -229,16 +961,17 @@ class CfApi(object):
             filters (Optional[dict]): A dict of query params that can be used
                 to filter results on the server side.  See Cloud Foundry API
                 documentation for supported parameters.
+            records (Optional[bool]): Return compact Org records
+                instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
 
         Returns:
             list(dict): A list of organizations.
         """
-        url = 'https://{0}/v2/organizations'.format(self.api_host)
-        headers = {'Authorization': self.bearer_token}
-        resources = []
-        for r in self._request_all(url, params=filters, headers=headers):
-            resources = resources + r['resources']
-        return resources
+        url = '{0}/v2/organizations'.format(self.api_url)
+        return self._list_resources(
+            url, filters, Org if records else None, fields)
 
     @require_access_token
     def get_org_guid(self, org_name=None):
@@ -258,7 +991,7 @@ class CfApi(object):
         return guid
 
     @require_access_token
-    def org_spaces(self, org_guid, filters=None):
+    def org_spaces(self, org_guid, filters=None, records=False, fields=None):
         """Gets all spaces for an organization.
 
         Pull a list of space metadata for an organization by GUID.
@@ -270,19 +1003,63 @@ class CfApi(object):
             filters (Optional[dict]): A dict of query params that can be used
                 to filter results on the server side.  See Cloud Foundry API
                 documentation for supported parameters.
+            records (Optional[bool]): Return compact Space records
+                instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
 
         Returns:
             list(dict): A list of dict objects containing metadata for all
                 spaces in the org.
         """
-        url = 'https://{0}/v2/organizations/{1}/spaces'.format(
-            self.api_host, org_guid
+        url = '{0}/v2/organizations/{1}/spaces'.format(
+            self.api_url, org_guid
         )
+        return self._list_resources(
+            url, filters, Space if records else None, fields)
+
+    @require_access_token
+    def spaces(self, filters=None, records=False, fields=None):
+        """Retrieves a list of all Cloud Foundry spaces.
+
+        Pull a list of spaces across every organization you are authorized
+        to see.
+
+        Keyword Args:
+            filters (Optional[dict]): A dict of query params that can be used
+                to filter results on the server side.  See Cloud Foundry API
+                documentation for supported parameters.
+            records (Optional[bool]): Return compact Space records
+                instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
+
+        Returns:
+            list: A list of spaces.
+        """
+        url = '{0}/v2/spaces'.format(self.api_url)
+        return self._list_resources(
+            url, filters, Space if records else None, fields)
+
+    @require_access_token
+    def space_summary(self, space_guid):
+        """Retrieves the summary of a space.
+
+        One request returns every app of the space with its state and bound
+        service names, and every service instance of the space, managed
+        and user-provided, with its plan and last operation.  Summary apps
+        carry no metadata, their package_updated_at is the closest to an
+        updated_at timestamp.
+
+        Args:
+            space_guid (str): The GUID of the space.
+
+        Returns:
+            dict: The summary with 'guid', 'name', 'apps' and 'services'.
+        """
+        url = '{0}/v2/spaces/{1}/summary'.format(self.api_url, space_guid)
         headers = {'Authorization': self.bearer_token}
-        resources = []
-        for r in self._request_all(url, params=filters, headers=headers):
-            resources = resources + r['resources']
-        return resources
+        return self._request(url, headers=headers)
 
     @require_access_token
     def services(self, filters=None):
@@ -300,7 +1077,7 @@ class CfApi(object):
         Returns:
             list: A list of resources and resource metadata.
         """
-        url = 'https://{0}/v2/services'.format(self.api_host)
+        url = '{0}/v2/services'.format(self.api_url)
         headers = {'Authorization': self.bearer_token}
         resources = []
         for r in self._request_all(url, params=filters, headers=headers):
@@ -347,8 +1124,8 @@ class CfApi(object):
         Returns:
             dict: A dict containing metadata on the newly created service.
         """
-        url = 'https://{0}/v2/user_provided_service_instances'.format(
-            self.api_host
+        url = '{0}/v2/user_provided_service_instances'.format(
+            self.api_url
         )
         body = {
             'space_guid': self.space_guid,
@@ -364,7 +1141,8 @@ class CfApi(object):
         return response
 
     @require_access_token
-    def user_provided_service_instances(self, filters=None):
+    def user_provided_service_instances(self, filters=None, records=False,
+                                        fields=None):
         """Retrieve a list of existing user-provided services.
 
         Returns a list of resources containing all user-provided services.
@@ -375,18 +1153,19 @@ class CfApi(object):
             filters (Optional[dict]): A valid query filter for the v2
                 service plans api in cloud foundry.  See Cloud Foundry
                 documentation for supported filters.
+            records (Optional[bool]): Return compact UserProvidedService
+                records instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
 
         Returns:
             list: A list of resources and resource metadata.
         """
-        url = 'https://{0}/v2/user_provided_service_instances'.format(
-            self.api_host
+        url = '{0}/v2/user_provided_service_instances'.format(
+            self.api_url
         )
-        headers = {'Authorization': self.bearer_token}
-        resources = []
-        for r in self._request_all(url, params=filters, headers=headers):
-            resources = resources + r['resources']
-        return resources
+        return self._list_resources(
+            url, filters, UserProvidedService if records else None, fields)
 
     @require_access_token
     def create_service(self, name, broker_name, plan_name, parameters=None):
@@ -405,18 +1184,14 @@ class CfApi(object):
 
         Returns:
             dict: A dict containing metadata on the newly created service.
+                Brokers provisioning asynchronously return the instance with
+                ``last_operation.state`` still ``in progress``.
+
+        Raises:
+            ValueError: When the broker or the plan is not in the catalog.
         """
-        url = 'https://{0}/v2/service_instances'.format(self.api_host)
-        service_guids = self.service_guids(service_name=broker_name)
-        if broker_name in service_guids:
-            service_guid = service_guids[broker_name]
-        else:
-            raise ValueError('Unknown service broker.')
-        plan_guids = self.service_plan_guids(service_guid)
-        if plan_name in plan_guids:
-            plan_guid = plan_guids[plan_name]
-        else:
-            raise ValueError('Invalid service plan')
+        url = '{0}/v2/service_instances'.format(self.api_url)
+        plan_guid = self.service_catalog.plan_guid(broker_name, plan_name)
         params = {'accepts_incomplete': 'true'}
         body = {
             'name': name,
@@ -450,7 +1225,7 @@ class CfApi(object):
         Returns:
             list: A list of resources and resource metadata.
         """
-        url = 'https://{0}/v2/service_plans'.format(self.api_host)
+        url = '{0}/v2/service_plans'.format(self.api_url)
         headers = {'Authorization': self.bearer_token}
         resources = []
         for r in self._request_all(url, params=filters, headers=headers):
@@ -482,7 +1257,7 @@ class CfApi(object):
         return service_plan_guids
 
     @require_access_token
-    def service_instances(self, filters=None):
+    def service_instances(self, filters=None, records=False, fields=None):
         """Retrieves a list of Cloud Foundry service instances.
 
         Pull a list of service instance from the Cloud Controller.
@@ -491,16 +1266,17 @@ class CfApi(object):
             filters (Optional[dict]): A dict of query params that can be used
                 to filter results on the server side.  See Cloud Foundry API
                 documentation for supported parameters
+            records (Optional[bool]): Return compact ServiceInstance records
+                instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
 
         Returns:
             list[dict]: A list of service instances and service metadata.
         """
-        url = 'https://{0}/v2/service_instances'.format(self.api_host)
-        headers = {'Authorization': self.bearer_token}
-        resources = []
-        for r in self._request_all(url, params=filters, headers=headers):
-            resources = resources + r['resources']
-        return resources
+        url = '{0}/v2/service_instances'.format(self.api_url)
+        return self._list_resources(
+            url, filters, ServiceInstance if records else None, fields)
 
     @require_access_token
     def delete_service(self, serv_guid):
@@ -510,7 +1286,7 @@ class CfApi(object):
             serv_guid (str): The GUID of the service to delete.
 
         """
-        url = 'https://{0}{1}?accepts_incomplete=true'.format(self.api_host, serv_guid)
+        url = '{0}{1}?accepts_incomplete=true'.format(self.api_url, serv_guid)
         headers = {'Authorization': self.bearer_token}
         response = self._request(
             url, headers=headers, body='', method='DELETE')
@@ -524,10 +1300,11 @@ class CfApi(object):
             space_guid (str): The GUID of the space to delete.
 
         """
-        url = 'https://{0}{1}?async=true&recursive=true'.format(self.api_host, space_guid)
+        url = '{0}{1}?async=true&recursive=true'.format(self.api_url, space_guid)
         headers = {'Authorization': self.bearer_token}
         response = self._request(
             url, headers=headers, body='', method='DELETE')
+        self.session.forget_spaces()
         return response
 
     @require_access_token
@@ -544,7 +1321,7 @@ class CfApi(object):
         Returns:
             list[dict]: A list of service instances and service metadata.
         """
-        url = 'https://{0}{1}'.format(self.api_host, sbindurl)
+        url = '{0}{1}'.format(self.api_url, sbindurl)
         headers = {'Authorization': self.bearer_token}
         resources = []
         for r in self._request_all(url, params=filters, headers=headers):
@@ -553,7 +1330,7 @@ class CfApi(object):
 
     @require_access_token
     def create_service_key(self, service_guid, servicekeyname):
-        url = 'https://{0}/v2/service_keys'.format(self.api_host)
+        url = '{0}/v2/service_keys'.format(self.api_url)
         headers = {'Authorization': self.bearer_token}
         json_body = json.dumps({
             'service_instance_guid': service_guid,
@@ -564,30 +1341,70 @@ class CfApi(object):
         return response
 
     @require_access_token
-    def get_service_key(self, service_guid, servicekeyname):
-        url = 'https://{0}/v2/service_instances/{1}/service_keys'.format(self.api_host, service_guid)
+    def service_keys(self, filters=None):
+        """Retrieves a list of service keys.
+
+        Keyword Args:
+            filters (Optional[dict]): A dict of query params that can be used
+                to filter results on the server side, for example
+                ``service_instance_guid IN guid1,guid2``.  See Cloud Foundry
+                API documentation for supported parameters.
+
+        Returns:
+            list[dict]: A list of service key resources.
+        """
+        url = '{0}/v2/service_keys'.format(self.api_url)
+        return self._list_resources(url, filters)
+
+    @require_access_token
+    def get_service_key(self, service_guid, servicekeyname, create=False):
+        """Retrieves the keys of a service instance.
+
+        Keys come from the session cache of service_key_manager.
+
+        Args:
+            service_guid (str): The GUID of the service instance.
+            servicekeyname (str): The key to create when create is True and
+                the instance has no key.
+
+        Keyword Args:
+            create (Optional[bool]): Create servicekeyname when no key
+                exists.
+
+        Returns:
+            dict: A page shaped dict with total_results and resources.
+        """
+        keys = self.service_key_manager.keys(service_guid)
+        if not keys and create:
+            keys = [self.service_key_manager.create(service_guid, servicekeyname)]
+        return {'total_results': len(keys), 'resources': keys}
+
+    @require_access_token
+    def delete_service_key_url(self, servicekeyurl):
+        """Delete a single service key.
+
+        Args:
+            servicekeyurl (str): The key's metadata url.
+        """
+        url = '{0}{1}'.format(self.api_url, servicekeyurl)
         headers = {'Authorization': self.bearer_token}
-        response = self._request(
-            url, headers=headers, method='GET')
-        if response['total_results'] != 0:
-            return response
-        else:
-            res = self.create_service_key(service_guid, servicekeyname)
-            self.delete_service_key(service_guid, servicekeyname)
-            return res
+        self._request(url, headers=headers, method='DELETE')
 
     @require_access_token
-    def delete_service_key(self, service_guid, servicekeyname):
-        servicekey = self.get_service_key(service_guid, servicekeyname)
-        if servicekey['total_results'] != 0:
-            for s in servicekey['resources']:
-                skey = s['metadata']['url']
-            url = 'https://{0}/{1}'.format(self.api_host, skey)
-            headers = {'Authorization': self.bearer_token}
-            self._request(url, headers=headers, method='DELETE')
+    def delete_service_key(self, service_guid, servicekeyname=None):
+        """Delete keys of a service instance.
+
+        Args:
+            service_guid (str): The GUID of the service instance.
+
+        Keyword Args:
+            servicekeyname (Optional[str]): Only delete the key with this
+                name, all keys are deleted when omitted.
+        """
+        self.service_key_manager.delete(service_guid, servicekeyname)
 
     @require_access_token
-    def apps(self, filters=None):
+    def apps(self, filters=None, records=False, fields=None):
         """Retrieves a list of Cloud Foundry applications.
 
         Pull a list of Cloud Foundry applications and application metadata.  By
@@ -600,16 +1417,17 @@ class CfApi(object):
             filters (Optional[dict]): A dict of query params that can be used
                 to filter results on the server side.  See Cloud Foundry API
                 documentation for supported parameters
+            records (Optional[bool]): Return compact App records
+                instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
 
         Returns:
             list[dict]: A list of resource and resource metadata.
         """
-        url = 'https://{0}/v2/apps'.format(self.api_host)
-        headers = {'Authorization': self.bearer_token}
-        resources = []
-        for r in self._request_all(url, params=filters, headers=headers):
-            resources = resources + r['resources']
-        return resources
+        url = '{0}/v2/apps'.format(self.api_url)
+        return self._list_resources(
+            url, filters, App if records else None, fields)
 
     @require_access_token
     def create_app(self, app_name):
@@ -627,7 +1445,7 @@ class CfApi(object):
         Returns:
             dict: A dictionary of application metadata.
         """
-        url = 'https://{0}/v2/apps'.format(self.api_host)
+        url = '{0}/v2/apps'.format(self.api_url)
         headers = {'Authorization': self.bearer_token}
         json_body = json.dumps({
             'name': app_name,
@@ -645,7 +1463,7 @@ class CfApi(object):
             app_guid (str): The GUID of the application to delete.
 
         """
-        url = 'https://{0}{1}?accepts_incomplete=true'.format(self.api_host, app_guid)
+        url = '{0}{1}?accepts_incomplete=true'.format(self.api_url, app_guid)
         headers = {'Authorization': self.bearer_token}
         self._request(url, headers=headers, method='DELETE')
 
@@ -657,7 +1475,7 @@ class CfApi(object):
             service_guid (str): The GUID of the service instance.
             app_guid (str): The GUID of the application to bind to.
         """
-        url = 'https://{0}/v2/service_bindings'.format(self.api_host)
+        url = '{0}/v2/service_bindings'.format(self.api_url)
         headers = {'Authorization': self.bearer_token}
         json_body = json.dumps({
             'service_instance_guid': service_guid,
@@ -674,14 +1492,14 @@ class CfApi(object):
         Args:
             binding_guid (str): The GUID for the service binding.
         """
-        url = 'https://{0}/v2/service_bindings/{1}?'.format(
-            self.api_host, binding_guid)
+        url = '{0}/v2/service_bindings/{1}?'.format(
+            self.api_url, binding_guid)
         headers = {'Authorization': self.bearer_token}
         response = self._request(url, headers=headers, method='DELETE')
         return response
 
     @require_access_token
-    def app_instances(self, filters=None):
+    def app_instances(self, filters=None, records=False, fields=None):
         """Retrieves a list of Cloud Foundry app details.
 
         Pull a list of apps from the Cloud Controller.
@@ -690,21 +1508,134 @@ class CfApi(object):
             filters (Optional[dict]): A dict of query params that can be used
                 to filter results on the server side.  See Cloud Foundry API
                 documentation for supported parameters
+            records (Optional[bool]): Return compact App records
+                instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
 
         Returns:
             list[dict]: A list of service instances and service metadata.
         """
-        url = 'https://{0}/v2/apps'.format(self.api_host)
-        headers = {'Authorization': self.bearer_token}
-        resources = []
-        for r in self._request_all(url, params=filters, headers=headers):
-            resources = resources + r['resources']
-        return resources
+        url = '{0}/v2/apps'.format(self.api_url)
+        return self._list_resources(
+            url, filters, App if records else None, fields)
+
+    @require_access_token
+    def events(self, filters=None, records=False, fields=None):
+        """Retrieves a list of audit events.
+
+        Keyword Args:
+            filters (Optional[dict]): A dict of query params that can be used
+                to filter results on the server side, typically timestamp and
+                type filters.  See Cloud Foundry API documentation for
+                supported parameters.
+            records (Optional[bool]): Return compact Event records
+                instead of raw resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.  Defaults to all fields of the record.
+
+        Returns:
+            list: A list of events.
+        """
+        url = '{0}/v2/events'.format(self.api_url)
+        return self._list_resources(
+            url, filters, Event if records else None, fields)
+
+    def event_windows(self, start, end, filters=None, max_events=2000):
+        """Split a time range into windows of a bounded number of events.
+
+        The range is cut at UTC midnights and every day is probed for its
+        event count, concurrently.  Empty days are dropped and days with
+        more than max_events events are cut into hours.
+
+        Args:
+            start (int): Start of the range in epoch seconds, inclusive.
+            end (int): End of the range in epoch seconds, exclusive.
+
+        Keyword Args:
+            filters (Optional[dict]): Extra query params for the events.
+            max_events (Optional[int]): Events a day may hold before it is
+                split into hours.
+
+        Returns:
+            list(tuple): ``(start, end)`` epoch second pairs in time order.
+        """
+        days = []
+        day = start
+        while day < end:
+            days.append((day, min(end, day - day % 86400 + 86400)))
+            day = days[-1][1]
+        counts = self.map_concurrent(
+            lambda window: self.count(
+                '/v2/events', self._event_window_filters(window, filters)),
+            days)
+        windows = []
+        for (day_start, day_end), total in zip(days, counts):
+            if total == 0:
+                continue
+            if total <= max_events:
+                windows.append((day_start, day_end))
+                continue
+            hour = day_start
+            while hour < day_end:
+                windows.append((hour, min(day_end, hour - hour % 3600 + 3600)))
+                hour = windows[-1][1]
+        return windows
+
+    @staticmethod
+    def _event_window_filters(window, filters=None):
+        """Return the query params listing the events of a window.
+
+        Should be considered internal to this class.
+        """
+        params = dict(filters or {})
+        q = params.get('q', [])
+        q = [q] if isinstance(q, basestring) else list(q)
+        params['q'] = q + [
+            'timestamp>={0}'.format(strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(window[0]))),
+            'timestamp<{0}'.format(strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(window[1])))]
+        params['order-by'] = ['timestamp', 'id']
+        params['order-direction'] = 'asc'
+        params['results-per-page'] = 100
+        return params
+
+    @require_access_token
+    def events_by_window(self, start, end, filters=None, records=False,
+                         fields=None, max_events=2000):
+        """Stream the audit events of a time range, window by window.
+
+        The range is split by event_windows and the windows are listed
+        concurrently, each with shallow pagination.  Windows are yielded in
+        time order as soon as they and every earlier window are complete,
+        so the events come out in timestamp order.
+
+        Args:
+            start (int): Start of the range in epoch seconds, inclusive.
+            end (int): End of the range in epoch seconds, exclusive.
+
+        Keyword Args:
+            filters (Optional[dict]): Extra query params for the events.
+            records (Optional[bool]): Yield Event records instead of raw
+                resource dicts.
+            fields (Optional[iterable(str)]): Record fields to keep when
+                records is True.
+            max_events (Optional[int]): See event_windows.
+
+        Yields:
+            list: The events of one window.
+        """
+        url = '{0}/v2/events'.format(self.api_url)
+        windows = self.event_windows(start, end, filters, max_events)
+        return self.imap_concurrent(
+            lambda window: self._list_resources(
+                url, self._event_window_filters(window, filters),
+                Event if records else None, fields),
+            windows)
 
     @require_access_token
     def get_generic_request(self, request_string):
         # print(request_string)
-        url = 'https://{0}{1}'.format(self.api_host, request_string)
+        url = '{0}{1}'.format(self.api_url, request_string)
         headers = {'Authorization': self.bearer_token}
         resources = []
         for r in self._request_all(url, headers=headers):
@@ -713,21 +1644,67 @@ class CfApi(object):
 
     @require_access_token
     def get_generic_request1(self, request_string):
-        url = 'https://{0}{1}'.format(self.api_host, request_string)
+        url = '{0}{1}'.format(self.api_url, request_string)
         headers = {'Authorization': self.bearer_token}
         resources = self._request_all(url, headers=headers)
         return resources
 
     @require_access_token
-    def get_service_credentials(self, servicename):
-        service_names = servicename
+    def get_service_credentials(self, servicename, create_missing=False):
+        """Retrieve the service keys of a service instance.
+
+        Args:
+            servicename (str): Regular expression the whole instance name
+                must match.  The last matching instance of the space is used.
+
+        Keyword Args:
+            create_missing (Optional[bool]): Create a ``testkey`` when the
+                instance has no key yet.  The new key is kept and reused.
+
+        Returns:
+            dict: A page shaped dict with total_results and the key
+                resources, see get_service_key.  None when no instance
+                matches.
+        """
         filters = {'q': 'space_guid:{0}'.format(self.space_guid)}
-        service_instances = self.service_instances(filters=filters)
-        for s in service_instances:
-            if re.match("^" + service_names + "$", s['entity']['name']):
-                serviceguid = s['metadata']['guid']
-                service_credential = self.get_service_key(serviceguid, 'testkey')
-        return service_credential
+        matched = [s for s in self.service_instances(filters=filters)
+                   if re.match("^" + servicename + "$", s['entity']['name'])]
+        if not matched:
+            return None
+        return self.get_service_key(matched[-1]['metadata']['guid'], 'testkey',
+                                    create=create_missing)
+
+    @require_access_token
+    def service_credentials(self, servicenames, create_missing=False):
+        """Retrieve credentials of several service instances at once.
+
+        Lists the space's service instances once and the keys of all
+        matching instances with one bulk call.  Existing keys are reused.
+
+        Args:
+            servicenames (list(str)): Regular expressions, an instance
+                matches when its whole name matches one of them.
+
+        Keyword Args:
+            create_missing (Optional[bool]): Create a ``testkey`` for
+                instances that have no key yet.
+
+        Returns:
+            dict: Names of the matching instances to their credentials
+                (None when the instance has no key and create_missing is
+                False).
+        """
+        filters = {'q': 'space_guid:{0}'.format(self.space_guid)}
+        service_instances = self.service_instances(
+            filters=filters, records=True, fields=('name', 'guid'))
+        patterns = [re.compile("^" + name + "$") for name in servicenames]
+        guids = dict((s.name, s.guid) for s in service_instances
+                     if any(p.match(s.name) for p in patterns))
+        self.service_key_manager.load(guids.values())
+        return dict(
+            (name, self.service_key_manager.credentials(
+                guid, create=create_missing))
+            for name, guid in guids.items())
 
     @require_access_token
     def verify_servicename(self, servicename):
@@ -758,16 +1735,17 @@ class CfApi(object):
         service_names = servicename
         filters = {'q': 'space_guid:{0}'.format(self.space_guid)}
         service_instances = self.service_instances(filters=filters)
-        if service_instances:
-            for ser in service_instances:
-                if re.match("^" + service_names + "$", ser['entity']['name']):
-                    serviceguid = ser['metadata']['guid']
-                    servicekeyname = self.get_service_key(serviceguid, 'testkey')
-                    if 'resources' in servicekeyname:
-                        for serkeyname in servicekeyname['resources']:
-                            skeyname = serkeyname['metadata']['url']
-                            self.delete_service_key(serviceguid, skeyname)
-                    self.delete_service(ser['metadata']['url'])
+        matched = [
+            ser for ser in service_instances
+            if re.match("^" + service_names + "$", ser['entity']['name'])
+        ]
+        self.service_key_manager.load(
+            [ser['metadata']['guid'] for ser in matched])
+        for ser in matched:
+            serviceguid = ser['metadata']['guid']
+            self.service_key_manager.delete(serviceguid)
+            self.delete_service(ser['metadata']['url'])
+            self.service_key_manager.forget(serviceguid)
 
     @require_access_token
     def get_app_status(self, appname):
@@ -781,6 +1759,38 @@ class CfApi(object):
                 serstatus['guid'] = ser['metadata']['guid']
         return (serstatus)
 
+    @require_access_token
+    def app_envs(self, appnames):
+        """Retrieve the environment documents of several apps at once.
+
+        Lists the apps of the current space once, resolves every name in
+        memory and fetches the ``/env`` documents of the matching apps
+        concurrently.  Like the other app and service lookups, a name is a
+        regular expression that has to match the whole app name.
+
+        Args:
+            appnames (list(str)): The application names.
+
+        Returns:
+            dict: App names to their deserialized ``/v2/apps/:guid/env``
+                documents.  Names that do not exist in the space are left
+                out.
+        """
+        filters = {'q': 'space_guid:{0}'.format(self.space_guid)}
+        apps = self.app_instances(filters=filters, records=True,
+                                  fields=('name', 'guid'))
+        guids = {}
+        for appname in appnames:
+            for app in apps:
+                if re.match("^" + appname + "$", app.name):
+                    guids[appname] = app.guid
+        found = [name for name in appnames if name in guids]
+        envs = self.map_concurrent(
+            lambda name: self.get_generic_request(
+                '/v2/apps/{0}/env'.format(guids[name])),
+            found)
+        return dict(zip(found, envs))
+
     @require_access_token
     def user_delete_app(self, appname):
         app_names = appname
@@ -801,9 +1811,7 @@ class CfApi(object):
         service_instances = self.service_instances(filters=filters)
         for s in service_instances:
             if re.match("^" + service_names + "$", s['entity']['name']):
-                serviceguid = s['metadata']['guid']
-        service_credential = self.delete_service_key(cfapi, serviceguid, 'testkey')
-        return service_credential
+                self.delete_service_key(s['metadata']['guid'], 'testkey')
 
     @require_access_token
     def get_user_provided_service(self, servicename):
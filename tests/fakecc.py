@@ -0,0 +1,174 @@
+"""In-memory Cloud Controller used as a CfApi transport by the tests."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import json
+import re
+import threading
+import urllib
+import urllib2
+from StringIO import StringIO
+from urlparse import urlparse, parse_qs
+
+COLLECTIONS = ('organizations', 'spaces', 'apps', 'service_instances',
+               'user_provided_service_instances', 'service_keys', 'service_bindings',
+               'services', 'service_plans', 'events')
+
+FILTER_RE = re.compile(r'^(\w+)( IN |>=|<=|:|>|<)(.*)$')
+
+
+def guid(kind, i):
+    """Return a GUID that is stable per kind and number."""
+    return '{0:08x}-0000-0000-0000-{1:012d}'.format(hash(kind) & 0xffffffff, i)
+
+
+class FakeCloudController(object):
+    """Answers v2 requests from in-memory collections.
+
+    Supports listing with ``q`` filters and paging, fetching, creating,
+    updating and deleting resources, nested space listings, space
+    summaries and UAA logins.
+
+    Attributes:
+        collections (dict): Collection names to lists of resources.
+        envs (dict): App GUIDs to their ``/env`` documents.
+        calls (list(tuple)): ``(method, path, query)`` of every request.
+        failures (dict): ``(method, path)`` to an HTTP status returned
+            instead of the answer.
+    """
+
+    def __init__(self, per_page=50):
+        self.per_page = per_page
+        self.collections = dict((name, []) for name in COLLECTIONS)
+        self.envs = {}
+        self.calls = []
+        self.failures = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, collection, **entity):
+        """Add a resource and return it."""
+        with self._lock:
+            self._count += 1
+            resource_guid = entity.pop('guid', None) or guid(collection, self._count)
+        resource = {
+            'metadata': {'guid': resource_guid,
+                         'url': '/v2/{0}/{1}'.format(collection, resource_guid),
+                         'created_at': '2026-01-01T00:00:00Z',
+                         'updated_at': '2026-01-01T00:00:00Z'},
+            'entity': entity}
+        self.collections[collection].append(resource)
+        return resource
+
+    def find(self, collection, resource_guid):
+        for resource in self.collections[collection]:
+            if resource['metadata']['guid'] == resource_guid:
+                return resource
+        return None
+
+    def count(self, method, path_prefix=''):
+        """Return the number of requests of a method under a path."""
+        return len([c for c in self.calls if c[0] == method and c[1].startswith(path_prefix)])
+
+    def request(self, url, headers=None, params=None, body=None, method='GET'):
+        # pylint: disable=unused-argument,missing-docstring
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        for key, value in (params or {}).items():
+            query.setdefault(key, []).extend(value if isinstance(value, list) else [value])
+        method = str(method).upper()
+        with self._lock:
+            self.calls.append((method, parsed.path, query))
+        status = self.failures.get((method, parsed.path))
+        if status is not None:
+            raise urllib2.HTTPError(url, status, 'error', None,
+                                    StringIO(json.dumps({'description': 'error'})))
+        if parsed.path == '/oauth/token':
+            return {'access_token': 'token', 'refresh_token': 'refresh', 'expires_in': 3600}
+        parts = parsed.path.strip('/').split('/')[1:]
+        if method == 'GET':
+            return self._get(parsed.path, parts, query)
+        if method == 'POST':
+            return self.add(parts[0], **json.loads(body))
+        resource = self.find(parts[0], parts[1]) if len(parts) > 1 else None
+        if resource is None:
+            raise urllib2.HTTPError(url, 404, 'not found', None, StringIO('{}'))
+        if method == 'PUT':
+            resource['entity'].update(json.loads(body))
+            return resource
+        if method == 'DELETE':
+            self.collections[parts[0]].remove(resource)
+            return ''
+        raise ValueError('Unsupported method {0}'.format(method))
+
+    def _get(self, path, parts, query):
+        if len(parts) == 2:
+            resource = self.find(parts[0], parts[1])
+            if resource is None:
+                raise urllib2.HTTPError(path, 404, 'not found', None, StringIO('{}'))
+            return resource
+        if len(parts) == 3 and parts[0] == 'spaces' and parts[2] == 'summary':
+            return self._summary(parts[1])
+        if len(parts) == 3 and parts[0] == 'apps' and parts[2] == 'env':
+            return self.envs.get(parts[1], {'system_env_json': {'VCAP_SERVICES': {}}})
+        if len(parts) == 3:
+            field = {'organizations': 'organization_guid', 'spaces': 'space_guid'}[parts[0]]
+            resources = [r for r in self.collections[parts[2]]
+                         if r['entity'].get(field) == parts[1]]
+        else:
+            resources = self.collections[parts[0]]
+        for expression in query.get('q', []):
+            resources = [r for r in resources if self._matches(r, expression)]
+        return self._page(path, resources, query)
+
+    @staticmethod
+    def _matches(resource, expression):
+        field, op, value = FILTER_RE.match(expression).groups()
+        actual = resource['metadata'].get(field, resource['entity'].get(field))
+        if op == ' IN ':
+            return actual in value.split(',')
+        if op == ':':
+            return actual == value
+        if actual is None:
+            return False
+        return {'>': actual > value, '<': actual < value,
+                '>=': actual >= value, '<=': actual <= value}[op]
+
+    def _page(self, path, resources, query):
+        per_page = int(query.get('results-per-page', [self.per_page])[0])
+        page = int(query.get('page', ['1'])[0])
+        pages = max(1, (len(resources) + per_page - 1) // per_page)
+        next_url = None
+        if page < pages:
+            next_query = dict(query, page=[str(page + 1)], **{'results-per-page': [str(per_page)]})
+            next_url = '{0}?{1}'.format(path, urllib.urlencode(
+                [(k, v) for k, values in sorted(next_query.items()) for v in values]))
+        return {'total_results': len(resources), 'total_pages': pages, 'prev_url': None,
+                'next_url': next_url,
+                'resources': resources[(page - 1) * per_page:page * per_page]}
+
+    def _summary(self, space_guid):
+        space = self.find('spaces', space_guid)
+        apps = [dict(a['entity'], guid=a['metadata']['guid'])
+                for a in self.collections['apps'] if a['entity'].get('space_guid') == space_guid]
+        services = [dict(s['entity'], guid=s['metadata']['guid'],
+                         service_plan={'guid': s['entity'].get('service_plan_guid')})
+                    for s in self.collections['service_instances']
+                    if s['entity'].get('space_guid') == space_guid]
+        services += [dict(s['entity'], guid=s['metadata']['guid'])
+                     for s in self.collections['user_provided_service_instances']
+                     if s['entity'].get('space_guid') == space_guid]
+        return {'guid': space_guid, 'name': space['entity']['name'], 'apps': apps,
+                'services': services}
+
+
+class FakeFoundations(object):
+    """Routes every request to the FakeCloudController of its host."""
+
+    def __init__(self, controllers):
+        self.controllers = controllers
+
+    def request(self, url, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        return self.controllers[urlparse(url).netloc].request(url, *args, **kwargs)
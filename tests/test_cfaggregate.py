@@ -0,0 +1,87 @@
+"""Tests for the event stream summaries."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import random
+import unittest
+from collections import Counter
+from cfaggregate import EventAggregator, SpaceSaving
+
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def test_exact_within_capacity(self):
+        counter = SpaceSaving(capacity=10)
+        for key in 'abracadabra':
+            counter.add(key)
+        self.assertEqual(counter.top(3), [('a', 5, 0), ('b', 2, 0), ('r', 2, 0)])
+        self.assertEqual(counter.total, 11)
+
+    def test_eviction_inherits_the_minimum(self):
+        counter = SpaceSaving(capacity=2)
+        for key in 'aab':
+            counter.add(key)
+        counter.add('c')
+        self.assertEqual(counter.top(2), [('a', 2, 0), ('c', 2, 1)])
+
+    def test_heavy_hitters_are_kept(self):
+        rng = random.Random(42)
+        stream = ['hot-{0}'.format(i) for i in range(5) for _ in range(300)]
+        stream += ['cold-{0}'.format(rng.randint(0, 5000)) for _ in range(3000)]
+        rng.shuffle(stream)
+        counter = SpaceSaving(capacity=50)
+        for key in stream:
+            counter.add(key)
+        exact = Counter(stream)
+        top = counter.top(5)
+        self.assertEqual(sorted(k for k, _, _ in top), ['hot-{0}'.format(i) for i in range(5)])
+        for key, count, error in top:
+            self.assertLessEqual(count - error, exact[key])
+            self.assertGreaterEqual(count, exact[key])
+        # Every counter is in use, overcounts stay below total / capacity.
+        self.assertLessEqual(max(e for _, _, e in counter.top(50)), len(stream) // 50)
+
+
+class EventAggregatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.aggregator = EventAggregator(top=2, capacity=10)
+        for time, event, name, user in (
+                ('2026-10-18T10:30:00Z', 'audit.app.update', 'web', 'alice'),
+                ('2026-10-18T09:15:00Z', 'audit.app.update', 'web', 'bob'),
+                ('2026-10-18T09:45:00Z', 'audit.app.restage', 'worker', 'alice'),
+                ('2026-10-18T10:05:00Z', 'audit.app.update', 'api', 'alice')):
+            self.aggregator.add_row({'foundation': '', 'orgname': 'org', 'spacename': 'space',
+                                     'name': name, 'user': user, 'event': event, 'time': time})
+
+    def test_summary(self):
+        summary = self.aggregator.summary()
+        self.assertEqual((summary['events'], summary['first'], summary['last']),
+                         (4, '2026-10-18T09:15:00Z', '2026-10-18T10:30:00Z'))
+        self.assertEqual(summary['types']['audit.app.update'],
+                         {'events': 3, 'first': '2026-10-18T09:15:00Z',
+                          'last': '2026-10-18T10:30:00Z'})
+        self.assertEqual(summary['hours'], {'2026-10-18T09': 2, '2026-10-18T10': 2})
+        self.assertEqual(summary['top_users'], [{'name': 'alice', 'events': 3, 'overcount': 0},
+                                                {'name': 'bob', 'events': 1, 'overcount': 0}])
+        self.assertEqual(summary['top_apps'][0], {'name': 'org/space/web', 'events': 2,
+                                                  'overcount': 0})
+
+    def test_foundation_names_apps(self):
+        self.aggregator.add_row({'foundation': 'east', 'orgname': 'org', 'spacename': 'space',
+                                 'name': 'web', 'user': 'carol', 'event': 'audit.app.update',
+                                 'time': '2026-10-18T11:00:00Z'})
+        self.assertIn('east/org/space/web', [k for k, _, _ in self.aggregator.apps.top(10)])
+
+    def test_rows(self):
+        rows = self.aggregator.rows()
+        self.assertEqual(rows[0], ('total', '', 4, '2026-10-18T09:15:00Z', '2026-10-18T10:30:00Z', 0))
+        self.assertEqual([r[:3] for r in rows if r[0] == 'event type'],
+                         [('event type', 'audit.app.restage', 1),
+                          ('event type', 'audit.app.update', 3)])
+        self.assertEqual(len([r for r in rows if r[0] == 'app']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
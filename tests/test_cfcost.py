@@ -0,0 +1,70 @@
+"""Tests for the crawl cost history."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import os
+import shutil
+import tempfile
+import unittest
+from cfcost import CostHistory, lpt_order
+
+
+class LptOrderTest(unittest.TestCase):
+
+    def test_most_expensive_first(self):
+        costs = {'a': 1, 'b': 5, 'c': None, 'd': 5, 'e': 2.5}
+        self.assertEqual(lpt_order('abcde', costs.get), ['b', 'd', 'e', 'a', 'c'])
+        self.assertEqual(lpt_order([], costs.get), [])
+
+
+class CostHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = CostHistory()
+        self.history.record('api.a.com', {
+            'org': 'big', 'requests': 40, 'seconds': 8.0, 'resources': 100,
+            'spaces': {'dev': {'resources': 60, 'seconds': 5.0}, 'prod': {'resources': 40}}})
+        self.history.record('api.a.com', {'org': 'small', 'requests': 4, 'seconds': 2.0,
+                                          'resources': 0})
+
+    def test_lookups(self):
+        self.assertEqual(self.history.org_seconds('api.a.com', 'big'), 8.0)
+        self.assertIsNone(self.history.org_seconds('api.b.com', 'big'))
+        self.assertEqual(self.history.space_seconds('api.a.com', 'big', 'dev'), 5.0)
+        self.assertIsNone(self.history.space_seconds('api.a.com', 'big', 'prod'))
+
+    def test_seconds_per_resource(self):
+        # Orgs without resources are left out of the rate.
+        self.assertEqual(self.history.seconds_per_resource('api.a.com'), 0.08)
+        self.assertEqual(self.history.seconds_per_resource('api.b.com'), 1.0)
+
+    def test_estimate_probes_only_unknown_orgs(self):
+        probed = []
+
+        def probe(orgs):
+            probed.extend(orgs)
+            return dict((org, 50) for org in orgs)
+
+        costs = self.history.estimate('api.a.com', ['big', 'new', 'small'], probe)
+        self.assertEqual(costs, {'big': 8.0, 'new': 4.0, 'small': 2.0})
+        self.assertEqual(probed, ['new'])
+        self.history.estimate('api.a.com', ['big'], probe)
+        self.assertEqual(probed, ['new'])
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'costs.json')
+            self.assertEqual(CostHistory.load(filename).foundations, {})
+            self.history.save(filename)
+            loaded = CostHistory.load(filename)
+            self.assertEqual(os.listdir(directory), ['costs.json'])
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(loaded.foundations, self.history.foundations)
+        self.assertEqual(loaded.filename, filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+"""Tests for the in-memory inventory."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import os
+import shutil
+import tempfile
+import unittest
+from time import time
+from cfinventory import Inventory, InventoryWatcher, iso_timestamp, is_delete_event
+from cfrecords import App, Event
+from cloudfoundryapi import CfApi
+from fakecc import FakeCloudController
+
+
+def make_api(cc):
+    """Return a foundation-wide client of a fake Cloud Controller."""
+    return CfApi(api_host='api.example.com', login_host='login.example.com', transport=cc)
+
+
+class InventoryTestCase(unittest.TestCase):
+    """Fake foundation with an org, a space, an app and two services."""
+
+    def setUp(self):
+        self.cc = FakeCloudController()
+        self.org = self.cc.add('organizations', name='org')['metadata']['guid']
+        self.space = self.cc.add('spaces', name='space',
+                                 organization_guid=self.org)['metadata']['guid']
+        self.app = self.cc.add('apps', name='app', space_guid=self.space,
+                               state='STARTED')['metadata']['guid']
+        self.cc.add('service_instances', name='db', space_guid=self.space,
+                    last_operation={'created_at': '2026-10-01T00:00:00Z'})
+        self.cc.add('user_provided_service_instances', name='ups', space_guid=self.space)
+        self.api = make_api(self.cc)
+
+    def add_event(self, event_type, actee, actee_type='app', timestamp=None):
+        return self.cc.add('events', type=event_type, actee=actee, actee_type=actee_type,
+                           actee_name='app', actor_name='user', space_guid=self.space,
+                           organization_guid=self.org,
+                           timestamp=timestamp or iso_timestamp(time() + 60))
+
+
+class InventoryTest(InventoryTestCase):
+
+    def setUp(self):
+        InventoryTestCase.setUp(self)
+        self.inventory = Inventory()
+        self.inventory.load(self.api)
+
+    def test_load(self):
+        self.assertEqual(len(self.inventory.orgs), 1)
+        self.assertEqual(self.inventory.apps[self.app].name, 'app')
+        self.assertEqual([s.name for s in self.inventory.services.values()], ['db'])
+        self.assertEqual([s.name for s in self.inventory.user_provided_services.values()], ['ups'])
+        self.assertIsNotNone(self.inventory.crawled_at)
+
+    def test_upsert_and_remove(self):
+        self.inventory.upsert('apps', App(guid='new', name='new', space_guid=self.space))
+        self.assertEqual(sorted(a.name for a in self.inventory.apps.values()), ['app', 'new'])
+        self.inventory.remove('apps', 'new')
+        self.inventory.remove('apps', 'missing')
+        self.assertEqual(list(self.inventory.apps), [self.app])
+
+    def test_snapshot_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'snapshot.json')
+            self.inventory.save(filename)
+            self.assertEqual(os.listdir(directory), ['snapshot.json'])
+            loaded = Inventory.from_snapshot(filename)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(loaded.apps, self.inventory.apps)
+        self.assertEqual(loaded.user_provided_services, self.inventory.user_provided_services)
+        self.assertEqual(loaded.crawled_at, self.inventory.crawled_at)
+
+    def test_apply_events(self):
+        self.cc.find('apps', self.app)['entity']['state'] = 'STOPPED'
+        gone = self.cc.add('apps', name='gone', space_guid=self.space)['metadata']['guid']
+        self.inventory.load(self.api)
+        self.cc.collections['apps'].remove(self.cc.find('apps', gone))
+        events = [Event.from_resource(self.add_event(t, a)) for t, a in (
+            ('audit.app.update', self.app), ('audit.app.restage', self.app),
+            ('audit.app.delete-request', gone), ('audit.app.update', 'vanished'))]
+        before = self.cc.count('GET', '/v2/apps/')
+        self.assertEqual(self.inventory.apply_events(self.api, events), 3)
+        self.assertEqual(self.inventory.apps[self.app].state, 'STOPPED')
+        self.assertEqual(list(self.inventory.apps), [self.app])
+        # The updated app and the vanished one are fetched once each.
+        self.assertEqual(self.cc.count('GET', '/v2/apps/') - before, 2)
+        self.assertEqual(len(self.inventory.events), 4)
+
+    def test_report_rows(self):
+        self.inventory.record_events([Event.from_resource(
+            self.add_event('audit.app.update', self.app, timestamp='2026-10-18T09:00:00Z'))])
+        report = self.inventory.report_rows('east')
+        self.assertEqual(report['spaces'], [{'foundation': 'east', 'orgname': 'org',
+                                             'spacename': 'space', 'spaceguid': self.space}])
+        self.assertEqual([(a['orgname'], a['name'], a['state']) for a in report['apps']],
+                         [('org', 'app', 'STARTED')])
+        self.assertEqual(sorted((s['name'], s['date']) for s in report['services']),
+                         [('db', '2026-10-01T00:00:00Z'), ('ups', '2026-01-01T00:00:00Z')])
+        self.assertEqual([(e['spacename'], e['event'], e['time']) for e in report['events']],
+                         [('space', 'audit.app.update', '2026-10-18T09:00:00Z')])
+
+    def test_is_delete_event(self):
+        self.assertTrue(is_delete_event('audit.app.delete-request'))
+        self.assertTrue(is_delete_event('audit.service_instance.delete'))
+        self.assertFalse(is_delete_event('audit.app.update'))
+
+
+class RefreshTest(InventoryTestCase):
+
+    def setUp(self):
+        InventoryTestCase.setUp(self)
+        self.other = self.cc.add('spaces', name='other',
+                                 organization_guid=self.org)['metadata']['guid']
+        self.cc.add('apps', name='quiet', space_guid=self.other)
+        self.inventory = Inventory()
+
+    def app_names(self):
+        return sorted(a.name for a in self.inventory.apps.values())
+
+    def test_first_refresh_crawls_everything(self):
+        self.assertIsNone(self.inventory.refresh(self.api))
+        self.assertEqual(self.app_names(), ['app', 'quiet'])
+
+    def test_only_dirty_spaces_are_recrawled(self):
+        self.inventory.refresh(self.api)
+        self.inventory.crawled_at -= 60
+        self.cc.add('apps', name='new', space_guid=self.space)
+        self.add_event('audit.app.create', 'new', timestamp=iso_timestamp(time() - 30))
+        # Changes in spaces without events are not seen.
+        self.cc.add('apps', name='unseen', space_guid=self.other)
+        self.assertEqual(self.inventory.refresh(self.api), 1)
+        self.assertEqual(self.app_names(), ['app', 'new', 'quiet'])
+
+    def test_changed_and_deleted_spaces(self):
+        self.inventory.refresh(self.api)
+        self.inventory.crawled_at -= 60
+        self.cc.find('spaces', self.other)['metadata']['updated_at'] = '2026-10-18T00:00:00Z'
+        self.cc.add('apps', name='seen', space_guid=self.other)
+        self.cc.collections['spaces'].remove(self.cc.find('spaces', self.space))
+        self.assertEqual(self.inventory.refresh(self.api), 1)
+        self.assertEqual(self.app_names(), ['quiet', 'seen'])
+        self.assertEqual(self.inventory.services, {})
+
+    def test_old_crawls_are_redone(self):
+        self.inventory.refresh(self.api)
+        self.inventory.crawled_at -= 8 * 86400
+        self.assertIsNone(self.inventory.refresh(self.api))
+
+
+class InventoryWatcherTest(InventoryTestCase):
+
+    def setUp(self):
+        InventoryTestCase.setUp(self)
+        self.watcher = InventoryWatcher(self.api, reconcile_interval=3600)
+
+    def test_first_poll_reconciles(self):
+        self.assertEqual(self.watcher.poll(), 0)
+        self.assertEqual(len(self.watcher.inventory.apps), 1)
+
+    def test_poll_applies_each_event_once(self):
+        self.watcher.reconcile()
+        new = self.cc.add('apps', name='new', space_guid=self.space)['metadata']['guid']
+        self.add_event('audit.app.create', new)
+        self.assertEqual(self.watcher.poll(), 1)
+        self.assertIn(new, self.watcher.inventory.apps)
+        # Events of the last second are queried again but not re-applied.
+        self.assertEqual(self.watcher.poll(), 0)
+        self.assertEqual(len(self.watcher.inventory.events), 1)
+
+    def test_polls_within_one_second(self):
+        self.watcher.reconcile()
+        second = iso_timestamp(time() + 60)
+        for name in ('first', 'second', 'third'):
+            guid = self.cc.add('apps', name=name, space_guid=self.space)['metadata']['guid']
+            self.add_event('audit.app.create', guid, timestamp=second)
+            self.assertEqual(self.watcher.poll(), 1)
+        # All three events share a second and are each applied once.
+        self.assertEqual(self.watcher.poll(), 0)
+        self.assertEqual(len(self.watcher.inventory.events), 3)
+        self.assertEqual(len(self.watcher.inventory.apps), 4)
+
+    def test_tick_reconciles_when_due(self):
+        self.assertEqual(self.watcher.tick(), 0)
+        crawls = self.cc.count('GET', '/v2/organizations')
+        self.watcher.tick()
+        self.assertEqual(self.cc.count('GET', '/v2/organizations'), crawls)
+        self.watcher.reconcile_interval = 0
+        self.watcher.tick()
+        self.assertGreater(self.cc.count('GET', '/v2/organizations'), crawls)
+
+    def test_event_backlog(self):
+        self.add_event('audit.app.update', self.app, timestamp=iso_timestamp(time() - 600))
+        self.add_event('audit.app.update', self.app, timestamp=iso_timestamp(time() - 7200))
+        watcher = InventoryWatcher(self.api, event_backlog=3600)
+        watcher.reconcile()
+        self.assertEqual(len(watcher.inventory.events), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
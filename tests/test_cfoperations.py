@@ -0,0 +1,471 @@
+"""Tests for the command line tool."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from xml.etree import ElementTree
+import cfoperations
+from cloudfoundryapi import CfApi
+from fakecc import FakeCloudController, FakeFoundations
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def read_workbook(filename):
+    """Return the cell values of every sheet, strings and numbers as text."""
+    workbook = zipfile.ZipFile(filename)
+    names = [s.get('name') for s in ElementTree.fromstring(
+        workbook.read('xl/workbook.xml')).iter(XLSX + 'sheet')]
+    sheets = {}
+    for i, name in enumerate(names):
+        rows = []
+        for row in ElementTree.fromstring(
+                workbook.read('xl/worksheets/sheet{0}.xml'.format(i + 1))).iter(XLSX + 'row'):
+            values = []
+            for cell in row.iter(XLSX + 'c'):
+                # Blank cells are not written, place values by column.
+                column = ord(cell.get('r')[0]) - ord('A')
+                values.extend([None] * (column - len(values)))
+                value = cell.find(XLSX + 'v')
+                values.append(''.join(t.text or '' for t in cell.iter(XLSX + 't')) or
+                              (value.text if value is not None else None))
+            rows.append(values)
+        sheets[name] = rows
+    return sheets
+
+
+class CheckStartupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.started = cfoperations.STARTED
+        self.budget = cfoperations.STARTUP_BUDGET
+        self.heavy = cfoperations.HEAVY_MODULES
+
+    def tearDown(self):
+        cfoperations.STARTED = self.started
+        cfoperations.STARTUP_BUDGET = self.budget
+        cfoperations.HEAVY_MODULES = self.heavy
+
+    def test_self_check_within_budget(self):
+        process = subprocess.Popen([sys.executable, 'cfoperations.py', 'check-startup'],
+                                   cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        self.assertEqual(process.returncode, 0, out + err)
+        self.assertIn('budget', out)
+
+    def test_fails_over_budget(self):
+        cfoperations.STARTUP_BUDGET = 0.01
+        cfoperations.HEAVY_MODULES = ()
+        cfoperations.STARTED -= 1
+        with self.assertRaises(SystemExit) as raised:
+            cfoperations.check_startup()
+        self.assertIn('exceeded', str(raised.exception.code))
+
+    def test_fails_on_heavy_imports(self):
+        cfoperations.HEAVY_MODULES = ('unittest',)
+        with self.assertRaises(SystemExit) as raised:
+            cfoperations.check_startup()
+        self.assertIn('unittest', str(raised.exception.code))
+
+
+class ParseVcapServicesTest(unittest.TestCase):
+
+    def setUp(self):
+        cfoperations.s3service, cfoperations.vaultservice = 's3', 'vault'
+
+    def test_classifies_instances(self):
+        services = cfoperations.parse_vcap_services({
+            'user-provided': [{'instance_name': 'ups', 'credentials': {'port': 1}}],
+            's3': [{'instance_name': 'bucket', 'credentials': {
+                'bucket': 'b', 'api_key': 'k', 'secret_key': 's'}}],
+            'vault': [{'instance_name': 'vault', 'credentials': {
+                'endpoint': 'e', 'service_secret_path': 'p', 'role_id': 'r', 'secret_id': 'i'}}],
+            'rds': [{'instance_name': 'db', 'credentials': {
+                'hostname': 'h', 'username': 'u', 'password': 'pw', 'port': 5432, 'db_name': 'd'}}],
+            'other': [{'instance_name': 'queue', 'credentials': {'uri': 'amqp://'}}],
+        })
+        by_name = dict((s['instance_name'], s) for s in services)
+        self.assertEqual(sorted(by_name), ['bucket', 'db', 'ups', 'vault'])
+        self.assertEqual(by_name['ups']['userprovided'], 'yes')
+        self.assertEqual(by_name['bucket']['secret_key'], 's')
+        self.assertEqual(by_name['vault']['role_id'], 'r')
+        self.assertEqual((by_name['db']['host'], by_name['db']['port']), ('h', 5432))
+
+    def test_no_services(self):
+        self.assertEqual(cfoperations.parse_vcap_services({}), 'None')
+
+
+class WriteReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'report.xlsx')
+        where = {'foundation': '', 'orgname': 'org', 'spacename': 'space'}
+        self.report = {
+            'spaces': [where],
+            'apps': [dict(where, name='app', state='STARTED', date='2026-10-01T00:00:00Z')],
+            'services': [dict(where, name='db', date='2026-10-01T00:00:00Z')],
+            'events': [dict(where, name='app-{0}'.format(i % 2), user='user', event='audit.app.update',
+                            time='2026-10-18T0{0}:00:00Z'.format(9 - i)) for i in range(4)],
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_events_sorted_by_time(self):
+        cfoperations.write_report(self.report, self.filename)
+        sheets = read_workbook(self.filename)
+        self.assertEqual([r[5] for r in sheets['App Events'][1:]],
+                         ['2026-10-18T0{0}:00:00Z'.format(h) for h in (6, 7, 8, 9)])
+        self.assertNotIn('Event Summary', sheets)
+
+    def test_event_summary_without_event_rows(self):
+        cfoperations.write_report(self.report, self.filename, event_rows=False, event_summary=True)
+        sheets = read_workbook(self.filename)
+        self.assertNotIn('App Events', sheets)
+        summary = sheets['Event Summary']
+        self.assertEqual(summary[1], ['total', None, '4', '2026-10-18T06:00:00Z',
+                                      '2026-10-18T09:00:00Z', '0'])
+        self.assertEqual(sorted(r[1] for r in summary if r[0] == 'app'),
+                         ['org/space/app-0', 'org/space/app-1'])
+
+
+class CrawlTestCase(unittest.TestCase):
+    """Two fake foundations with one org, space, app, service and event each."""
+
+    def setUp(self):
+        self.controllers = {}
+        self.foundations = []
+        for name in ('east', 'west'):
+            host = name + '.example.com'
+            cc = self.controllers[host] = FakeCloudController()
+            org = cc.add('organizations', name=name + '-org')['metadata']['guid']
+            space = cc.add('spaces', name='space', organization_guid=org)['metadata']['guid']
+            cc.add('apps', name='app', space_guid=space, organization_guid=org, state='STARTED',
+                   package_updated_at='2026-10-02T00:00:00Z')
+            cc.add('service_instances', name='db', space_guid=space, organization_guid=org,
+                   service_plan_guid='plan', last_operation={'created_at': '2026-10-01T00:00:00Z'})
+            cc.add('user_provided_service_instances', name='ups', space_guid=space)
+            cc.add('events', type='audit.app.update', actee_name='app', actor_name='user',
+                   space_guid=space, organization_guid=org, timestamp='2026-10-18T09:00:00Z')
+            self.foundations.append({'name': name, 'api_host': host, 'login_host': host,
+                                     'username': 'user'})
+        self.options = dict(cfoperations.API_OPTIONS)
+        cfoperations.API_OPTIONS['transport'] = FakeFoundations(self.controllers)
+        cfoperations.SESSIONS.clear()
+
+    def tearDown(self):
+        cfoperations.API_OPTIONS.clear()
+        cfoperations.API_OPTIONS.update(self.options)
+        cfoperations.SESSIONS.clear()
+
+    def crawl(self, foundations=None, **kwargs):
+        return cfoperations.crawl_foundations(foundations or self.foundations, {'user': 'secret'},
+                                              '2026-10-18', '2026-10-18', **kwargs)
+
+
+class CrawlFoundationsTest(CrawlTestCase):
+
+    def test_rows_are_tagged_with_their_foundation(self):
+        report = self.crawl()
+        for key in ('spaces', 'apps', 'events'):
+            self.assertEqual(sorted((r['foundation'], r['orgname']) for r in report[key]),
+                             [('east', 'east-org'), ('west', 'west-org')])
+        self.assertEqual(sorted((r['foundation'], r['name']) for r in report['services']),
+                         [('east', 'db'), ('east', 'ups'), ('west', 'db'), ('west', 'ups')])
+        self.assertEqual(report['costs'], [])
+
+    def test_one_login_per_foundation(self):
+        self.crawl()
+        self.crawl()
+        self.assertEqual(sorted(cfoperations.SESSIONS), [('east.example.com', 'user'),
+                                                         ('west.example.com', 'user')])
+        for cc in self.controllers.values():
+            self.assertEqual(cc.count('POST', '/oauth/token'), 1)
+
+    def test_single_foundation(self):
+        report = self.crawl(self.foundations[1:])
+        self.assertEqual(set(r['foundation'] for r in report['apps']), set(['west']))
+        self.assertEqual(self.controllers['east.example.com'].calls, [])
+
+    def test_snapshot(self):
+        directory = tempfile.mkdtemp()
+        try:
+            snapshot = os.path.join(directory, 'inventory.json')
+            first = self.crawl(snapshot=snapshot)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['inventory-east.json', 'inventory-west.json'])
+            requests = sum(len(cc.calls) for cc in self.controllers.values())
+            second = self.crawl(snapshot=snapshot)
+        finally:
+            shutil.rmtree(directory)
+        for key in ('spaces', 'apps', 'services', 'events'):
+            self.assertEqual(sorted(first[key]), sorted(second[key]))
+        # Nothing changed, apps and services are not listed again.
+        self.assertEqual(sum(cc.count('GET', '/v2/apps') for cc in self.controllers.values()), 2)
+        self.assertGreater(sum(len(cc.calls) for cc in self.controllers.values()), requests)
+
+
+class CostedCrawlTest(CrawlTestCase):
+
+    def setUp(self):
+        CrawlTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        CrawlTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def stream(self, history):
+        cfoperations.stream_report(self.foundations, {'user': 'secret'}, '2026-10-18', '2026-10-18',
+                                   os.path.join(self.directory, 'report.xlsx'), space_summary=True,
+                                   history=history)
+
+    def test_costs_are_measured_and_recorded(self):
+        from cfcost import CostHistory
+        history = CostHistory()
+        self.stream(history)
+        costs = history.foundations['east.example.com']
+        self.assertEqual(sorted(costs['orgs']), ['east-org'])
+        self.assertEqual(costs['orgs']['east-org']['resources'], 3)
+        self.assertGreater(costs['orgs']['east-org']['requests'], 0)
+        self.assertIn('seconds', costs['spaces']['east-org/space'])
+        # The next crawl estimates the org from its history, without probes.
+        probes = self.controllers['east.example.com'].count('GET', '/v2/apps')
+        self.stream(history)
+        self.assertEqual(self.controllers['east.example.com'].count('GET', '/v2/apps'), probes)
+
+    def test_unknown_orgs_are_probed(self):
+        from cfcost import CostHistory
+        api = cfoperations.foundation_api(self.foundations[0], {'user': 'secret'})
+        costs = cfoperations.estimate_org_costs(api, ['east-org', 'missing'], CostHistory())
+        self.assertEqual(costs, {'east-org': 2.0, 'missing': 0.0})
+
+
+class SpaceSummaryCrawlTest(CrawlTestCase):
+
+    def setUp(self):
+        CrawlTestCase.setUp(self)
+        cc = self.controllers['east.example.com']
+        org = cc.collections['organizations'][0]['metadata']['guid']
+        for i in range(3):
+            space = cc.add('spaces', name='extra-{0}'.format(i), organization_guid=org)
+            cc.add('apps', name='app-{0}'.format(i), space_guid=space['metadata']['guid'],
+                   state='STOPPED')
+
+    def test_same_rows_as_the_full_crawl(self):
+        full = self.crawl()
+        summary = self.crawl(space_summary=True)
+        for key in ('spaces', 'services', 'events'):
+            self.assertEqual(sorted(full[key]), sorted(summary[key]))
+        self.assertEqual(sorted((a['name'], a['state']) for a in full['apps']),
+                         sorted((a['name'], a['state']) for a in summary['apps']))
+        self.assertIn('2026-10-02T00:00:00Z', [a['date'] for a in summary['apps']])
+
+    def test_one_summary_per_space(self):
+        self.crawl(space_summary=True)
+        cc = self.controllers['east.example.com']
+        self.assertEqual(len([c for c in cc.calls if c[1].endswith('/summary')]), 4)
+        self.assertEqual(cc.count('GET', '/v2/apps'), 0)
+        self.assertEqual(cc.count('GET', '/v2/service_instances'), 0)
+
+
+class StreamReportTest(CrawlTestCase):
+
+    def setUp(self):
+        CrawlTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        CrawlTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def test_same_workbook_as_crawl_and_write(self):
+        batch = os.path.join(self.directory, 'batch.xlsx')
+        stream = os.path.join(self.directory, 'stream.xlsx')
+        cfoperations.write_report(self.crawl(), batch, now=1792314900)
+        cfoperations.stream_report(self.foundations, {'user': 'secret'}, '2026-10-18', '2026-10-18',
+                                   stream, now=1792314900, queue_size=1)
+        self.assertEqual(read_workbook(stream), read_workbook(batch))
+        self.assertEqual(len(read_workbook(stream)['Application']), 3)
+
+    def test_sheets_are_written_by_the_calling_thread(self):
+        from xlsxwriter.worksheet import Worksheet
+        writers = set()
+        write = Worksheet.write
+
+        def record(worksheet, *args):
+            writers.add((worksheet.name, threading.current_thread().name))
+            return write(worksheet, *args)
+
+        Worksheet.write = record
+        try:
+            cfoperations.stream_report(self.foundations, {'user': 'secret'}, '2026-10-18',
+                                       '2026-10-18', os.path.join(self.directory, 'stream.xlsx'),
+                                       queue_size=1, event_summary=True)
+        finally:
+            Worksheet.write = write
+        self.assertIn('App Events', set(name for name, _ in writers))
+        self.assertEqual(set(thread for _, thread in writers),
+                         set([threading.current_thread().name]))
+
+
+class CommandEventsTest(CrawlTestCase):
+
+    def setUp(self):
+        CrawlTestCase.setUp(self)
+        self.input = cfoperations.INPUT
+        self.prompt = cfoperations.prompt_credentials
+        cfoperations.INPUT = {'FOUNDATIONS': self.foundations}
+        cfoperations.prompt_credentials = lambda username: {username: 'secret'}
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        CrawlTestCase.tearDown(self)
+        cfoperations.INPUT = self.input
+        cfoperations.prompt_credentials = self.prompt
+        shutil.rmtree(self.directory)
+
+    def run_command(self, *argv):
+        args = cfoperations.parse_args(['events', '-cfUsername', 'user', '-SDate', '2026-10-18',
+                                        '-EDate', '2026-10-18'] + list(argv))
+        args.func(args)
+
+    def test_json_lines(self):
+        output = os.path.join(self.directory, 'events.jsonl')
+        self.run_command('-Output', output)
+        with open(output) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([(e['Foundation'], e['OrgName'], e['Event']) for e in events],
+                         [('east', 'east-org', 'audit.app.update'),
+                          ('west', 'west-org', 'audit.app.update')])
+
+    def test_summary(self):
+        summary = os.path.join(self.directory, 'summary.json')
+        self.run_command('-Summary', summary)
+        with open(summary) as f:
+            self.assertEqual(json.load(f)['events'], 2)
+
+
+class IndexLookupTest(CrawlTestCase):
+
+    def test_online_and_offline(self):
+        api = cfoperations.foundation_api(self.foundations[0], {'user': 'secret'})
+        directory = tempfile.mkdtemp()
+        try:
+            snapshot = os.path.join(directory, 'index.json')
+            rows = cfoperations.index_lookup(api, 'AP', 'prefix', snapshot=snapshot)
+            offline = cfoperations.index_lookup(None, 'app', snapshot=snapshot)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([(r['kind'], r['orgname'], r['spacename'], r['name']) for r in rows],
+                         [('app', 'east-org', 'space', 'app')])
+        self.assertEqual(offline, rows)
+
+    def test_labels_and_bindings_need_the_api(self):
+        with self.assertRaises(SystemExit):
+            cfoperations.index_lookup(None, 'db', label='rds')
+
+
+class DeleteServicesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cc = FakeCloudController()
+        org = self.cc.add('organizations', name='org')['metadata']['guid']
+        space = self.cc.add('spaces', name='space', organization_guid=org)['metadata']['guid']
+        for name, operation in (('db-1', 'create'), ('db-2', 'create'), ('busy', 'delete')):
+            instance = self.cc.add('service_instances', name=name, space_guid=space,
+                                   last_operation={'type': operation, 'state': 'in progress'})
+            self.cc.add('service_keys', name='testkey', service_instance_guid=instance['metadata']['guid'])
+        self.cc.add('user_provided_service_instances', name='config', space_guid=space)
+        self.log = cfoperations.log
+        self.logged = []
+        cfoperations.sscfapi = CfApi(api_host='api.example.com', login_host='login.example.com',
+                                     transport=self.cc, org_name='org', space_name='space')
+        cfoperations.log = self.logged.append
+        cfoperations.raw_input = lambda prompt: 'y'
+        cfoperations.web = [{'instance_name': 'db-.*'}, {'instance_name': 'busy'},
+                            {'instance_name': 'missing'},
+                            {'instance_name': 'config', 'userprovided': 'yes'}]
+
+    def tearDown(self):
+        cfoperations.log = self.log
+        # The space client, prompts and service lists are module globals.
+        del cfoperations.sscfapi, cfoperations.raw_input, cfoperations.web
+
+    def test_deletes_confirmed_services(self):
+        cfoperations.delete_services(['web'])
+        names = [s['entity']['name'] for s in self.cc.collections['service_instances']]
+        self.assertEqual(names, ['busy'])
+        self.assertEqual(self.cc.collections['user_provided_service_instances'], [])
+        self.assertEqual(len(self.cc.collections['service_keys']), 1)
+        for line in ('db-1 Service is deleted.', 'db-2 Service is deleted.', 'config Service is deleted.',
+                     'missing Service is not available.'):
+            self.assertIn(line, self.logged)
+        self.assertTrue(any(line.startswith('busy Service can not be deleted') for line in self.logged))
+        # One listing before, one bulk key lookup and one listing after the deletes.
+        self.assertEqual(self.cc.count('GET', '/v2/service_instances'), 2)
+        self.assertEqual(self.cc.count('GET', '/v2/service_keys'), 1)
+
+    def test_failed_deletes_are_reported(self):
+        guid = self.cc.collections['service_instances'][0]['metadata']['guid']
+        self.cc.failures[('DELETE', '/v2/service_instances/' + guid)] = 502
+        cfoperations.delete_services(['web'])
+        self.assertTrue(any(line.startswith('db-1 Service delete failed') for line in self.logged))
+        self.assertIn('db-2 Service is deleted.', self.logged)
+
+    def test_final_confirmation(self):
+        cfoperations.raw_input = lambda prompt: 'n' if prompt.startswith('Final') else 'y'
+        with self.assertRaises(SystemExit):
+            cfoperations.delete_services(['web'])
+        self.assertEqual(self.cc.count('DELETE'), 0)
+
+
+class ResolveSpaceNamesTest(unittest.TestCase):
+
+    def test_unknown_spaces_and_orgs_are_batched(self):
+        cc = FakeCloudController()
+        orgs = [cc.add('organizations', name='org-{0}'.format(i))['metadata']['guid'] for i in range(3)]
+        spaces = [cc.add('spaces', name='space-{0}'.format(i),
+                         organization_guid=orgs[i % 3])['metadata']['guid'] for i in range(6)]
+        api = CfApi(api_host='api.example.com', login_host='login.example.com',
+                    transport=cc)
+        known = {spaces[0]: (orgs[0], 'space-0')}
+        names = {}
+        cfoperations.resolve_space_names(api, spaces + [None], known, names)
+        self.assertEqual(known[spaces[4]], (orgs[1], 'space-4'))
+        self.assertEqual(sorted(names.values()), ['org-0', 'org-1', 'org-2'])
+        self.assertEqual((cc.count('GET', '/v2/spaces'), cc.count('GET', '/v2/organizations')), (1, 1))
+        # Everything is known now, nothing is looked up again.
+        cfoperations.resolve_space_names(api, spaces, known, names)
+        self.assertEqual(len(cc.calls), 3)
+
+
+class MergeReportsTest(unittest.TestCase):
+
+    def test_concatenates_in_order(self):
+        merged = cfoperations.merge_reports([
+            {'spaces': [1], 'apps': [2], 'services': [], 'events': [3]},
+            {'spaces': [4], 'apps': [], 'services': [5], 'events': [], 'costs': [6]},
+        ])
+        self.assertEqual(merged, {'spaces': [1, 4], 'apps': [2], 'services': [5],
+                                  'events': [3], 'costs': [6]})
+
+    def test_empty(self):
+        self.assertEqual(cfoperations.merge_reports([]),
+                         {'spaces': [], 'apps': [], 'services': [], 'events': [], 'costs': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
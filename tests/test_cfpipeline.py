@@ -0,0 +1,104 @@
+"""Tests for the threaded pipelines."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import threading
+import time
+import unittest
+from cfpipeline import Cancelled, Pipeline
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_items_arrive_in_order(self):
+        with Pipeline() as pipeline:
+            numbers = pipeline.source('numbers', lambda: iter(range(100)))
+            squares = pipeline.channel('squares')
+
+            def square():
+                for n in numbers:
+                    squares.put(n * n)
+                squares.close()
+
+            pipeline.spawn(square)
+            results = list(squares)
+        self.assertEqual(results, [n * n for n in range(100)])
+        self.assertEqual([c.items for c in pipeline.channels], [100, 100])
+
+    def test_full_channels_block_the_producer(self):
+        produced = []
+
+        def produce():
+            for n in range(10):
+                produced.append(n)
+                yield n
+
+        with Pipeline(maxsize=2) as pipeline:
+            channel = pipeline.source('numbers', produce)
+            consumed = []
+            for n in channel:
+                time.sleep(0.01)
+                # The producer is never more than the channel ahead.
+                self.assertLessEqual(len(produced) - len(consumed), 4)
+                consumed.append(n)
+        self.assertEqual(consumed, range(10))
+        self.assertLessEqual(channel.high_water, 2)
+        self.assertGreater(channel.put_wait, 0)
+        line, = pipeline.stats()
+        self.assertTrue(line.startswith('numbers: 10 items, peak '), line)
+
+    def test_stage_errors_cancel_the_pipeline(self):
+        blocked = threading.Event()
+        stopped = []
+
+        def stuck(channel):
+            blocked.set()
+            try:
+                for _ in range(100):
+                    channel.put(None)
+            except Cancelled:
+                stopped.append(True)
+                raise
+
+        def fail():
+            blocked.wait(5)
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            with Pipeline(maxsize=1) as pipeline:
+                pipeline.spawn(stuck, pipeline.channel('full'))
+                pipeline.spawn(fail)
+                # The body is blocked on a channel nobody feeds.
+                list(pipeline.channel('idle'))
+        self.assertEqual(stopped, [True])
+
+    def test_errors_in_the_body_cancel_the_stages(self):
+        with self.assertRaises(KeyError):
+            with Pipeline(maxsize=1) as pipeline:
+                pipeline.source('numbers', lambda: iter(range(100)))
+                raise KeyError('body')
+
+    def test_drain_does_not_wait(self):
+        with Pipeline() as pipeline:
+            channel = pipeline.channel('numbers')
+            self.assertEqual(channel.drain(), [])
+            channel.put(1)
+            channel.put(2)
+            self.assertEqual(channel.drain(), [1, 2])
+            channel.put(3)
+            channel.close()
+            self.assertEqual(channel.drain(), [3])
+            self.assertEqual(channel.drain(), [])
+            self.assertEqual(list(channel), [])
+
+    def test_cancel(self):
+        pipeline = Pipeline(maxsize=1)
+        channel = pipeline.channel('empty')
+        pipeline.cancel()
+        with self.assertRaises(Cancelled):
+            list(channel)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests for the API call profiler."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import unittest
+from cfprofiler import ApiProfiler, url_template
+from cloudfoundryapi import CfApi
+
+GUID = '0000000{0}-0000-0000-0000-000000000000'
+
+
+class EchoTransport(object):
+    """Answers every request with an empty page."""
+
+    def request(self, url, headers=None, params=None, body=None, method='GET'):
+        # pylint: disable=unused-argument
+        return {'total_results': 0, 'next_url': None, 'resources': []}
+
+
+class UrlTemplateTest(unittest.TestCase):
+
+    def test_collapses_guids_ids_and_query(self):
+        self.assertEqual(
+            url_template('https://api/v2/spaces/{0}/apps/12?q=a&page=2&q=b'.format(
+                GUID.format(1))),
+            '/v2/spaces/:guid/apps/:id?page&q')
+
+
+class ApiProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = ApiProfiler(threshold=3)
+        self.api = CfApi(api_host='api', login=False, transport=EchoTransport(),
+                         profiler=self.profiler, coalesce=False, max_workers=4)
+
+    def sites(self):
+        return set(c.call_site for c in self.profiler.calls)
+
+    def test_call_site_is_the_caller(self):
+        for i in range(4):
+            self.api.space_summary(GUID.format(i))
+        site, = self.sites()
+        self.assertTrue(site.startswith('test_cfprofiler.py:'), site)
+        self.assertTrue(site.endswith('(test_call_site_is_the_caller)'), site)
+        self.assertEqual(set(c.api_method for c in self.profiler.calls), set(['space_summary']))
+
+    def test_pool_requests_keep_the_submitting_call_site(self):
+        guids = [GUID.format(i) for i in range(8)]
+        self.api.map_concurrent(self.api.space_summary, guids)
+        list(self.api.imap_concurrent(self.api.space_summary, guids))
+        self.assertEqual(len(self.profiler.calls), 16)
+        sites = self.sites()
+        self.assertEqual(len(sites), 2)
+        for site in sites:
+            self.assertIn('(test_pool_requests_keep_the_submitting_call_site)', site)
+        self.assertEqual(set(c.api_method for c in self.profiler.calls), set(['space_summary']))
+
+    def test_hotspots(self):
+        for i in range(4):
+            self.api.space_summary(GUID.format(i))
+        for _ in range(3):
+            self.api.space_summary(GUID.format(0))
+        kinds = sorted(h['kind'] for h in self.profiler.hotspots())
+        self.assertEqual(kinds, ['duplicate', 'per-row'])
+
+
+if __name__ == '__main__':
+    unittest.main()
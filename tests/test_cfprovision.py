@@ -0,0 +1,145 @@
+"""Tests for bulk provisioning."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import unittest
+from cfprovision import Provisioner
+from cloudfoundryapi import CfApi
+from fakecc import FakeCloudController
+
+MANIFEST = {
+    'services': [{'name': 'db', 'broker': 'rds', 'plan': 'micro'},
+                 {'name': 'cache', 'broker': 'redis', 'plan': 'slow'}],
+    'user_provided_services': [{'name': 'config', 'credentials': {'url': 'https://example.com'}}],
+    'apps': [{'name': 'web', 'services': ['db', 'cache', 'config']},
+             {'name': 'worker', 'services': ['config']}],
+}
+
+
+class BrokerController(FakeCloudController):
+    """Creates instances of 'slow' and 'broken' plans asynchronously.
+
+    Asynchronous instances finish after two listings of the service
+    instances, 'broken' ones fail and 'gone' ones are deleted.
+    """
+
+    def __init__(self):
+        FakeCloudController.__init__(self)
+        self.async_plans = {}
+        self.pending = {}
+
+    def request(self, url, headers=None, params=None, body=None, method='GET'):
+        # pylint: disable=missing-docstring
+        response = FakeCloudController.request(self, url, headers, params, body, method)
+        if method == 'POST' and '/v2/service_instances' in url:
+            final = self.async_plans.get(response['entity']['service_plan_guid'])
+            state = 'succeeded'
+            if final is not None:
+                self.pending[response['metadata']['guid']] = [2, final]
+                state = 'in progress'
+            response['entity']['last_operation'] = {'type': 'create', 'state': state}
+        elif method == 'GET' and url.endswith('/v2/service_instances'):
+            for instance_guid, remaining in list(self.pending.items()):
+                remaining[0] -= 1
+                if not remaining[0]:
+                    del self.pending[instance_guid]
+                    instance = self.find('service_instances', instance_guid)
+                    if remaining[1] == 'deleted':
+                        self.collections['service_instances'].remove(instance)
+                    else:
+                        instance['entity']['last_operation'] = {'type': 'create',
+                                                                'state': remaining[1]}
+        return response
+
+
+class ProvisionerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cc = BrokerController()
+        org = self.cc.add('organizations', name='org')['metadata']['guid']
+        self.space = self.cc.add('spaces', name='space', organization_guid=org)['metadata']['guid']
+        final = {'slow': 'succeeded', 'broken': 'failed', 'gone': 'deleted'}
+        for label, plans in (('rds', ('micro',)), ('redis', ('slow', 'broken', 'gone'))):
+            service = self.cc.add('services', label=label)['metadata']['guid']
+            for plan in plans:
+                plan_guid = self.cc.add('service_plans', name=plan,
+                                        service_guid=service)['metadata']['guid']
+                if plan != 'micro':
+                    self.cc.async_plans[plan_guid] = final[plan]
+        self.api = CfApi(api_host='api.example.com', login_host='login.example.com',
+                         transport=self.cc, org_name='org', space_name='space')
+        self.provisioner = Provisioner(self.api, poll_interval=0, timeout=5)
+
+    def bindings(self):
+        names = dict((r['metadata']['guid'], r['entity']['name'])
+                     for kind in ('apps', 'service_instances', 'user_provided_service_instances')
+                     for r in self.cc.collections[kind])
+        return sorted('{0} -> {1}'.format(names[b['entity']['app_guid']],
+                                          names[b['entity']['service_instance_guid']])
+                      for b in self.cc.collections['service_bindings'])
+
+    def test_provision(self):
+        result = self.provisioner.provision(MANIFEST)
+        self.assertTrue(result.ok, result.failed)
+        self.assertEqual(sorted(result.created), [
+            ('app', 'web'), ('app', 'worker'),
+            ('binding', 'web -> cache'), ('binding', 'web -> config'), ('binding', 'web -> db'),
+            ('binding', 'worker -> config'),
+            ('service', 'cache'), ('service', 'db'), ('user_provided_service', 'config')])
+        self.assertEqual(self.bindings(), ['web -> cache', 'web -> config', 'web -> db',
+                                           'worker -> config'])
+        # The catalog is listed once for both instances.
+        self.assertEqual(self.cc.count('GET', '/v2/service_plans'), 1)
+
+    def test_rerun_is_idempotent(self):
+        self.provisioner.provision(MANIFEST)
+        posts = self.cc.count('POST')
+        result = self.provisioner.provision(MANIFEST)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.created, [])
+        self.assertEqual(len(result.existing), 9)
+        self.assertEqual(self.cc.count('POST'), posts)
+
+    def test_failed_instances_are_not_bound(self):
+        manifest = dict(MANIFEST, services=[{'name': 'db', 'broker': 'rds', 'plan': 'micro'},
+                                            {'name': 'cache', 'broker': 'redis', 'plan': 'broken'}])
+        result = self.provisioner.provision(manifest)
+        self.assertFalse(result.ok)
+        self.assertEqual(sorted(f[:2] for f in result.failed),
+                         [('binding', 'web -> cache'), ('service', 'cache')])
+        self.assertNotIn(('service', 'cache'), result.created)
+        self.assertEqual(self.bindings(), ['web -> config', 'web -> db', 'worker -> config'])
+
+    def test_deleted_instances_are_not_awaited(self):
+        manifest = dict(MANIFEST, services=[{'name': 'db', 'broker': 'rds', 'plan': 'micro'},
+                                            {'name': 'cache', 'broker': 'redis', 'plan': 'gone'}])
+        result = self.provisioner.provision(manifest)
+        self.assertEqual(sorted(result.failed), [
+            ('binding', 'web -> cache', 'service instance creation failed'),
+            ('service', 'cache', 'service instance is gone')])
+        self.assertNotIn(('service', 'cache'), result.created)
+        self.assertEqual(self.bindings(), ['web -> config', 'web -> db', 'worker -> config'])
+
+    def test_unknown_plans_and_services(self):
+        result = self.provisioner.provision({
+            'services': [{'name': 'db', 'broker': 'rds', 'plan': 'huge'}],
+            'apps': [{'name': 'web', 'services': ['db', 'missing']}]})
+        self.assertEqual(sorted(result.failed), [
+            ('binding', 'web -> db', 'unknown service instance'),
+            ('binding', 'web -> missing', 'unknown service instance'),
+            ('service', 'db', 'Invalid service plan')])
+        self.assertEqual(result.created, [('app', 'web')])
+
+    def test_timeout(self):
+        self.provisioner.timeout = 0
+        result = self.provisioner.provision({
+            'services': [{'name': 'cache', 'broker': 'redis', 'plan': 'slow'}],
+            'apps': [{'name': 'web', 'services': ['cache']}]})
+        self.assertEqual(sorted(f[:2] for f in result.failed),
+                         [('binding', 'web -> cache'), ('service', 'cache')])
+        self.assertEqual(self.bindings(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Tests for the local inventory query service."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import threading
+import unittest
+from cfinventory import Inventory
+from cfquery import InventoryQuery, QueryError, make_server
+from cfrecords import App, Org, Space
+from cloudfoundryapi import CfApi
+
+ORG = '00000000-0000-0000-0000-00000000000a'
+SPACE = '00000000-0000-0000-0000-00000000000b'
+
+
+def app_guid(i):
+    return '00000000-0000-0000-0000-{0:012d}'.format(i)
+
+
+def make_inventory(napps):
+    inventory = Inventory()
+    inventory.upsert('orgs', Org(guid=ORG, name='org'))
+    inventory.upsert('spaces', Space(guid=SPACE, name='space', organization_guid=ORG))
+    for i in range(napps):
+        inventory.upsert('apps', App(guid=app_guid(i), name='app-{0}'.format(i),
+                                     state='STARTED', space_guid=SPACE))
+    return inventory
+
+
+class InventoryQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.query = InventoryQuery(make_inventory(5))
+
+    def test_filters_and_pages(self):
+        page = self.query.get('/v2/apps', {'q': ['name IN app-1,app-3'],
+                                           'results-per-page': ['1']})
+        self.assertEqual(page['total_results'], 2)
+        self.assertEqual(page['total_pages'], 2)
+        self.assertEqual(len(page['resources']), 1)
+        self.assertTrue(page['next_url'])
+
+    def test_resolves_org_through_space(self):
+        page = self.query.get('/v2/apps', {'q': ['organization_guid:' + ORG]})
+        self.assertEqual(page['total_results'], 5)
+
+    def test_unknown_collection(self):
+        with self.assertRaises(QueryError) as raised:
+            self.query.get('/v2/nothing', {})
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_single_resource(self):
+        copied = []
+        records = self.query.records
+        self.query.records = lambda collection: copied.append(collection) or records(collection)
+        resource = self.query.get('/v2/apps/' + app_guid(3), {})
+        self.assertEqual(resource['entity']['name'], 'app-3')
+        with self.assertRaises(QueryError) as raised:
+            self.query.get('/v2/apps/' + app_guid(9), {})
+        self.assertEqual(raised.exception.status, 404)
+        self.assertEqual(copied, [])
+
+    def test_nested_listing_copies_only_children(self):
+        copied = []
+        records = self.query.records
+        self.query.records = lambda collection: copied.append(collection) or records(collection)
+        page = self.query.get('/v2/spaces/{0}/apps'.format(SPACE), {})
+        self.assertEqual(page['total_results'], 5)
+        self.assertEqual(copied, ['apps'])
+
+
+class CfApiClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = make_server(make_inventory(120), port=0)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.api = CfApi(api_host='127.0.0.1:{0}'.format(self.server.server_address[1]),
+                         scheme='http', login=False)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_lists_apps(self):
+        apps = self.api.apps(records=True)
+        self.assertEqual(sorted(a.guid for a in apps), [app_guid(i) for i in range(120)])
+        self.assertTrue(all(a.space_guid == SPACE for a in apps))
+
+    def test_scoped_client(self):
+        api = self.api.scope('org', 'space')
+        self.assertEqual((api.org_guid, api.space_guid), (ORG, SPACE))
+        self.assertEqual(len(api.apps()), 120)
+
+
+if __name__ == '__main__':
+    unittest.main()
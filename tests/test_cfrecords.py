@@ -0,0 +1,51 @@
+"""Tests for the slotted resource records."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import unittest
+from cfrecords import App, ServiceInstance
+
+INSTANCE = {
+    'metadata': {'guid': 'g', 'url': '/v2/service_instances/g',
+                 'created_at': '2026-01-01T00:00:00Z', 'updated_at': None},
+    'entity': {'name': 'db', 'space_guid': 's', 'service_plan_guid': 'p',
+               'credentials': {'password': 'secret'},
+               'last_operation': {'type': 'create', 'state': 'succeeded',
+                                  'created_at': '2026-01-01T00:00:00Z'}},
+}
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_from_resource(self):
+        record = ServiceInstance.from_resource(INSTANCE)
+        self.assertEqual((record.guid, record.name, record.last_operation_state),
+                         ('g', 'db', 'succeeded'))
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertNotIn('credentials', record.to_dict())
+
+    def test_projection(self):
+        record = ServiceInstance.from_resource(INSTANCE, fields=('name', 'guid'))
+        self.assertEqual(record.name, 'db')
+        self.assertIsNone(record.space_guid)
+
+    def test_missing_nested_values(self):
+        resource = {'metadata': {'guid': 'g'}, 'entity': {'last_operation': None}}
+        record = ServiceInstance.from_resource(resource)
+        self.assertIsNone(record.last_operation_state)
+
+    def test_from_page(self):
+        records = ServiceInstance.from_page({'resources': [INSTANCE, INSTANCE]}, ['name'])
+        self.assertEqual([r.name for r in records], ['db', 'db'])
+        self.assertEqual(App.from_page({}), [])
+
+    def test_round_trip(self):
+        record = ServiceInstance.from_resource(INSTANCE)
+        self.assertEqual(ServiceInstance.from_resource(record.to_resource()), record)
+        self.assertEqual(ServiceInstance(**record.to_dict()), record)
+        self.assertNotEqual(App(guid='g'), ServiceInstance(guid='g'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests for the columnar report model."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import datetime
+import unittest
+from cfreport import ReportTable, format_duration, parse_timestamps
+
+
+class ParseTimestampsTest(unittest.TestCase):
+
+    def test_parses_and_marks_missing(self):
+        seconds = parse_timestamps(['1970-01-02T00:00:01Z', None, '2026-10-18T09:15:00Z'])
+        self.assertEqual(seconds[0], 86401)
+        self.assertNotEqual(seconds[1], seconds[1])
+        self.assertEqual(seconds[2], 1792314900)
+
+
+class FormatDurationTest(unittest.TestCase):
+
+    def test_matches_timedelta(self):
+        for seconds in (0, 59, 3600, 86399, 86400, 2 * 86400 + 3723):
+            self.assertEqual(format_duration(seconds),
+                             str(datetime.timedelta(seconds=seconds)))
+
+    def test_nan_is_blank(self):
+        self.assertEqual(format_duration(float('nan')), '')
+
+
+class ReportTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = ReportTable(['org', 'name', 'date'])
+        self.table.extend([
+            {'org': 'b', 'name': 'x', 'date': '2026-10-18T00:00:00Z'},
+            {'org': 'a', 'name': 'y', 'date': None},
+            {'org': 'a', 'name': 'x'},
+        ])
+
+    def test_missing_columns_are_none(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(list(self.table['date']), ['2026-10-18T00:00:00Z', None, None])
+
+    def test_sort_by(self):
+        ordered = self.table.sort_by('org', 'name')
+        self.assertEqual(list(ordered.rows('org', 'name')), [('a', 'x'), ('a', 'y'), ('b', 'x')])
+        # The original table is left alone.
+        self.assertEqual(list(self.table['org']), ['b', 'a', 'a'])
+
+    def test_add_durations(self):
+        now = parse_timestamps(['2026-10-19T01:00:00Z'])[0]
+        self.table.add_durations('date', now=now)
+        self.assertEqual(self.table['duration_seconds'][0], 90000)
+        self.assertEqual(list(self.table['duration']), ['1 day, 1:00:00', '', ''])
+        # Duration columns follow the rows when sorting.
+        ordered = self.table.sort_by('org', 'name')
+        self.assertEqual(list(ordered['duration']), ['', '', '1 day, 1:00:00'])
+
+    def test_add_column_checks_length(self):
+        with self.assertRaises(ValueError):
+            self.table.add_column('extra', [1])
+
+    def test_group_by(self):
+        self.assertEqual(dict(self.table.group_by('org')), {('b',): [0], ('a',): [1, 2]})
+
+
+if __name__ == '__main__':
+    unittest.main()
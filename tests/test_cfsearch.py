@@ -0,0 +1,139 @@
+"""Tests for the local search index."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import unittest
+from cfinventory import Inventory
+from cfrecords import App, Org, ServiceInstance, Space, UserProvidedService
+from cfsearch import SearchIndex, trigrams
+
+
+def make_inventory():
+    """Two orgs with a 'dev' space each, apps and services in them."""
+    inventory = Inventory()
+    for record in (Org(guid='o1', name='payments'), Org(guid='o2', name='search')):
+        inventory.upsert('orgs', record)
+    for record in (Space(guid='s1', name='dev', organization_guid='o1'),
+                   Space(guid='s2', name='prod', organization_guid='o1'),
+                   Space(guid='s3', name='dev', organization_guid='o2')):
+        inventory.upsert('spaces', record)
+    for record in (App(guid='a1', name='checkout-api', space_guid='s1'),
+                   App(guid='a2', name='Checkout-Worker', space_guid='s2'),
+                   App(guid='a3', name='indexer', space_guid='s3')):
+        inventory.upsert('apps', record)
+    for record in (ServiceInstance(guid='i1', name='checkout-db', space_guid='s1',
+                                   service_plan_guid='p-rds'),
+                   ServiceInstance(guid='i2', name='cache', space_guid='s3',
+                                   service_plan_guid='p-redis')):
+        inventory.upsert('services', record)
+    inventory.upsert('user_provided_services',
+                     UserProvidedService(guid='u1', name='checkout-config', space_guid='s1'))
+    return inventory
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.inventory = make_inventory()
+        self.index = SearchIndex()
+        self.index.sync(self.inventory)
+
+    def names(self, pattern, match='exact', **kwargs):
+        return sorted(r['name'] for r in self.index.search(pattern, match, **kwargs))
+
+    def test_exact(self):
+        row, = self.index.search('checkout-api')
+        self.assertEqual(row, {'kind': 'app', 'orgname': 'payments', 'spacename': 'dev',
+                               'name': 'checkout-api', 'guid': 'a1', 'label': None})
+        self.assertEqual(self.names('Checkout-api'), [])
+        self.assertEqual(self.names('dev'), ['dev', 'dev'])
+
+    def test_prefix_ignores_case(self):
+        self.assertEqual(self.names('CHECKOUT-', 'prefix'),
+                         ['Checkout-Worker', 'checkout-api', 'checkout-config', 'checkout-db'])
+        self.assertEqual(self.names('zzz', 'prefix'), [])
+
+    def test_substring(self):
+        self.assertEqual(self.names('OUT-', 'substring'),
+                         ['Checkout-Worker', 'checkout-api', 'checkout-config', 'checkout-db'])
+        self.assertEqual(self.names('de', 'substring'), ['dev', 'dev', 'indexer'])
+        self.assertEqual(self.names('-worker-', 'substring'), [])
+
+    def test_regex(self):
+        self.assertEqual(self.names(r'^c\w+-(api|db)$', 'regex'), ['checkout-api', 'checkout-db'])
+        self.assertEqual(self.names('(?i)worker', 'regex'), ['Checkout-Worker'])
+
+    def test_unknown_match_mode(self):
+        with self.assertRaises(ValueError):
+            self.index.search('x', 'fuzzy')
+
+    def test_filters(self):
+        self.assertEqual(self.names('checkout', 'prefix', kinds=['service', 'user-provided']),
+                         ['checkout-config', 'checkout-db'])
+        self.assertEqual(self.names('dev', org='search'), ['dev'])
+        self.assertEqual(self.names('checkout', 'prefix', space='prod'), ['Checkout-Worker'])
+        self.assertEqual(self.names('', 'prefix', org='search', kinds=['app', 'service']),
+                         ['cache', 'indexer'])
+
+    def test_labels(self):
+        self.index.set_labels({'rds': {'micro': 'p-rds'}, 'redis': {'small': 'p-redis'}})
+        self.assertEqual(self.names('c', 'prefix', label='redis'), ['cache'])
+        self.assertEqual(self.index.search('checkout-db')[0]['label'], 'rds')
+
+    def test_bound_to(self):
+        self.index.set_bindings([
+            {'entity': {'app_guid': 'a1', 'service_instance_guid': 'i1'}},
+            {'entity': {'app_guid': 'a1', 'service_instance_guid': 'u1'}},
+            {'entity': {'app_guid': 'a2', 'service_instance_guid': 'i1'}}])
+        self.assertEqual(self.names('checkout', 'prefix', bound_to='checkout-db'),
+                         ['Checkout-Worker', 'checkout-api'])
+        self.assertEqual(self.names('checkout', 'prefix', bound_to='checkout-api'),
+                         ['checkout-config', 'checkout-db'])
+
+    def test_sync_touches_only_changes(self):
+        self.assertEqual(len(self.index), 11)
+        self.assertEqual(self.index.sync(self.inventory), 0)
+        self.inventory.upsert('apps', App(guid='a3', name='crawler', space_guid='s3'))
+        self.inventory.remove('services', 'i2')
+        self.assertEqual(self.index.sync(self.inventory), 2)
+        self.assertEqual(self.names('indexer'), [])
+        self.assertEqual(self.names('cra', 'prefix'), ['crawler'])
+        self.assertEqual(self.names('ache', 'substring'), [])
+
+    def test_sync_skips_unchanged_collections(self):
+        copied = []
+        collection = self.inventory.collection
+        self.inventory.collection = lambda name: copied.append(name) or collection(name)
+        self.assertEqual(self.index.sync(self.inventory), 0)
+        self.assertEqual(copied, [])
+        self.inventory.remove('apps', 'missing')
+        self.inventory.upsert('apps', App(guid='a4', name='scheduler', space_guid='s3'))
+        del copied[:]
+        self.assertEqual(self.index.sync(self.inventory), 1)
+        self.assertEqual(copied, ['apps'])
+
+    def test_other_inventories_are_synced_in_full(self):
+        other = make_inventory()
+        other.remove('orgs', 'o2')
+        self.assertEqual(self.index.sync(other), 1)
+        self.assertEqual(self.names('dev', org='search'), [])
+
+    def test_space_renames_need_no_reindexing(self):
+        self.inventory.upsert('spaces', Space(guid='s1', name='development', organization_guid='o1'))
+        self.assertEqual(self.index.sync(self.inventory), 1)
+        self.assertEqual(self.index.search('checkout-api')[0]['spacename'], 'development')
+
+    def test_add_and_remove(self):
+        self.assertFalse(self.index.add('app', App(guid='a1', name='checkout-api', space_guid='s1')))
+        self.assertTrue(self.index.remove('app', 'a1'))
+        self.assertFalse(self.index.remove('app', 'a1'))
+        self.assertEqual(self.names('checkout-api'), [])
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('abcd'), set(['abc', 'bcd']))
+        self.assertEqual(trigrams('ab'), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
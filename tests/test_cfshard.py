@@ -0,0 +1,110 @@
+"""Tests for sharded execution and the directory work queue."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from cfshard import FileWorkQueue, ShardError, make_shards, run_local, run_queue, run_worker
+
+
+def total(payload):
+    return sum(payload['items'])
+
+
+def flaky(payload):
+    if payload['items'][0] == 0 and not os.path.exists(payload['marker']):
+        open(payload['marker'], 'w').close()
+        raise ValueError('first attempt fails')
+    return sum(payload['items'])
+
+
+class MakeShardsTest(unittest.TestCase):
+
+    def test_splits_items(self):
+        shards = make_shards(range(5), 2, payload={'x': 1})
+        self.assertEqual([s['id'] for s in shards], [0, 1, 2])
+        self.assertEqual([s['payload']['items'] for s in shards], [[0, 1], [2, 3], [4]])
+        self.assertTrue(all(s['payload']['x'] == 1 for s in shards))
+
+
+class RunLocalTest(unittest.TestCase):
+
+    def test_results_in_shard_order(self):
+        self.assertEqual(run_local(make_shards(range(10), 3), total, 2), [3, 12, 21, 9])
+
+
+class FileWorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.queue = FileWorkQueue(self.root, max_attempts=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def work(self, task=total):
+        worker = threading.Thread(target=run_worker, args=(FileWorkQueue(self.root), task),
+                                  kwargs={'poll_interval': 0.01, 'exit_when_idle': True})
+        worker.start()
+        return worker
+
+    def run_shards(self, shards, task=total):
+        results = []
+        coordinator = threading.Thread(
+            target=lambda: results.append(run_queue(self.queue, shards, poll_interval=0.01)))
+        coordinator.start()
+        while coordinator.is_alive():
+            self.work(task).join()
+            coordinator.join(0.01)
+        return results[0] if results else None
+
+    def test_run_queue(self):
+        self.assertEqual(self.run_shards(make_shards(range(10), 3)), [3, 12, 21, 9])
+
+    def test_retries_failed_shard(self):
+        marker = os.path.join(self.root, 'marker')
+        shards = make_shards(range(4), 2, payload={'marker': marker})
+        self.assertEqual(self.run_shards(shards, flaky), [1, 5])
+
+    def test_gives_up_after_max_attempts(self):
+        shard = dict(make_shards([1], 1)[0], run='r')
+        self.queue.put(shard)
+        for _ in range(2):
+            self.queue.fail(self.queue.claim(), 'boom')
+        self.assertIsNone(self.queue.claim())
+        with self.assertRaises(ShardError):
+            self.queue.collect('r')
+
+    def test_leftovers_of_earlier_runs_are_ignored(self):
+        # An earlier run left a failed shard, a finished shard and a
+        # pending shard with the same ids the next run uses.
+        for state, shard in (('failed', {'id': 0, 'attempts': 3, 'error': 'old'}),
+                             ('done', {'id': 1, 'attempts': 0, 'result': 'stale'}),
+                             ('pending', {'id': 2, 'attempts': 0, 'payload': {'items': [100]}})):
+            with open(os.path.join(self.root, state, '1.old-{0}.json'.format(shard['id'])),
+                      'w') as f:
+                json.dump(dict(shard, run='1.old'), f)
+        self.assertEqual(self.run_shards(make_shards(range(6), 2)), [1, 5, 9])
+
+    def test_collect_keeps_other_runs(self):
+        self.queue.put({'id': 0, 'attempts': 0, 'run': 'a', 'payload': {'items': [1]}})
+        self.queue.put({'id': 0, 'attempts': 0, 'run': 'b', 'payload': {'items': [2]}})
+        self.work().join()
+        self.assertEqual([s['result'] for s in self.queue.collect('b')], [2])
+        self.assertEqual([s['result'] for s in self.queue.collect('a')], [1])
+
+    def test_requeue_stale(self):
+        self.queue.lease = 0
+        self.queue.put({'id': 0, 'attempts': 0, 'run': 'a', 'payload': {}})
+        self.queue.claim()
+        self.assertEqual(self.queue.requeue_stale(), 1)
+        self.assertEqual(self.queue.claim()['attempts'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,356 @@
+"""Tests for the transports."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import gzip
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+from multiprocessing.pool import ThreadPool
+from cftransport import (CassetteMiss, HedgingTransport, Http2Transport, RecordingTransport,
+                         ReplayTransport, redact, redact_text, request_key)
+from cloudfoundryapi import CfApi
+from fakecc import FakeCloudController
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import hyper  # pylint: disable=unused-import
+except ImportError:
+    h2 = None
+
+
+class H2cServer(object):
+    """Cleartext HTTP/2 server answering every stream after a delay.
+
+    Attributes:
+        connections (int): Connections accepted.
+        peak (int): Most streams answered at once.
+        peak_per_connection (int): Most streams answered at once on one
+            connection.
+    """
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.connections = 0
+        self.peak = 0
+        self.peak_per_connection = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._listener = socket.socket()
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        self._start(self._accept)
+
+    @staticmethod
+    def _start(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except socket.error:
+                return
+            # Accepted while a client connects with a default timeout.
+            sock.settimeout(None)
+            with self._lock:
+                self.connections += 1
+            self._start(self._serve, sock)
+
+    def _serve(self, sock):
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        sock.sendall(conn.data_to_send())
+        write = threading.Lock()
+        state = {'active': 0}
+        paths = {}
+        while True:
+            try:
+                data = sock.recv(65535)
+            except socket.error:
+                break
+            if not data:
+                break
+            with write:
+                events = conn.receive_data(data)
+                sock.sendall(conn.data_to_send())
+            for event in events:
+                if isinstance(event, h2.events.RequestReceived):
+                    paths[event.stream_id] = dict(event.headers)[':path']
+                elif isinstance(event, h2.events.StreamEnded):
+                    self._start(self._respond, conn, sock, write, state, event.stream_id,
+                                paths.pop(event.stream_id))
+        sock.close()
+
+    def _respond(self, conn, sock, write, state, stream_id, path):
+        with self._lock:
+            self._active += 1
+            state['active'] += 1
+            self.peak = max(self.peak, self._active)
+            self.peak_per_connection = max(self.peak_per_connection, state['active'])
+        time.sleep(self.delay)
+        with self._lock:
+            self._active -= 1
+            state['active'] -= 1
+        status = '404' if path.startswith('/missing') else '200'
+        data = json.dumps({'path': path})
+        with write:
+            conn.send_headers(stream_id, [(':status', status),
+                                          ('content-length', str(len(data)))])
+            conn.send_data(stream_id, data, end_stream=True)
+            sock.sendall(conn.data_to_send())
+
+
+@unittest.skipIf(h2 is None, 'needs the hyper and h2 packages')
+class Http2TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = H2cServer()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.port)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_request(self):
+        transport = Http2Transport(5, 5)
+        response = transport.request(self.url + '/v2/apps', params={'q': ['a:1', 'b:2']})
+        self.assertEqual(response['path'], '/v2/apps?q=a%3A1&q=b%3A2')
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            transport.request(self.url + '/missing')
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_multiplexes_within_max_streams(self):
+        transport = Http2Transport(5, 5, max_streams=4, connections=2)
+        pool = ThreadPool(20)
+        try:
+            paths = pool.map(lambda i: transport.request('{0}/v2/apps/{1}'.format(self.url, i)),
+                             range(40))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual([p['path'] for p in paths], ['/v2/apps/{0}'.format(i) for i in range(40)])
+        self.assertEqual((transport.opened, self.server.connections), (2, 2))
+        # Streams share a connection, but never more than max_streams.
+        self.assertGreater(self.server.peak_per_connection, 1)
+        self.assertLessEqual(self.server.peak_per_connection, 4)
+        self.assertLessEqual(self.server.peak, 8)
+        self.assertEqual(transport.peak_streams, 8)
+
+    def test_read_timeout(self):
+        self.server.delay = 1
+        transport = Http2Transport(1, 0.2)
+        start = time.time()
+        with self.assertRaises(socket.timeout):
+            transport.request(self.url + '/slow')
+        self.assertLess(time.time() - start, 0.9)
+        self.assertIsNone(socket.getdefaulttimeout())
+        # The broken connection is replaced.
+        self.server.delay = 0
+        self.assertEqual(transport.request(self.url + '/again')['path'], '/again')
+        self.assertEqual(transport.opened, 2)
+
+
+class RedactTest(unittest.TestCase):
+
+    def test_secrets_are_replaced(self):
+        self.assertEqual(redact({
+            'name': 'db', 'password': 'pw', 'Access_Token': 'abc',
+            'credentials': {'uri': 'postgres://user:pw@host/db', 'secret_key': 42,
+                            'ports': [1, 2], 'tokens': ['a'], 'private_key': {'pem': 'k'}},
+            'list': [{'api_key': 'k'}, 'https://u:p@example.com/path'],
+        }), {
+            'name': 'db', 'password': '<redacted>', 'Access_Token': '<redacted>',
+            'credentials': {'uri': 'postgres://<redacted>@host/db', 'secret_key': '<redacted>',
+                            'ports': [1, 2], 'tokens': '<redacted>',
+                            'private_key': '<redacted>'},
+            'list': [{'api_key': '<redacted>'}, 'https://<redacted>@example.com/path'],
+        })
+
+    def test_redact_text(self):
+        self.assertEqual(json.loads(redact_text('{"description": "x", "token": "t"}')),
+                         {'description': 'x', 'token': '<redacted>'})
+        self.assertEqual(redact_text('failed: amqp://user:pw@host'), 'failed: amqp://<redacted>@host')
+
+
+class RequestKeyTest(unittest.TestCase):
+
+    def test_host_and_query_order_are_ignored(self):
+        self.assertEqual(request_key('https://api.a.com/v2/apps?page=2&q=name:x'),
+                         request_key('http://127.0.0.1:8080/v2/apps?q=name:x', params={'page': 2}))
+        self.assertNotEqual(request_key('https://api.a.com/v2/apps?page=2'),
+                            request_key('https://api.a.com/v2/apps?page=3'))
+        self.assertNotEqual(request_key('https://api.a.com/v2/apps'),
+                            request_key('https://api.a.com/v2/apps', method='DELETE'))
+
+    def test_secrets_in_bodies_are_ignored(self):
+        self.assertEqual(request_key('/oauth/token', body={'username': 'u', 'password': 'a'},
+                                     method='POST'),
+                         request_key('/oauth/token', body={'username': 'u', 'password': 'b'},
+                                     method='POST'))
+        self.assertEqual(request_key('/v2/service_keys', body='{"name": "k", "b": 1}', method='POST'),
+                         request_key('/v2/service_keys', body='{"b": 1, "name": "k"}', method='POST'))
+
+
+class RecordReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cassette = os.path.join(self.directory, 'api.json.gz')
+        self.cc = FakeCloudController()
+        self.cc.add('apps', name='app', environment_json={'DB_PASSWORD': 'hunter2'})
+        self.cc.failures[('GET', '/v2/spaces')] = 403
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self):
+        recording = RecordingTransport(self.cc, self.cassette)
+        api = CfApi(api_host='api.example.com', login_host='login.example.com',
+                    username='user', password='hunter2', transport=recording)
+        apps = api.apps()
+        with self.assertRaises(urllib2.HTTPError):
+            api.spaces()
+        recording.save()
+        return apps
+
+    def test_cassette_holds_no_secrets(self):
+        self.record()
+        with gzip.open(self.cassette, 'rb') as f:
+            cassette = f.read()
+        self.assertNotIn('hunter2', cassette)
+        self.assertNotIn('"token"', cassette)
+        self.assertIn('DB_PASSWORD', cassette)
+
+    def test_replay_against_another_host(self):
+        apps = self.record()
+        replay = ReplayTransport(self.cassette)
+        api = CfApi(api_host='127.0.0.1:8080', login_host='127.0.0.1:8080',
+                    username='user', password='other', transport=replay)
+        replayed = api.apps()
+        self.assertEqual([a['entity']['name'] for a in replayed], ['app'])
+        self.assertEqual(replayed[0]['entity']['environment_json'], {'DB_PASSWORD': '<redacted>'})
+        self.assertEqual(replayed[0]['metadata'], apps[0]['metadata'])
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            api.spaces()
+        self.assertEqual(raised.exception.code, 403)
+        with self.assertRaises(CassetteMiss):
+            api.orgs()
+
+    def test_repeated_requests_replay_in_order(self):
+        recording = RecordingTransport(self.cc, self.cassette)
+        recording.request('https://api.example.com/v2/apps')
+        self.cc.add('apps', name='second')
+        recording.request('https://api.example.com/v2/apps')
+        recording.save()
+        replay = ReplayTransport(self.cassette)
+        counts = [replay.request('https://api.example.com/v2/apps')['total_results']
+                  for _ in range(3)]
+        self.assertEqual(counts, [1, 2, 2])
+
+
+class ScriptedTransport(object):
+    """Answers GETs after scripted delays, negative delays time out.
+
+    Attributes:
+        threads (list(str)): Name of the thread sending each request.
+    """
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def request(self, url, headers=None, params=None, body=None, method='GET'):
+        # pylint: disable=unused-argument,missing-docstring
+        with self._lock:
+            delay = self.delays.pop(0) if self.delays else 0
+            self.threads.append(threading.current_thread().name)
+        time.sleep(abs(delay))
+        if delay < 0:
+            raise socket.timeout('timed out')
+        return {'url': url, 'delay': delay}
+
+
+class HedgingTransportTest(unittest.TestCase):
+
+    def make(self, delays, **kwargs):
+        self.transport = ScriptedTransport(delays)
+        options = dict(max_extra=1, min_samples=5, window=5)
+        options.update(kwargs)
+        hedging = HedgingTransport(self.transport, **options)
+        for _ in range(5):
+            hedging._observe('/v2/apps', 0.05)
+        return hedging
+
+    def test_unhedged_endpoints_run_on_calling_thread(self):
+        hedging = self.make([0.0], min_samples=6)
+        self.assertEqual(hedging.request('https://api/v2/apps')['delay'], 0.0)
+        self.assertEqual(self.transport.threads, [threading.current_thread().name])
+        self.assertEqual(hedging.hedged, 0)
+
+    def test_fast_original_is_not_duplicated(self):
+        hedging = self.make([0.0])
+        self.assertEqual(hedging.request('https://api/v2/apps')['delay'], 0.0)
+        time.sleep(0.1)
+        self.assertEqual((hedging.hedged, len(self.transport.threads)), (0, 1))
+        self.assertLess(list(hedging._latencies['/v2/apps'])[-1], 0.05)
+
+    def test_fast_duplicate_wins(self):
+        hedging = self.make([0.3, 0.0])
+        start = time.time()
+        self.assertEqual(hedging.request('https://api/v2/apps')['delay'], 0.0)
+        self.assertLess(time.time() - start, 0.25)
+        self.assertEqual((hedging.hedged, hedging.won), (1, 1))
+        # The original did not finish, its latency is not recorded.
+        self.assertEqual(list(hedging._latencies['/v2/apps']), [0.05] * 5)
+
+    def test_slow_original_wins(self):
+        hedging = self.make([0.1, 0.3])
+        self.assertEqual(hedging.request('https://api/v2/apps')['delay'], 0.1)
+        self.assertEqual((hedging.hedged, hedging.won), (1, 0))
+        self.assertGreaterEqual(list(hedging._latencies['/v2/apps'])[-1], 0.1)
+
+    def test_duplicate_answers_for_failed_original(self):
+        # The original hangs past the hedge delay, then times out.
+        hedging = self.make([-0.2, 0.3])
+        self.assertEqual(hedging.request('https://api/v2/apps')['delay'], 0.3)
+        self.assertEqual((hedging.hedged, hedging.won), (1, 1))
+
+    def test_error_without_duplicate(self):
+        hedging = self.make([-0.0001])
+        with self.assertRaises(socket.timeout):
+            hedging.request('https://api/v2/apps')
+        self.assertEqual(hedging.hedged, 0)
+
+    def test_duplicates_are_capped(self):
+        hedging = self.make([0.2, 0.0], max_extra=0.5)
+        hedging.requests = 10
+        hedging.hedged = 6
+        hedging.request('https://api/v2/apps')
+        self.assertEqual(hedging.hedged, 6)
+        self.assertEqual(len(self.transport.threads), 1)
+
+    def test_writes_are_not_hedged(self):
+        hedging = self.make([0.2])
+        hedging.request('https://api/v2/apps', body={'name': 'x'}, method='POST')
+        self.assertEqual((hedging.requests, hedging.hedged), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,328 @@
+"""Tests for the Cloud Controller client."""
+# pylint: disable=invalid-name
+#
+# The invalid-name warnings are disabled to allow for the use of one
+# letter variables in anonymous instances or functions.
+import threading
+import time
+import unittest
+import urllib
+from cloudfoundryapi import CfApi, CfSession, SingleFlight
+from fakecc import FakeCloudController
+
+
+def make_api(cc, **kwargs):
+    """Return a client scoped to the org ``org`` and space ``space``."""
+    return CfApi(api_host='api.example.com', login_host='login.example.com',
+                 transport=cc, org_name='org', space_name='space', **kwargs)
+
+
+class FoundationTestCase(unittest.TestCase):
+    """Fake foundation with one org and space, a second space elsewhere."""
+
+    def setUp(self):
+        self.cc = FakeCloudController()
+        self.org = self.cc.add('organizations', name='org')['metadata']['guid']
+        self.space = self.cc.add('spaces', name='space',
+                                 organization_guid=self.org)['metadata']['guid']
+        other = self.cc.add('organizations', name='other')['metadata']['guid']
+        self.other_space = self.cc.add('spaces', name='space',
+                                       organization_guid=other)['metadata']['guid']
+
+    def add_instance(self, name, space=None, keys=()):
+        instance = self.cc.add('service_instances', name=name, space_guid=space or self.space,
+                               service_plan_guid='plan',
+                               last_operation={'type': 'create', 'state': 'succeeded'})
+        for key in keys:
+            self.cc.add('service_keys', name=key,
+                        service_instance_guid=instance['metadata']['guid'],
+                        credentials={'key': key, 'instance': name})
+        return instance
+
+
+class CfSessionTest(FoundationTestCase):
+
+    def setUp(self):
+        FoundationTestCase.setUp(self)
+        self.dev = self.cc.add('spaces', name='dev', organization_guid=self.org)['metadata']['guid']
+        self.session = CfSession(api_host='api.example.com', login_host='login.example.com',
+                                 username='user', password='secret', transport=self.cc,
+                                 max_workers=4)
+
+    def test_scopes_share_login_and_lookups(self):
+        space = self.session.scope('org', 'space')
+        dev = self.session.scope('org', 'dev', max_workers=2)
+        other = self.session.scope('other', 'space')
+        self.assertEqual((space.org_guid, space.space_guid), (self.org, self.space))
+        self.assertEqual(dev.space_guid, self.dev)
+        self.assertEqual(other.space_guid, self.other_space)
+        self.assertEqual((space.max_workers, dev.max_workers), (4, 2))
+        space.apps()
+        dev.apps()
+        self.assertEqual(self.cc.count('POST', '/oauth/token'), 1)
+        # One org lookup and one space listing per org.
+        self.assertEqual(len([c for c in self.cc.calls if c[1] == '/v2/organizations']), 2)
+        self.assertEqual(len([c for c in self.cc.calls if c[1].endswith('/spaces')]), 2)
+
+    def test_unknown_names(self):
+        self.assertEqual(self.session.resolve('missing', 'space'), ('', None))
+        self.assertEqual(self.session.resolve('org', 'missing'), (self.org, None))
+        self.assertEqual(self.session.resolve('org'), (self.org, None))
+
+    def test_forget_spaces(self):
+        self.session.resolve('org', 'space')
+        new = self.cc.add('spaces', name='new', organization_guid=self.org)['metadata']['guid']
+        self.assertEqual(self.session.resolve('org', 'new'), (self.org, None))
+        self.session.forget_spaces()
+        self.assertEqual(self.session.resolve('org', 'new'), (self.org, new))
+
+    def test_expired_token_is_refreshed(self):
+        api = self.session.scope()
+        api.orgs()
+        self.session._access_token_expire_time = 0  # pylint: disable=protected-access
+        api.orgs()
+        self.assertEqual(self.cc.count('POST', '/oauth/token'), 2)
+        self.assertEqual(self.session.bearer_token, 'Bearer token')
+
+    def test_login_can_be_disabled(self):
+        session = CfSession(api_host='127.0.0.1:8080', scheme='http', login=False,
+                            transport=self.cc)
+        session.scope().orgs()
+        self.assertEqual(self.cc.count('POST'), 0)
+        self.assertEqual(self.cc.count('GET', '/v2/organizations'), 1)
+
+
+class ServiceCredentialsTest(FoundationTestCase):
+
+    def setUp(self):
+        FoundationTestCase.setUp(self)
+        self.add_instance('db-1', keys=['testkey'])
+        self.add_instance('db-2', keys=['other', 'testkey'])
+        self.add_instance('cache')
+        self.add_instance('db-3', space=self.other_space, keys=['testkey'])
+        self.api = make_api(self.cc)
+
+    def test_get_service_credentials_returns_key_page(self):
+        page = self.api.get_service_credentials('db-1')
+        self.assertEqual(page['total_results'], 1)
+        key, = page['resources']
+        self.assertEqual(key['entity']['credentials'], {'key': 'testkey', 'instance': 'db-1'})
+
+    def test_get_service_credentials_matches_regex(self):
+        page = self.api.get_service_credentials('db-.*')
+        self.assertEqual(sorted(k['entity']['name'] for k in page['resources']),
+                         ['other', 'testkey'])
+        self.assertIsNone(self.api.get_service_credentials('db'))
+
+    def test_get_service_credentials_creates_missing_key(self):
+        page = self.api.get_service_credentials('cache')
+        self.assertEqual(page, {'total_results': 0, 'resources': []})
+        page = self.api.get_service_credentials('cache', create_missing=True)
+        self.assertEqual([k['entity']['name'] for k in page['resources']], ['testkey'])
+        # The new key is kept and reused.
+        self.api.get_service_credentials('cache', create_missing=True)
+        self.assertEqual(self.cc.count('POST', '/v2/service_keys'), 1)
+        self.assertEqual(self.cc.count('DELETE'), 0)
+
+    def test_service_credentials(self):
+        credentials = self.api.service_credentials(['db-.*', 'cache'])
+        self.assertEqual(credentials, {
+            'db-1': {'key': 'testkey', 'instance': 'db-1'},
+            'db-2': {'key': 'testkey', 'instance': 'db-2'},
+            'cache': None})
+        # One instance listing and one bulk key listing.
+        self.assertEqual(self.cc.count('GET', '/v2/service_instances'), 1)
+        self.assertEqual(self.cc.count('GET', '/v2/service_keys'), 1)
+
+    def test_keys_are_cached_per_session(self):
+        self.api.service_credentials(['db-1'])
+        self.api.scope('org', 'space').service_credentials(['db-1'])
+        self.assertEqual(self.cc.count('GET', '/v2/service_keys'), 1)
+
+    def test_delete_service_key(self):
+        instance = self.api.get_service_credentials('db-2')['resources'][0]
+        instance_guid = instance['entity']['service_instance_guid']
+        self.api.delete_service_key(instance_guid, 'other')
+        self.assertEqual([k['entity']['name'] for k in self.cc.collections['service_keys']
+                          if k['entity']['service_instance_guid'] == instance_guid],
+                         ['testkey'])
+        self.assertEqual(self.api.get_service_key(instance_guid, 'testkey')['total_results'], 1)
+
+    def test_user_delete_service(self):
+        self.api.user_delete_service('db-.*')
+        self.assertEqual(sorted(s['entity']['name'] for s in self.cc.collections['service_instances']),
+                         ['cache', 'db-3'])
+        self.assertEqual(len(self.cc.collections['service_keys']), 1)
+
+
+class AppEnvsTest(FoundationTestCase):
+
+    def test_app_envs(self):
+        for name in ('web', 'worker'):
+            app = self.cc.add('apps', name=name, space_guid=self.space)
+            self.cc.envs[app['metadata']['guid']] = {'system_env_json': {'VCAP_SERVICES': {
+                'user-provided': [{'instance_name': name + '-ups', 'credentials': {}}]}}}
+        self.cc.add('apps', name='web', space_guid=self.other_space)
+        envs = make_api(self.cc).app_envs(['web', 'worker', 'missing'])
+        self.assertEqual(sorted(envs), ['web', 'worker'])
+        self.assertEqual(envs['web']['system_env_json']['VCAP_SERVICES']['user-provided'][0]
+                         ['instance_name'], 'web-ups')
+        # One listing of the space's apps, then one /env request per app.
+        self.assertEqual(self.cc.count('GET', '/v2/apps'), 3)
+
+    def test_names_match_the_whole_app_name(self):
+        app = self.cc.add('apps', name='web-1', space_guid=self.space)
+        self.cc.envs[app['metadata']['guid']] = {'environment_json': {'N': '1'}}
+        self.cc.add('apps', name='web-10', space_guid=self.space)
+        envs = make_api(self.cc).app_envs(['web-1', 'web', r'web-\d'])
+        self.assertEqual(sorted(envs), ['web-1', r'web-\d'])
+        self.assertEqual(envs[r'web-\d'], {'environment_json': {'N': '1'}})
+
+
+class BatchedLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cc = FakeCloudController()
+        org = self.cc.add('organizations', name='org')['metadata']['guid']
+        self.spaces = [self.cc.add('spaces', name='space-{0}'.format(i),
+                                   organization_guid=org)['metadata']['guid']
+                       for i in range(250)]
+
+    def in_filters(self):
+        return [c[2]['q'][0] for c in self.cc.calls if c[1] == '/v2/spaces']
+
+    def test_batches_fit_a_page(self):
+        spaces = make_api(self.cc).spaces_by_guid(self.spaces + ['unknown'], records=True)
+        self.assertEqual(sorted(spaces), sorted(self.spaces))
+        self.assertEqual(spaces[self.spaces[7]].name, 'space-7')
+        self.assertEqual(len(self.in_filters()), 3)
+
+    def test_batches_fit_the_url_length(self):
+        api = make_api(self.cc, max_url_length=1000)
+        found = api.resources_in('/v2/spaces', 'guid', self.spaces * 2)
+        self.assertEqual(sorted(r['metadata']['guid'] for r in found), sorted(self.spaces))
+        filters = self.in_filters()
+        self.assertGreater(len(filters), 3)
+        for q in filters:
+            self.assertLessEqual(len('https://api.example.com/v2/spaces?' + urllib.urlencode(
+                {'q': q, 'results-per-page': 100})), 1000)
+
+    def test_no_values(self):
+        self.assertEqual(make_api(self.cc).orgs_by_guid([]), {})
+        self.assertEqual(self.in_filters(), [])
+
+
+class EventWindowsTest(unittest.TestCase):
+
+    DAY = 1792281600  # 2026-10-18T00:00:00Z
+
+    def setUp(self):
+        self.cc = FakeCloudController()
+        # Listed newest day first, the windows put them back in order.
+        for timestamp in ('2026-10-20T08:00:00Z', '2026-10-18T09:00:00Z', '2026-10-18T09:30:00Z',
+                          '2026-10-18T23:00:00Z'):
+            self.cc.add('events', type='audit.app.update', timestamp=timestamp)
+        self.api = make_api(self.cc)
+
+    def test_empty_days_are_dropped(self):
+        windows = self.api.event_windows(self.DAY + 3600, self.DAY + 3 * 86400)
+        self.assertEqual(windows, [(self.DAY + 3600, self.DAY + 86400),
+                                   (self.DAY + 2 * 86400, self.DAY + 3 * 86400)])
+
+    def test_busy_days_are_split_into_hours(self):
+        windows = self.api.event_windows(self.DAY, self.DAY + 86400, max_events=2)
+        self.assertEqual(len(windows), 24)
+        self.assertEqual(windows[9], (self.DAY + 9 * 3600, self.DAY + 10 * 3600))
+
+    def test_events_by_window_in_time_order(self):
+        events = [e.timestamp for window in self.api.events_by_window(
+            self.DAY, self.DAY + 3 * 86400, records=True, max_events=2) for e in window]
+        self.assertEqual(events, ['2026-10-18T09:00:00Z', '2026-10-18T09:30:00Z',
+                                  '2026-10-18T23:00:00Z', '2026-10-20T08:00:00Z'])
+
+    def test_extra_filters_are_kept(self):
+        self.cc.add('events', type='audit.space.create', timestamp='2026-10-18T10:00:00Z')
+        windows = list(self.api.events_by_window(self.DAY, self.DAY + 86400,
+                                                 filters={'q': 'type:audit.space.create'}))
+        self.assertEqual([[e['entity']['type'] for e in w] for w in windows],
+                         [['audit.space.create']])
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.sent = []
+        self.error = None
+
+    def request(self, url, headers=None, params=None, body=None, method='GET'):
+        # pylint: disable=unused-argument
+        self.sent.append((method, url))
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {'url': url}
+
+    def run_concurrently(self, calls):
+        """Run the calls on threads once all followers are waiting."""
+        coalesced = self.single_flight.wrap(self.request)
+        results = [None] * len(calls)
+
+        def call(i):
+            args, kwargs = calls[i]
+            try:
+                results[i] = coalesced(*args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-except
+                results[i] = e
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(calls))]
+        for thread in threads:
+            thread.start()
+        gets = len([c for c in calls if c[1].get('method', 'GET') == 'GET'])
+        deadline = time.time() + 5
+        while self.single_flight.requests < gets and time.time() < deadline:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_gets_share_one_request(self):
+        results = self.run_concurrently([(('/v2/apps',), {'params': {'page': 1}})] * 4)
+        self.assertEqual(self.sent, [('GET', '/v2/apps')])
+        self.assertEqual(results, [{'url': '/v2/apps'}] * 4)
+        self.assertIs(results[0], results[3])
+        self.assertEqual((self.single_flight.requests, self.single_flight.saved), (4, 3))
+
+    def test_distinct_requests_are_sent(self):
+        self.run_concurrently([
+            (('/v2/apps',), {'headers': {'Authorization': 'bearer a'}}),
+            (('/v2/apps',), {'headers': {'Authorization': 'bearer b'}}),
+            (('/v2/apps',), {'params': {'page': 2}}),
+            (('/v2/apps',), {'method': 'DELETE'}),
+        ])
+        self.assertEqual(len(self.sent), 4)
+        self.assertEqual(self.single_flight.saved, 0)
+
+    def test_errors_reach_every_caller(self):
+        self.error = ValueError('boom')
+        results = self.run_concurrently([(('/v2/apps',), {})] * 3)
+        self.assertEqual(len(self.sent), 1)
+        self.assertTrue(all(r is self.error for r in results))
+
+    def test_later_requests_are_sent_again(self):
+        self.release.set()
+        coalesced = self.single_flight.wrap(self.request)
+        coalesced('/v2/apps')
+        coalesced('/v2/apps')
+        self.assertEqual(len(self.sent), 2)
+
+    def test_cfapi_coalescing_can_be_disabled(self):
+        cc = FakeCloudController()
+        self.assertIsNotNone(make_api(cc).session.single_flight)
+        self.assertIsNone(make_api(cc, coalesce=False).session.single_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()